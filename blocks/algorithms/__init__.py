@@ -1,6 +1,7 @@
 """Training algorithms."""
 import logging
 import itertools
+import operator
 from abc import ABCMeta, abstractmethod
 from collections import OrderedDict
 
@@ -8,6 +9,7 @@ import theano
 from six import add_metaclass
 from theano import tensor
 
+from blocks import compilation
 from blocks.graph import ComputationGraph
 from blocks.utils import named_copy, shared_floatx
 from blocks.theano_expressions import L2_norm
@@ -160,6 +162,16 @@ class GradientDescent(DifferentiableCostMinimizer):
         A dictionary mapping a parameter to an expression for the cost's
         gradient with respect to the parameter. If ``None``, the gradient
         are taken automatically using :func:`theano.gradient.grad`.
+    steps_per_call : int, optional
+        The number of steps to do for each batch. If larger than 1, the
+        data of every batch must have an extra leading axis of this
+        length, and one step is done for each slice along that axis,
+        within a single call to a compiled function (using
+        :func:`theano.scan`). This removes most of the Python overhead of
+        each step when training small models. Such stacked batches can be
+        created by wrapping a data stream of batches in a
+        :class:`.BatchDataStream` with ``strict=True``. The main loop
+        counts each step as an iteration. 1 by default.
 
     Attributes
     ----------
@@ -168,9 +180,33 @@ class GradientDescent(DifferentiableCostMinimizer):
     step_rule : instance of :class:`StepRule`
         The step rule.
 
+    Notes
+    -----
+    All the updates of the algorithm, including those added by
+    extensions such as :class:`.TrainingDataMonitoring`, are done at
+    every step, so that the monitored values are aggregated over all the
+    steps of a batch. The extensions themselves are only called once per
+    batch: conditions such as
+    :meth:`~.SimpleExtension.invoke_every_n_batches` are fulfilled after
+    the batch during which the number of iterations was reached.
+
+    The parameters are updated by separate updates, not as views of a
+    single flat buffer. Unless an update happens to be done in place,
+    Theano gives the updated shared variable a newly allocated array, so
+    views of a flat buffer aliased to the parameters with ``borrow=True``
+    would be detached by the first update. The parallel algorithms of
+    :mod:`blocks.algorithms.parallel` can alias parameters to shared
+    buffers only because their workers alias them again before every
+    call, or change the buffers in place outside of Theano.
+
     """
-    def __init__(self, step_rule=None, gradients=None, **kwargs):
+    def __init__(self, step_rule=None, gradients=None, steps_per_call=1,
+                 **kwargs):
         super(GradientDescent, self).__init__(**kwargs)
+        if steps_per_call < 1:
+            raise ValueError("at least one step must be done per call")
+        self.steps_per_call = steps_per_call
+        self._batch_getter = None
         self.gradients = gradients
         if not self.gradients:
             logger.info("Taking the cost gradient")
@@ -193,17 +229,77 @@ class GradientDescent(DifferentiableCostMinimizer):
         # reproducibility.
         for param in self.params:
             all_updates.append((param, param + self.steps[param]))
-        self._function = theano.function(self.inputs, [], updates=all_updates)
+        all_updates.extend(self.step_rule.additional_updates())
+        if self.steps_per_call == 1:
+            self._function = compilation.function(self.inputs, [],
+                                                  updates=all_updates)
+        else:
+            self._function = self._compile_steps(all_updates)
+        self._input_names = [v.name for v in self.inputs]
         logger.info("The training algorithm is initialized")
 
-    def process_batch(self, batch):
-        if not set(batch.keys()) == set([v.name for v in self.inputs]):
+    def _compile_steps(self, updates):
+        """Compile a function doing several steps on stacked inputs."""
+        stacked_inputs = [
+            tensor.TensorType(v.dtype, (False,) + v.broadcastable)(v.name)
+            for v in self.inputs]
+        variables = [variable for variable, _ in updates]
+
+        def step(*inputs):
+            values = theano.clone([value for _, value in updates],
+                                  replace=dict(zip(self.inputs, inputs)))
+            return OrderedDict(zip(variables, values))
+        _, step_updates = theano.scan(
+            step, sequences=stacked_inputs,
+            n_steps=None if stacked_inputs else self.steps_per_call)
+        return compilation.function(stacked_inputs, [], updates=step_updates)
+
+    def _order_batch(self, batch):
+        """Order the data of a batch like the inputs of the graph.
+
+        The sources of the first batch are checked against the names of
+        the inputs. The data of the following batches is then fetched by
+        a getter built once from these names, which fails if a source is
+        missing.
+
+        """
+        getter = getattr(self, '_batch_getter', None)
+        if getter is None:
+            if set(batch) != set(self._input_names):
+                raise ValueError("The names of the input variables of your"
+                                 " computation graph must correspond to the"
+                                 " data sources.")
+            getter = self._batch_getter = _batch_getter(self._input_names)
+        try:
+            return getter(batch)
+        except KeyError:
             raise ValueError("The names of the input variables of your"
                              " computation graph must correspond to the"
                              " data sources.")
-        ordered_batch = [batch[v.name] for v in self.inputs]
+
+    def process_batch(self, batch):
+        ordered_batch = self._order_batch(batch)
+        if self.steps_per_call > 1 and any(
+                len(data) != self.steps_per_call for data in ordered_batch):
+            raise ValueError("The data must have a leading axis of length"
+                             " {}".format(self.steps_per_call))
         self._function(*ordered_batch)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_batch_getter'] = None
+        return state
+
+
+def _batch_getter(names):
+    """Return a function fetching the data of a batch in a given order."""
+    if not names:
+        return lambda batch: []
+    getter = operator.itemgetter(*names)
+    if len(names) == 1:
+        return lambda batch: [getter(batch)]
+    return lambda batch: list(getter(batch))
+
 
 @add_metaclass(ABCMeta)
 class StepRule(object):
@@ -285,6 +381,185 @@ class SteepestDescent(StepRule):
         return -self.learning_rate * gradient
 
 
+class StatefulStepRule(StepRule):
+    """A step rule that keeps a state for each parameter.
+
+    The state is stored in shared variables allocated along with each
+    parameter when its step is computed. The updates of the state are
+    returned by :meth:`additional_updates`, and are done at the same time
+    as the parameter updates.
+
+    """
+    def __init__(self):
+        self._updates = []
+
+    def _allocate(self, param, suffix):
+        """Allocate a state variable with the shape of a parameter."""
+        name = '{}_{}'.format(param.name, suffix) if param.name else suffix
+        return shared_floatx(param.get_value() * 0, name=name)
+
+    def additional_updates(self):
+        return list(self._updates)
+
+
+class Momentum(StatefulStepRule):
+    """Accumulates a velocity from the steps, with momentum.
+
+    The step is ``momentum * velocity - learning_rate * gradient``, and
+    the velocity of each parameter is the previous step.
+
+    Parameters
+    ----------
+    learning_rate : float, optional
+        The learning rate by which the gradient is multiplied. 1 by
+        default.
+    momentum : float, optional
+        The fraction of the previous step kept. 0 by default.
+
+    Attributes
+    ----------
+    learning_rate : :class:`~tensor.TensorSharedVariable`
+        The shared variable storing the learning rate used.
+    momentum : :class:`~tensor.TensorSharedVariable`
+        The shared variable storing the momentum used.
+
+    """
+    def __init__(self, learning_rate=1.0, momentum=0.):
+        super(Momentum, self).__init__()
+        self.learning_rate = shared_floatx(learning_rate)
+        self.momentum = shared_floatx(momentum)
+
+    def compute_step(self, param, gradient):
+        velocity = self._allocate(param, 'velocity')
+        step = self.momentum * velocity - self.learning_rate * gradient
+        self._updates.append((velocity, step))
+        return step
+
+
+class AdaGrad(StatefulStepRule):
+    """Scales the learning rate by the accumulated squared gradients.
+
+    Parameters
+    ----------
+    learning_rate : float, optional
+        The learning rate. 0.002 by default.
+    epsilon : float, optional
+        Added to the root of the accumulated squared gradients to avoid
+        division by zero. 1e-6 by default.
+
+    Notes
+    -----
+    For more information, see [ADAGRAD]_.
+
+    .. [ADAGRAD] Duchi J, Hazan E, Singer Y.,
+       *Adaptive subgradient methods for online learning and
+       stochastic optimization*,
+       http://www.jmlr.org/papers/volume12/duchi11a/duchi11a.pdf
+
+    """
+    def __init__(self, learning_rate=0.002, epsilon=1e-6):
+        super(AdaGrad, self).__init__()
+        self.learning_rate = shared_floatx(learning_rate)
+        self.epsilon = epsilon
+
+    def compute_step(self, param, gradient):
+        squares = self._allocate(param, 'squares')
+        new_squares = squares + tensor.sqr(gradient)
+        self._updates.append((squares, new_squares))
+        return (-self.learning_rate * gradient /
+                (tensor.sqrt(new_squares) + self.epsilon))
+
+
+class RMSProp(StatefulStepRule):
+    """Scales the gradient by a running average of its recent magnitude.
+
+    Parameters
+    ----------
+    learning_rate : float, optional
+        The learning rate. 1 by default.
+    decay_rate : float, optional
+        How fast the running average of the squared gradients decays.
+        0.9 by default.
+    epsilon : float, optional
+        Added to the root of the average to avoid division by zero. 1e-6
+        by default.
+
+    Notes
+    -----
+    For more information, see [RMSProp]_.
+
+    .. [RMSProp] Geoff Hinton, *Neural Networks for Machine Learning*,
+       lecture 6a,
+       http://cs.toronto.edu/~tijmen/csc321/slides/lecture_slides_lec6.pdf
+
+    """
+    def __init__(self, learning_rate=1.0, decay_rate=0.9, epsilon=1e-6):
+        super(RMSProp, self).__init__()
+        self.learning_rate = shared_floatx(learning_rate)
+        self.decay_rate = shared_floatx(decay_rate)
+        self.epsilon = epsilon
+
+    def compute_step(self, param, gradient):
+        mean_square = self._allocate(param, 'mean_square')
+        new_mean_square = (self.decay_rate * mean_square +
+                           (1 - self.decay_rate) * tensor.sqr(gradient))
+        self._updates.append((mean_square, new_mean_square))
+        return (-self.learning_rate * gradient /
+                (tensor.sqrt(new_mean_square) + self.epsilon))
+
+
+class Adam(StatefulStepRule):
+    """Adam optimizer.
+
+    Keeps running averages of the gradients and of the squared gradients,
+    and scales the former by the root of the latter, correcting both for
+    their initialization at zero.
+
+    Parameters
+    ----------
+    learning_rate : float, optional
+        The learning rate. 0.002 by default.
+    beta1 : float, optional
+        The decay rate of the average of the gradients. 0.9 by default.
+    beta2 : float, optional
+        The decay rate of the average of the squared gradients. 0.999 by
+        default.
+    epsilon : float, optional
+        Added to the root of the average of the squared gradients to
+        avoid division by zero. 1e-8 by default.
+
+    Notes
+    -----
+    For more information, see [ADAM]_.
+
+    .. [ADAM] Diederik Kingma, Jimmy Ba, *Adam: A Method for Stochastic
+       Optimization*, http://arxiv.org/abs/1412.6980
+
+    """
+    def __init__(self, learning_rate=0.002, beta1=0.9, beta2=0.999,
+                 epsilon=1e-8):
+        super(Adam, self).__init__()
+        self.learning_rate = shared_floatx(learning_rate)
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.time = shared_floatx(0., name='adam_time')
+        self._updates.append((self.time, self.time + 1))
+
+    def compute_step(self, param, gradient):
+        mean = self._allocate(param, 'mean')
+        variance = self._allocate(param, 'variance')
+        time = self.time + 1
+        new_mean = self.beta1 * mean + (1 - self.beta1) * gradient
+        new_variance = (self.beta2 * variance +
+                        (1 - self.beta2) * tensor.sqr(gradient))
+        self._updates.extend([(mean, new_mean), (variance, new_variance)])
+        corrected_mean = new_mean / (1 - self.beta1 ** time)
+        corrected_variance = new_variance / (1 - self.beta2 ** time)
+        return (-self.learning_rate * corrected_mean /
+                (tensor.sqrt(corrected_variance) + self.epsilon))
+
+
 class GradientClipping(StepRule):
     """Clips the total gradient to make it not exceed a threshold.
 
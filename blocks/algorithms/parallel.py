@@ -0,0 +1,443 @@
+"""Training algorithms using several local processes."""
+import ctypes
+import logging
+import multiprocessing
+import time
+import traceback
+
+import numpy
+import theano
+from six.moves.queue import Full
+from theano import tensor
+
+from blocks import compilation
+from blocks.algorithms import GradientDescent
+from blocks.utils import fork_context, ignore_interrupts
+
+logger = logging.getLogger(__name__)
+
+
+def _shared_array(shape, dtype):
+    """Allocate an array in memory shared with forked processes."""
+    dtype = numpy.dtype(dtype)
+    size = int(numpy.prod(shape))
+    buffer_ = multiprocessing.RawArray(ctypes.c_char,
+                                       max(size * dtype.itemsize, 1))
+    return numpy.frombuffer(buffer_, dtype=dtype, count=size).reshape(shape)
+
+
+def _alias_params(params, param_buffers):
+    """Make the values of parameters point to shared memory."""
+    for param, buffer_ in zip(params, param_buffers):
+        param.set_value(buffer_, borrow=True)
+
+
+def _worker_exited(worker):
+    """Return the error to raise when a worker exited unexpectedly."""
+    worker.join(1)
+    return RuntimeError("A worker exited unexpectedly with code "
+                        "{}".format(worker.exitcode))
+
+
+def _gradient_worker(connection, function, params, param_buffers,
+                     gradient_buffers):
+    """Compute gradients on the shards of data sent by the master."""
+    ignore_interrupts()
+    while True:
+        shard = connection.recv()
+        if shard is None:
+            break
+        try:
+            _alias_params(params, param_buffers)
+            gradients = function(*shard)
+            for buffer_, gradient in zip(gradient_buffers, gradients):
+                buffer_[...] = gradient
+            connection.send(None)
+        except Exception:
+            connection.send(traceback.format_exc())
+
+
+def _hogwild_worker(batches, connection, function, param_buffers):
+    """Apply the steps computed on batches to the shared parameters.
+
+    For every batch the worker sends through its pipe either None, or the
+    traceback of the error raised while processing it, so that the main
+    process can count the batches done without waiting blindly.
+
+    """
+    ignore_interrupts()
+    while True:
+        batch = batches.get()
+        if batch is None:
+            break
+        try:
+            steps = function(*batch)
+            for buffer_, step in zip(param_buffers, steps):
+                buffer_ += step
+            connection.send(None)
+        except Exception:
+            connection.send(traceback.format_exc())
+
+
+class DataParallelGradientDescent(GradientDescent):
+    """Gradient descent with gradients computed by several processes.
+
+    Each batch is split into as many shards as there are workers. The
+    workers, which are forked from the main process when the algorithm is
+    initialized, compute the gradients of the cost on their shard of the
+    batch in parallel, and store them in shared memory. The main process
+    averages the gradients, weighted by the size of the shards, and then
+    applies the step rule to the averaged gradients. The parameters are
+    shared with the workers through shared memory as well.
+
+    Since everything else happens in the main process, the main loop and
+    its extensions work exactly as with :class:`.GradientDescent`.
+
+    Parameters
+    ----------
+    num_workers : int, optional
+        The number of worker processes. By default the number of CPUs.
+    batch_axis : int or dict, optional
+        The axis along which the examples of the batch are laid out, by
+        which the data is split between the workers. Either a single axis
+        for all the sources, or a dictionary mapping source names to axes,
+        the sources missing from it being split along their first axis.
+        By default 0. Time-major sequences, laid out as (time, batch,
+        ...), need an axis of 1.
+
+    See :class:`.GradientDescent` for the remaining parameters.
+
+    Notes
+    -----
+    The averaged gradient equals the gradient on the whole batch only if
+    the cost is an average over the examples of the batch, which is
+    normally the case.
+
+    Updates added to the algorithm (e.g. by
+    :class:`.TrainingDataMonitoring`) are computed in the main process on
+    the whole batch. Expressions depending on the gradients, such as
+    :attr:`total_gradient_norm`, use the averaged gradients.
+
+    The workers are started again when needed after the algorithm is
+    unpickled.
+
+    """
+    def __init__(self, num_workers=None, batch_axis=0, **kwargs):
+        super(DataParallelGradientDescent, self).__init__(**kwargs)
+        if self.steps_per_call != 1:
+            raise ValueError("only one step per call is supported")
+        self.num_workers = (num_workers if num_workers
+                            else multiprocessing.cpu_count())
+        self.batch_axis = batch_axis
+        self._workers = None
+
+    def initialize(self):
+        logger.info("Initializing the training algorithm")
+        gradients = [tensor.as_tensor_variable(self.gradients[param])
+                     for param in self.params]
+        self._gradient_function = compilation.function(self.inputs,
+                                                       gradients)
+
+        # The steps are computed from placeholders for the averaged
+        # gradients instead of from the gradient expressions
+        self._averaged_gradients = [gradient.type() for gradient in gradients]
+        updates = (list(self.updates) +
+                   [(param, param + self.steps[param])
+                    for param in self.params] +
+                   self.step_rule.additional_updates())
+        values = theano.clone(
+            [value for _, value in updates],
+            replace=dict(zip(gradients, self._averaged_gradients)))
+        self._function = compilation.function(
+            self.inputs + self._averaged_gradients, [],
+            updates=list(zip([variable for variable, _ in updates], values)),
+            on_unused_input='ignore')
+        self._input_names = [v.name for v in self.inputs]
+        if isinstance(self.batch_axis, dict):
+            self._batch_axes = [self.batch_axis.get(name, 0)
+                                for name in self._input_names]
+        else:
+            self._batch_axes = [self.batch_axis] * len(self._input_names)
+        self._start_workers()
+        logger.info("The training algorithm is initialized")
+
+    def _start_workers(self):
+        self._param_buffers = []
+        for param in self.params:
+            value = param.get_value(borrow=True)
+            buffer_ = _shared_array(value.shape, value.dtype)
+            buffer_[...] = value
+            self._param_buffers.append(buffer_)
+        self._gradient_buffers = [
+            [_shared_array(buffer_.shape, gradient.dtype)
+             for buffer_, gradient in zip(self._param_buffers,
+                                          self._averaged_gradients)]
+            for _ in range(self.num_workers)]
+        self._workers = []
+        self._connections = []
+        for gradient_buffers in self._gradient_buffers:
+            connection, worker_connection = fork_context.Pipe()
+            worker = fork_context.Process(
+                target=_gradient_worker,
+                args=(worker_connection, self._gradient_function,
+                      self.params, self._param_buffers, gradient_buffers))
+            worker.daemon = True
+            worker.start()
+            worker_connection.close()
+            self._workers.append(worker)
+            self._connections.append(connection)
+
+    def process_batch(self, batch):
+        if self._workers is None:
+            self._start_workers()
+        ordered_batch = self._order_batch(batch)
+        if ordered_batch:
+            if len(set(numpy.shape(data)[axis] for data, axis in
+                       zip(ordered_batch, self._batch_axes))) > 1:
+                raise ValueError("The sources have different numbers of "
+                                 "examples along their batch axes.")
+            shards = list(zip(*[
+                numpy.array_split(data, self.num_workers, axis=axis)
+                for data, axis in zip(ordered_batch, self._batch_axes)]))
+            sizes = [shard[0].shape[self._batch_axes[0]] for shard in shards]
+        else:
+            shards, sizes = [[]], [1]
+        workers = [i for i, size in enumerate(sizes) if size]
+        errors = []
+        i = None
+        try:
+            for i in workers:
+                self._connections[i].send(list(shards[i]))
+            for i in workers:
+                errors.append(self._connections[i].recv())
+        except (EOFError, IOError):
+            # The pipe of a worker is closed when it dies, e.g. killed by
+            # the system for lack of memory
+            raise _worker_exited(self._workers[i])
+        for error in errors:
+            if error is not None:
+                raise RuntimeError("A worker failed to compute the "
+                                   "gradients:\n" + error)
+
+        total_size = float(sum(sizes))
+        averaged_gradients = []
+        for j, buffer_ in enumerate(self._gradient_buffers[0]):
+            averaged_gradient = numpy.zeros_like(buffer_)
+            for i in workers:
+                averaged_gradient += (sizes[i] / total_size *
+                                      self._gradient_buffers[i][j])
+            averaged_gradients.append(averaged_gradient)
+        self._function(*(ordered_batch + averaged_gradients))
+
+        for param, buffer_ in zip(self.params, self._param_buffers):
+            buffer_[...] = param.get_value(borrow=True)
+
+    def close(self):
+        """Stop the worker processes.
+
+        The workers that can't be asked to stop, e.g. because a worker
+        died in the middle of a batch, are terminated.
+
+        """
+        if self._workers is None:
+            return
+        for connection, worker in zip(self._connections, self._workers):
+            try:
+                if worker.is_alive():
+                    connection.send(None)
+                    worker.join()
+            except IOError:
+                pass
+            finally:
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+        self._workers = None
+
+    def __getstate__(self):
+        state = super(DataParallelGradientDescent, self).__getstate__()
+        for attr in ['_param_buffers', '_gradient_buffers', '_connections']:
+            state.pop(attr, None)
+        state['_workers'] = None
+        return state
+
+
+class HogwildGradientDescent(GradientDescent):
+    """Asynchronous gradient descent on parameters in shared memory.
+
+    The values of the parameters are moved to shared memory, and several
+    worker processes, forked from the main process when the algorithm is
+    initialized, update them without any locking [Hogwild]_. The batches
+    passed to :meth:`process_batch` are put in a queue from which the
+    workers take them. Each worker computes the steps on the batch with
+    the current values of the parameters and adds them to the shared
+    parameters in place.
+
+    The main process, which runs the main loop, only reads the batches
+    and distributes them, so that its extensions (e.g. monitoring and
+    checkpointing) work as usual and see the parameters being trained.
+
+    Parameters
+    ----------
+    num_workers : int, optional
+        The number of worker processes. By default the number of CPUs.
+    queue_size : int, optional
+        The number of batches that can wait for a worker. When the queue
+        is full, :meth:`process_batch` waits. By default twice the number
+        of workers.
+    poll_interval : float, optional
+        The number of seconds between checks that the workers are still
+        alive while waiting for them. By default 0.1.
+
+    See :class:`.GradientDescent` for the remaining parameters.
+
+    Notes
+    -----
+    The steps of stateful step rules (e.g. :class:`.Momentum`) are
+    computed with a separate state in each worker.
+
+    Updates added to the algorithm (e.g. by
+    :class:`.TrainingDataMonitoring`) are computed in the main process,
+    on the current values of the parameters.
+
+    The parameters are changed by the workers at any time. Call
+    :meth:`synchronize` to wait until all the batches given so far have
+    been processed, e.g. before evaluating a model. The main loop does so
+    before the end of every epoch and of training, and so do the
+    :class:`.Dump` and :class:`.SerializeMainLoop` extensions before
+    saving. The workers are stopped by :meth:`close`, which the main
+    loop calls after training, and started again if training continues.
+    If a worker dies (e.g. killed by the system for lack of memory),
+    waiting for it raises a :class:`RuntimeError` instead of hanging.
+
+    .. [Hogwild] Feng Niu, Benjamin Recht, Christopher Re, Stephen J.
+       Wright, *HOGWILD!: A Lock-Free Approach to Parallelizing Stochastic
+       Gradient Descent*, http://arxiv.org/abs/1106.5730
+
+    """
+    def __init__(self, num_workers=None, queue_size=None, poll_interval=0.1,
+                 **kwargs):
+        super(HogwildGradientDescent, self).__init__(**kwargs)
+        if self.steps_per_call != 1:
+            raise ValueError("only one step per call is supported")
+        self.num_workers = (num_workers if num_workers
+                            else multiprocessing.cpu_count())
+        self.queue_size = (queue_size if queue_size
+                           else 2 * self.num_workers)
+        self.poll_interval = poll_interval
+        self._workers = None
+
+    def initialize(self):
+        logger.info("Initializing the training algorithm")
+        self._step_function = compilation.function(
+            self.inputs, [self.steps[param] for param in self.params],
+            updates=self.step_rule.additional_updates())
+        self._function = (compilation.function(self.inputs, [],
+                                               updates=self.updates)
+                          if self.updates else None)
+        self._input_names = [v.name for v in self.inputs]
+        self._start_workers()
+        logger.info("The training algorithm is initialized")
+
+    def _start_workers(self):
+        self._param_buffers = []
+        for param in self.params:
+            value = param.get_value(borrow=True)
+            buffer_ = _shared_array(value.shape, value.dtype)
+            buffer_[...] = value
+            self._param_buffers.append(buffer_)
+        _alias_params(self.params, self._param_buffers)
+        self._batches = fork_context.Queue(self.queue_size)
+        self._pending = 0
+        self._connections = []
+        self._workers = []
+        for _ in range(self.num_workers):
+            connection, worker_connection = fork_context.Pipe(duplex=False)
+            worker = fork_context.Process(
+                target=_hogwild_worker,
+                args=(self._batches, worker_connection, self._step_function,
+                      self._param_buffers))
+            worker.daemon = True
+            worker.start()
+            worker_connection.close()
+            self._connections.append(connection)
+            self._workers.append(worker)
+
+    def _check_errors(self):
+        """Count the batches done and raise the errors of the workers."""
+        for connection, worker in zip(self._connections, self._workers):
+            while connection.poll():
+                try:
+                    error = connection.recv()
+                except EOFError:
+                    raise _worker_exited(worker)
+                self._pending -= 1
+                if error is not None:
+                    raise RuntimeError("A worker failed to process a "
+                                       "batch:\n" + error)
+
+    def _check_workers(self):
+        """Raise an error if a worker has exited."""
+        for worker in self._workers:
+            if not worker.is_alive():
+                raise _worker_exited(worker)
+
+    def _wait(self):
+        """Wait until the workers are done, checking they are alive."""
+        while True:
+            # The workers are checked first, so that the results sent by a
+            # worker before it exited are received
+            workers_alive = all(worker.is_alive() for worker in self._workers)
+            self._check_errors()
+            if not self._pending:
+                return
+            if not workers_alive:
+                self._check_workers()
+            time.sleep(self.poll_interval)
+
+    def process_batch(self, batch):
+        if self._workers is None:
+            self._start_workers()
+        self._check_errors()
+        ordered_batch = self._order_batch(batch)
+        if self._function is not None:
+            self._function(*ordered_batch)
+        while True:
+            try:
+                self._batches.put(ordered_batch, timeout=self.poll_interval)
+                break
+            except Full:
+                self._check_workers()
+        self._pending += 1
+
+    def synchronize(self):
+        """Wait until all the batches given so far have been processed."""
+        if self._workers is not None:
+            self._wait()
+
+    def close(self):
+        """Process the remaining batches and stop the workers.
+
+        If a worker failed, the remaining workers are terminated.
+
+        """
+        if self._workers is None:
+            return
+        try:
+            self._wait()
+            for _ in self._workers:
+                self._batches.put(None)
+            for worker in self._workers:
+                worker.join()
+        finally:
+            for worker in self._workers:
+                if worker.is_alive():
+                    worker.terminate()
+            self._workers = None
+
+    def __getstate__(self):
+        state = super(HogwildGradientDescent, self).__getstate__()
+        for attr in ['_param_buffers', '_batches', '_connections']:
+            state.pop(attr, None)
+        state['_workers'] = None
+        return state
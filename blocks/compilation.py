@@ -0,0 +1,264 @@
+"""Compilation of Theano functions with a persistent cache.
+
+Compiling the Theano functions of a large model, e.g. in
+:meth:`.GradientDescent.initialize`, can take minutes. When the
+``function_cache_path`` configuration option is set (see
+:mod:`blocks.config_parser`), the functions compiled by :func:`function`
+are stored in that directory, and compiling a function with the same
+graph again, e.g. when relaunching an identical experiment, only loads
+the already optimized function from the disk.
+
+The cache files are keyed by :func:`graph_hash`, a hash of the structure
+of the graph, of the types and names of its variables, of the arguments
+given to :func:`function` and of the relevant Theano flags. The values of
+the shared variables are not part of the key: a function loaded from the
+cache uses the shared variables of the graph it is given. Note that the
+cache files do contain the values the shared variables had when the
+function was compiled, so that they are as large as the parameters.
+Functions whose ops have attributes that can't be described reliably
+are compiled without the cache.
+
+.. warning::
+
+   The cache files are loaded with :mod:`pickle`, which can execute
+   arbitrary code. Only use a cache directory that no untrusted user can
+   write to.
+
+"""
+import hashlib
+import logging
+import os
+import types
+from collections import Mapping
+
+import numpy
+import six
+import theano
+from six.moves import cPickle
+from theano.compile import SharedVariable
+from theano.compile.pfunc import rebuild_collect_shared
+from theano.gof import Op, Type
+from theano.gof.graph import (Constant, Variable, inputs as graph_inputs,
+                              io_toposort)
+
+from blocks.config_parser import config
+from blocks.utils import secure_write
+
+logger = logging.getLogger(__name__)
+
+# The Theano flags that change the compiled function
+THEANO_FLAGS = ['floatX', 'device', 'mode', 'optimizer', 'linker',
+                'optimizer_excluding', 'optimizer_including', 'cast_policy']
+
+# The keyword arguments of :func:`theano.function` that can be cached
+CACHEABLE_ARGUMENTS = ['on_unused_input', 'allow_input_downcast', 'name']
+
+
+def _signature(value):
+    """Describe an attribute of an op, including inner graphs.
+
+    Raises
+    ------
+    TypeError
+        If the attribute is of a type that can't be described reliably.
+        Functions using such ops are not cached.
+
+    """
+    if isinstance(value, Variable):
+        return _graph_signature([value])
+    if isinstance(value, Op):
+        return _op_signature(value)
+    if isinstance(value, (list, tuple)):
+        return [_signature(element) for element in value]
+    # The items are sorted, so that the description doesn't depend on
+    # the arbitrary iteration order of dictionaries and sets
+    if isinstance(value, Mapping):
+        return sorted((repr(_signature(key)), _signature(element))
+                      for key, element in value.items())
+    if isinstance(value, (set, frozenset)):
+        return ('set', sorted(repr(_signature(element))
+                              for element in value))
+    if isinstance(value, (six.string_types, six.integer_types, float,
+                          bool, type(None), numpy.generic)):
+        return repr(value)
+    if isinstance(value, slice):
+        return ('slice', _signature([value.start, value.stop, value.step]))
+    if isinstance(value, numpy.ndarray):
+        return (value.dtype.str, value.shape,
+                hashlib.sha1(value.tostring()).hexdigest())
+    if isinstance(value, (Type, numpy.dtype)):
+        return (type(value).__name__, str(value))
+    # Elemwise ops keep the NumPy ufunc they use once they have run
+    if isinstance(value, numpy.ufunc):
+        return ('ufunc', value.__name__)
+    if isinstance(value, (type, types.FunctionType,
+                          types.BuiltinFunctionType)):
+        return (value.__module__, value.__name__)
+    # Other objects, e.g. the output type rules of scalar ops, are
+    # described by their class and attributes
+    if hasattr(value, '__dict__'):
+        return (type(value).__module__, type(value).__name__,
+                _signature(vars(value)))
+    raise TypeError("can't describe an attribute of type {}"
+                    .format(type(value).__name__))
+
+
+def _op_signature(op):
+    if hasattr(op, '__props__'):
+        props = [(prop, getattr(op, prop)) for prop in op.__props__]
+    else:
+        props = sorted(vars(op).items())
+    return (type(op).__module__, type(op).__name__, str(op),
+            [(name, _signature(value))
+             for name, value in props if not name.startswith('_')])
+
+
+def _graph_signature(outputs):
+    """Describe the structure of the graph computing the outputs."""
+    variable_ids = {}
+    description = []
+
+    def variable_id(variable):
+        if variable not in variable_ids:
+            variable_ids[variable] = len(variable_ids)
+            if variable.owner is None:
+                if isinstance(variable, Constant):
+                    data = _signature(numpy.asarray(variable.data))
+                elif isinstance(variable, SharedVariable):
+                    data = ('shared', _signature(
+                        getattr(variable, 'default_update', None)))
+                else:
+                    data = None
+                description.append(('input', variable_ids[variable],
+                                    str(variable.type), variable.name,
+                                    data))
+        return variable_ids[variable]
+
+    for node in io_toposort(graph_inputs(outputs), outputs):
+        description.append(
+            ('apply', _op_signature(node.op),
+             [variable_id(input_) for input_ in node.inputs],
+             [(variable_id(output), str(output.type))
+              for output in node.outputs]))
+    description.append(('outputs', [variable_id(output)
+                                    for output in outputs]))
+    return description
+
+
+def graph_hash(inputs, outputs, updates, **kwargs):
+    r"""Hash the structure of the graph of a Theano function.
+
+    Parameters
+    ----------
+    inputs : list of :class:`~tensor.TensorVariable`
+        The inputs of the function.
+    outputs : list of :class:`~tensor.TensorVariable`
+        The outputs of the function.
+    updates : list of tuples
+        The updates of the function.
+    \*\*kwargs : dict
+        The other arguments of :func:`theano.function`.
+
+    Returns
+    -------
+    str
+        The SHA-1 hash of the structure of the graph.
+
+    Raises
+    ------
+    TypeError
+        If an op of the graph has an attribute that can't be described,
+        in which case two graphs differing only by it could not be told
+        apart.
+
+    """
+    variables = (list(inputs) + list(outputs) +
+                 [variable for variable, _ in updates] +
+                 [value for _, value in updates])
+    description = [
+        theano.__version__,
+        [(flag, str(getattr(theano.config, flag, None)))
+         for flag in THEANO_FLAGS],
+        sorted((name, repr(value)) for name, value in kwargs.items()),
+        len(inputs), len(outputs),
+        _graph_signature([theano.tensor.as_tensor_variable(variable)
+                          if not isinstance(variable, Variable)
+                          else variable for variable in variables])]
+    return hashlib.sha1(repr(description).encode('utf-8')).hexdigest()
+
+
+def _load(path, inputs, outputs, updates):
+    """Load a function from the cache and bind it to the shared variables.
+
+    The shared variables are given to the function in the order in
+    which :func:`theano.function` collects them.
+
+    """
+    reoptimize = getattr(theano.config, 'reoptimize_unpickled_function',
+                         None)
+    if reoptimize is not None:
+        theano.config.reoptimize_unpickled_function = False
+    try:
+        with open(path, 'rb') as f:
+            maker = cPickle.load(f)
+    finally:
+        if reoptimize is not None:
+            theano.config.reoptimize_unpickled_function = reoptimize
+    shared_inputs = rebuild_collect_shared(
+        list(outputs), inputs=list(inputs), updates=updates,
+        copy_inputs_over=True)[2][3]
+    if len(maker.inputs) != len(inputs) + len(shared_inputs):
+        raise ValueError("the cached function has different inputs")
+    return maker.create([None] * len(inputs) +
+                        [shared.container for shared in shared_inputs])
+
+
+def function(inputs, outputs=None, updates=None, **kwargs):
+    """Compile a Theano function, using the cache if enabled.
+
+    Takes the same arguments as :func:`theano.function`. Functions with
+    `givens`, inputs that are not variables or a custom compilation mode
+    are compiled without using the cache.
+
+    """
+    path = config.function_cache_path
+    if updates is None:
+        updates = []
+    updates = list(updates.items() if isinstance(updates, dict)
+                   else updates)
+    if (not path or
+            any(name not in CACHEABLE_ARGUMENTS for name in kwargs) or
+            not all(isinstance(input_, Variable) for input_ in inputs)):
+        return theano.function(inputs, outputs, updates=updates, **kwargs)
+
+    output_list = (outputs if isinstance(outputs, (list, tuple))
+                   else [] if outputs is None else [outputs])
+    kwargs_key = dict(kwargs, outputs_type=type(outputs).__name__)
+    try:
+        key = graph_hash(inputs, output_list, updates, **kwargs_key)
+    except (TypeError, RuntimeError):
+        # A RuntimeError is raised by the recursion limit, when objects
+        # referring to each other are described
+        logger.debug("Compiling a function without the cache",
+                     exc_info=True)
+        return theano.function(inputs, outputs, updates=updates, **kwargs)
+    filename = os.path.join(path, key + '.pkl')
+    if os.path.isfile(filename):
+        try:
+            compiled = _load(filename, inputs, output_list, updates)
+            logger.debug("Loaded a compiled function from %s", filename)
+            return compiled
+        except Exception:
+            logger.warning("Could not load a compiled function from %s",
+                           filename, exc_info=True)
+    compiled = theano.function(inputs, outputs, updates=updates, **kwargs)
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        secure_write(cPickle.dumps(compiled.maker,
+                                   protocol=cPickle.HIGHEST_PROTOCOL),
+                     filename)
+    except Exception:
+        logger.warning("Could not save a compiled function to %s",
+                       filename, exc_info=True)
+    return compiled
@@ -43,6 +43,13 @@ The following configurations are supported:
    :class:`~theano.sandbox.rng_mrg.MRG_RandomStreams` objects. Must be an
    integer. By default this is set to 1.
 
+.. option:: function_cache_path
+
+   The directory in which compiled Theano functions are cached, see
+   :mod:`blocks.compilation`. Can also be set using the environment
+   variable ``BLOCKS_FUNCTION_CACHE_PATH``. By default no cache is used.
+   The cached functions are unpickled, so the directory must be trusted.
+
 .. _YAML: http://yaml.org/
 .. _environment variables:
    https://en.wikipedia.org/wiki/Environment_variable
@@ -138,5 +145,7 @@ config = Configuration()
 # Define configuration options
 config.add_config('data_path', type_=str, env_var='BLOCKS_DATA_PATH')
 config.add_config('default_seed', type_=int, default=1)
+config.add_config('function_cache_path', type_=str, default='',
+                  env_var='BLOCKS_FUNCTION_CACHE_PATH')
 
 config.load_yaml()
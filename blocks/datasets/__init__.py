@@ -1,4 +1,10 @@
 import collections
+import functools
+import itertools
+import multiprocessing
+import sys
+import threading
+import traceback
 from abc import ABCMeta, abstractmethod
 
 import numpy
@@ -6,7 +12,9 @@ import six
 import theano
 from six import add_metaclass
 
-from blocks.utils import LambdaIterator, SequenceIterator
+from blocks import config
+from blocks.utils import (LambdaIterator, SequenceIterator, fork_context,
+                          ignore_interrupts)
 
 
 @add_metaclass(ABCMeta)
@@ -436,6 +444,16 @@ class AbstractDataStream(object):
         """Gracefully close the data stream, e.g. releasing file handles."""
         pass
 
+    def stop_workers(self):
+        """Stop the worker processes of the data stream, if any.
+
+        Called by the main loop after training. Unlike :meth:`close`, the
+        state of the data stream is kept, and the workers are started
+        again if more data is requested.
+
+        """
+        pass
+
     @abstractmethod
     def next_epoch(self):
         """Switch the data stream to the next epoch."""
@@ -545,6 +563,9 @@ class DataStreamWrapper(AbstractDataStream):
     def close(self):
         self.data_stream.close()
 
+    def stop_workers(self):
+        self.data_stream.stop_workers()
+
     def reset(self):
         self.data_stream.reset()
 
@@ -566,6 +587,22 @@ class DataStreamWrapper(AbstractDataStream):
         return super(DataStreamWrapper, self).get_epoch_iterator(**kwargs)
 
 
+def _check_new_arrays(data_stream):
+    """Check that a data stream returns new arrays for every batch.
+
+    Data streams that read ahead keep several batches of the data stream
+    they wrap at once, which a :class:`PaddingDataStream` reusing its
+    buffers would overwrite.
+
+    """
+    while isinstance(data_stream, DataStreamWrapper):
+        if (isinstance(data_stream, PaddingDataStream) and
+                data_stream.reuse_buffers):
+            raise ValueError("can't read ahead from a PaddingDataStream "
+                             "that reuses its buffers")
+        data_stream = data_stream.data_stream
+
+
 class DataStreamMapping(DataStreamWrapper):
     """Applies a mapping to the data of the wrapped data stream.
 
@@ -624,6 +661,143 @@ class DataStreamFilter(DataStreamWrapper):
                 return data
 
 
+def _apply_mapping(mapping, data):
+    """Apply a mapping in a worker process, capturing any exception."""
+    try:
+        return False, mapping(data)
+    except Exception:
+        return True, traceback.format_exc()
+
+
+class ParallelDataStreamMapping(DataStreamMapping):
+    """Applies a mapping to the wrapped data stream using worker processes.
+
+    Examples are read from the wrapped data stream in chunks, which are
+    distributed over a pool of worker processes. The results are returned
+    in the same order as the examples were read, so the output is the same
+    as that of :class:`DataStreamMapping`.
+
+    Parameters
+    ----------
+    data_stream : instance of :class:`DataStream`
+        The wrapped data stream.
+    mapping : callable
+        The mapping to be applied. It is sent to the worker processes, so
+        it must be picklable (e.g. a function defined at the module level,
+        not a lambda).
+    add_sources : tuple of str, optional
+        When given, the data produced by the mapping is added to original
+        data under source names `add_sources`.
+    num_workers : int, optional
+        The number of worker processes. By default the number of CPUs.
+    chunk_size : int, optional
+        The number of examples sent to a worker at a time. By default 16.
+    max_pending : int, optional
+        The number of rounds of ``num_workers * chunk_size`` examples
+        that are being processed ahead of the consumer. By default 2.
+
+    Notes
+    -----
+    The worker processes ignore SIGINT, so that a keyboard interrupt is
+    handled by the main loop only. The pool is started lazily when the
+    first data is requested, and is terminated by :meth:`close` and by
+    :meth:`stop_workers`, which the main loop calls after training. When
+    pickled, the examples that are being processed are awaited and stored
+    with the data stream, so that no examples are lost on resumption.
+
+    If the mapping raises an exception in a worker process, a
+    :class:`RuntimeError` containing the worker's traceback is raised
+    when the corresponding example is requested.
+
+    """
+    def __init__(self, data_stream, mapping, add_sources=None,
+                 num_workers=None, chunk_size=16, max_pending=2):
+        super(ParallelDataStreamMapping, self).__init__(
+            data_stream, mapping, add_sources=add_sources)
+        _check_new_arrays(data_stream)
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending
+        self._pool = None
+        self._pending = collections.deque()
+        self._ready = collections.deque()
+        self._exhausted = True
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = fork_context.Pool(
+                self.num_workers, initializer=ignore_interrupts)
+        return self._pool
+
+    def _submit(self):
+        examples = list(itertools.islice(self.child_epoch_iterator,
+                                         self.num_workers * self.chunk_size))
+        if not examples:
+            self._exhausted = True
+            return
+        result = self.pool.map_async(
+            functools.partial(_apply_mapping, self.mapping), examples,
+            self.chunk_size)
+        self._pending.append((examples, result))
+
+    def _collect(self):
+        examples, result = self._pending.popleft()
+        self._ready.extend(zip(examples, result.get()))
+
+    def get_data(self, request=None):
+        if request is not None:
+            raise ValueError
+        while not self._ready:
+            while not self._exhausted and \
+                    len(self._pending) < self.max_pending:
+                self._submit()
+            if not self._pending:
+                raise StopIteration
+            self._collect()
+        data, (failed, image) = self._ready.popleft()
+        if failed:
+            raise RuntimeError("The mapping raised an exception in a worker"
+                               " process:\n\n" + image)
+        if not self.add_sources:
+            return image
+        return data + image
+
+    def get_epoch_iterator(self, **kwargs):
+        self._pending.clear()
+        self._ready.clear()
+        self._exhausted = False
+        return super(ParallelDataStreamMapping, self).get_epoch_iterator(
+            **kwargs)
+
+    def _terminate_pool(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def close(self):
+        self._terminate_pool()
+        self._pending.clear()
+        super(ParallelDataStreamMapping, self).close()
+
+    def stop_workers(self):
+        """Stop the pool, keeping the examples being processed."""
+        while self._pending:
+            self._collect()
+        self._terminate_pool()
+        super(ParallelDataStreamMapping, self).stop_workers()
+
+    def __getstate__(self):
+        while self._pending:
+            self._collect()
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
+
 class CachedDataStream(DataStreamWrapper):
     """Cache examples when sequentially reading a dataset.
 
@@ -640,35 +814,92 @@ class CachedDataStream(DataStreamWrapper):
 
     Attributes
     ----------
-    cache : list of lists of objects
+    cache : list of arrays
         This attribute holds the cache at any given point. It is a list of
         the same size as the :attr:`sources` attribute. Each element in
-        this list in its turn a list of examples that are currently in the
-        cache. The cache gets emptied at the start of each epoch, and gets
-        refilled when needed through the :meth:`get_data` method.
+        this list in its turn an array of the examples that are currently
+        in the cache. The cache gets emptied at the start of each epoch,
+        and gets refilled when needed through the :meth:`get_data` method.
+
+    Notes
+    -----
+    The chunks are stored as arrays together with the offset of the first
+    example that hasn't been returned yet. The batches returned are views
+    of these arrays, so returning a batch doesn't involve any copying;
+    only the (few) remaining examples are copied when the cache is
+    refilled. Examples of different shapes (e.g. sentences) are stored
+    in arrays of objects.
 
     """
     def __init__(self, data_stream, iteration_scheme):
         super(CachedDataStream, self).__init__(
             data_stream, iteration_scheme=iteration_scheme)
-        self.cache = [[] for _ in self.sources]
+        self._clear_cache()
+
+    @property
+    def cache(self):
+        return [buffer_[self._cache_offset:] for buffer_ in self._buffers]
+
+    def _clear_cache(self):
+        self._buffers = [numpy.empty(0) for _ in self.sources]
+        self._cache_offset = 0
 
     def get_data(self, request=None):
-        if request > len(self.cache[0]):
+        if request > len(self._buffers[0]) - self._cache_offset:
             self._cache()
-        data = []
-        for i, cache in enumerate(self.cache):
-            data.append(numpy.asarray(cache[:request]))
-            self.cache[i] = cache[request:]
-        return tuple(data)
+        return self._take(request)
+
+    def _take(self, request):
+        """Return views of the next `request` examples in the cache."""
+        start = self._cache_offset
+        self._cache_offset = min(start + request, len(self._buffers[0]))
+        return tuple(buffer_[start:self._cache_offset]
+                     for buffer_ in self._buffers)
 
     def get_epoch_iterator(self, **kwargs):
-        self.cache = [[] for _ in self.sources]
+        self._clear_cache()
         return super(CachedDataStream, self).get_epoch_iterator(**kwargs)
 
     def _cache(self):
-        for cache, data in zip(self.cache, next(self.child_epoch_iterator)):
-            cache.extend(data)
+        self._extend_cache([_as_array(data) for data in
+                            next(self.child_epoch_iterator)])
+
+    def _extend_cache(self, data):
+        """Add arrays of examples to the end of the cache."""
+        buffers = []
+        for buffer_, new_data in zip(self.cache, data):
+            if not len(buffer_):
+                buffers.append(new_data)
+            elif (buffer_.dtype == object or new_data.dtype == object or
+                  buffer_.shape[1:] != new_data.shape[1:]):
+                buffers.append(numpy.concatenate(
+                    [_as_object_array(buffer_), _as_object_array(new_data)]))
+            else:
+                buffers.append(numpy.concatenate([buffer_, new_data]))
+        self._buffers = buffers
+        self._cache_offset = 0
+
+
+def _as_object_array(examples):
+    """Store a sequence of examples in a one-dimensional array."""
+    array = numpy.empty(len(examples), dtype=object)
+    for i, example in enumerate(examples):
+        array[i] = example
+    return array
+
+
+def _as_array(examples):
+    """Convert a batch of examples to an array.
+
+    Examples of different shapes are stored in an array of objects.
+
+    """
+    if isinstance(examples, numpy.ndarray):
+        return examples
+    shapes = set(numpy.shape(example) for example in examples)
+    if len(shapes) > 1:
+        return _as_object_array(examples)
+    return numpy.asarray(examples)
 
 
 class BatchDataStream(DataStreamWrapper):
@@ -718,6 +949,96 @@ class BatchDataStream(DataStreamWrapper):
         return tuple(numpy.asarray(source_data) for source_data in data)
 
 
+class BucketedBatchDataStream(DataStreamWrapper):
+    """Creates minibatches of examples of similar length.
+
+    Padding a batch of variable-length sequences to its longest sequence
+    is wasteful when the lengths in the batch differ a lot. This wrapper
+    reads a large window of examples, sorts them by length and splits them
+    into batches of consecutive examples. The batches of a window are
+    returned in a random order.
+
+    Parameters
+    ----------
+    data_stream : :class:`AbstractDataStream` instance
+        The data stream to wrap.
+    iteration_scheme : :class:`.BatchSizeScheme` instance
+        The iteration scheme to use; should return integers representing
+        the size of the batch to return. The batch size requested when a
+        new window is read is used for all the batches of that window.
+    window_size : int, optional
+        The number of examples to read and sort at a time. By default
+        1000.
+    sort_source : str, optional
+        The source whose length is used to sort the examples. By default
+        the first source.
+    max_tokens : int, optional
+        If given, a batch is made smaller when needed, so that the padded
+        size of the sort source (the batch size times the length of its
+        longest sequence) does not exceed this number.
+    rng : :class:`numpy.random.RandomState`, optional
+        The random number generator used to shuffle the batches. By
+        default one seeded with ``config.default_seed`` is created.
+
+    """
+    def __init__(self, data_stream, iteration_scheme, window_size=1000,
+                 sort_source=None, max_tokens=None, rng=None):
+        super(BucketedBatchDataStream, self).__init__(
+            data_stream, iteration_scheme=iteration_scheme)
+        _check_new_arrays(data_stream)
+        self.window_size = window_size
+        if sort_source is None:
+            sort_source = self.sources[0]
+        self.sort_source = sort_source
+        self.max_tokens = max_tokens
+        if rng is None:
+            rng = numpy.random.RandomState(config.default_seed)
+        self.rng = rng
+        self._batches = []
+
+    def _split(self, lengths, batch_size):
+        """Split sorted lengths into slices of consecutive examples."""
+        slices = []
+        start = 0
+        while start < len(lengths):
+            stop = min(start + batch_size, len(lengths))
+            if self.max_tokens:
+                while (stop - start > 1 and
+                       lengths[stop - 1] * (stop - start) > self.max_tokens):
+                    stop -= 1
+            slices.append(slice(start, stop))
+            start = stop
+        return slices
+
+    def _read_window(self, batch_size):
+        examples = list(itertools.islice(self.child_epoch_iterator,
+                                         self.window_size))
+        if not examples:
+            raise StopIteration
+        source_index = self.sources.index(self.sort_source)
+        lengths = numpy.array([len(example[source_index])
+                               for example in examples])
+        order = numpy.argsort(lengths, kind='mergesort')
+        slices = self._split(lengths[order], batch_size)
+        self.rng.shuffle(slices)
+        self._batches = [[examples[i] for i in order[slice_]]
+                         for slice_ in reversed(slices)]
+
+    def get_data(self, request=None):
+        if request is None:
+            raise ValueError
+        if not self._batches:
+            self._read_window(request)
+        batch = self._batches.pop()
+        return tuple(numpy.asarray(source_data)
+                     for source_data in zip(*batch))
+
+    def get_epoch_iterator(self, **kwargs):
+        self._batches = []
+        return super(BucketedBatchDataStream, self).get_epoch_iterator(
+            **kwargs)
+
+
 class PaddingDataStream(DataStreamWrapper):
     """Adds padding to variable-length sequences.
 
@@ -738,13 +1059,30 @@ class PaddingDataStream(DataStreamWrapper):
     mask_sources : tuple of strings, optional
         The sources for which we need to add a mask. If not provided, a
         mask will be created for all data sources
+    length_multiple : int, optional
+        If given, the padded length is rounded up to a multiple of this
+        number. This limits the number of distinct shapes that are passed
+        to Theano functions at the cost of some additional padding.
+    reuse_buffers : bool, optional
+        If ``True``, the padded data and masks are written into buffers
+        which are reused as long as the batches fit into them, instead of
+        allocating new arrays for every batch. The returned arrays are then
+        views of these buffers, which are overwritten by the next batch.
+        Data streams that read several batches ahead, such as
+        :class:`PrefetchingDataStream`, :class:`ParallelDataStreamMapping`
+        and :class:`BucketedBatchDataStream`, raise a :class:`ValueError`
+        when wrapping such a stream. ``False`` by default.
 
     """
-    def __init__(self, data_stream, mask_sources=None):
+    def __init__(self, data_stream, mask_sources=None, length_multiple=None,
+                 reuse_buffers=False):
         super(PaddingDataStream, self).__init__(data_stream)
         if mask_sources is None:
             mask_sources = self.data_stream.sources
         self.mask_sources = mask_sources
+        self.length_multiple = length_multiple
+        self.reuse_buffers = reuse_buffers
+        self._buffers = {}
 
     @property
     def sources(self):
@@ -755,40 +1093,222 @@ class PaddingDataStream(DataStreamWrapper):
                 sources.append(source + '_mask')
         return tuple(sources)
 
+    def _allocate(self, source, shape, dtype):
+        """Return zeroed arrays for the padded data and the mask."""
+        mask_shape = shape[:2]
+        if self.reuse_buffers and source in self._buffers:
+            data_buffer, mask_buffer = self._buffers[source]
+            if (data_buffer.dtype == dtype and
+                    data_buffer.shape[2:] == shape[2:] and
+                    all(numpy.less_equal(mask_shape, mask_buffer.shape))):
+                padded_data = data_buffer[:shape[0], :shape[1]]
+                mask = mask_buffer[:shape[0], :shape[1]]
+                padded_data[...] = 0
+                return padded_data, mask
+        padded_data = numpy.zeros(shape, dtype=dtype)
+        mask = numpy.empty(mask_shape, dtype=theano.config.floatX)
+        if self.reuse_buffers:
+            self._buffers[source] = (padded_data, mask)
+        return padded_data, mask
+
+    def _pad(self, source, source_data):
+        samples = [numpy.asarray(sample) for sample in source_data]
+        rest_shape = samples[0].shape[1:]
+        if not all([sample.shape[1:] == rest_shape for sample in samples]):
+            raise ValueError("All dimensions except length must be equal")
+        lengths = numpy.array([len(sample) for sample in samples])
+        max_sequence_length = lengths.max()
+        if self.length_multiple:
+            max_sequence_length = (-(-max_sequence_length //
+                                     self.length_multiple) *
+                                   self.length_multiple)
+
+        padded_data, mask = self._allocate(
+            source, (len(samples), max_sequence_length) + rest_shape,
+            samples[0].dtype)
+        is_data = lengths[:, None] > numpy.arange(max_sequence_length)
+        padded_data[is_data] = numpy.concatenate(samples)
+        mask[...] = is_data
+        return padded_data, mask
+
     def get_data(self, request=None):
         if request is not None:
             raise ValueError
         data = list(next(self.child_epoch_iterator))
         data_with_masks = []
-        for i, (source, source_data) in enumerate(
-                zip(self.data_stream.sources, data)):
+        for source, source_data in zip(self.data_stream.sources, data):
             if source not in self.mask_sources:
                 data_with_masks.append(source_data)
                 continue
-
-            shapes = [numpy.asarray(sample).shape for sample in source_data]
-            lengths = [shape[0] for shape in shapes]
-            max_sequence_length = max(lengths)
-            rest_shape = shapes[0][1:]
-            if not all([shape[1:] == rest_shape for shape in shapes]):
-                raise ValueError("All dimensions except length must be equal")
-            dtype = numpy.asarray(source_data[0]).dtype
-
-            padded_data = numpy.zeros(
-                (len(source_data), max_sequence_length) + rest_shape,
-                dtype=dtype)
-            for i, sample in enumerate(source_data):
-                padded_data[i, :len(sample)] = sample
-            data_with_masks.append(padded_data)
-
-            mask = numpy.zeros((len(source_data), max_sequence_length),
-                               dtype=theano.config.floatX)
-            for i, sequence_length in enumerate(lengths):
-                mask[i, :sequence_length] = 1
-            data_with_masks.append(mask)
+            data_with_masks.extend(self._pad(source, source_data))
         return tuple(data_with_masks)
 
 
+class PrefetchingDataStream(DataStreamWrapper):
+    """Prefetches data from the wrapped data stream in the background.
+
+    A producer thread reads ahead from the wrapped data stream and keeps a
+    bounded buffer of batches, so that the preparation of the next batch
+    (e.g. reading and numberizing text, padding) overlaps with the
+    processing of the current one by the training algorithm.
+
+    Parameters
+    ----------
+    data_stream : :class:`AbstractDataStream` instance
+        The data stream to prefetch from.
+    buffer_size : int, optional
+        The maximum number of batches to read ahead. By default 10.
+
+    Notes
+    -----
+    The end of an epoch of the wrapped data stream is passed through as
+    is: once the buffer is drained, :class:`StopIteration` is raised.
+    Exceptions raised by the wrapped data stream are re-raised in the
+    consuming thread, in the same position of the epoch.
+
+    A thread is used rather than a process, so that the wrapped data
+    stream stays in the main process and can be serialized. The producer
+    therefore only runs while the consumer releases the GIL: NumPy and
+    file operations do, but a compiled Theano function running on the
+    CPU holds it for most of its call, so little loading overlaps with
+    the update step of training. Use :class:`ParallelDataStreamMapping`
+    to move expensive processing to other processes. When pickled,
+    the producer is paused and the content of the buffer is saved along
+    with the wrapped stream. The producer is restarted lazily when data is
+    requested from the unpickled stream. An exception raised by the
+    wrapped stream but not re-raised yet is saved as its formatted
+    traceback, and re-raised as a :class:`RuntimeError` by the unpickled
+    stream.
+
+    Since the buffer holds several batches at once, the wrapped data
+    stream can't contain a :class:`PaddingDataStream` that reuses its
+    buffers.
+
+    """
+    def __init__(self, data_stream, buffer_size=10):
+        super(PrefetchingDataStream, self).__init__(data_stream)
+        if buffer_size < 1:
+            raise ValueError("buffer size must be positive")
+        _check_new_arrays(data_stream)
+        self.buffer_size = buffer_size
+        self._buffer = collections.deque()
+        self._exhausted = True
+        self._create_synchronization()
+
+    def _create_synchronization(self):
+        self._producer = None
+        self._stopping = False
+        self._error = None
+        self._condition = threading.Condition()
+
+    def _produce(self):
+        while True:
+            with self._condition:
+                while (len(self._buffer) >= self.buffer_size and
+                       not self._stopping):
+                    self._condition.wait()
+                if self._stopping:
+                    return
+            exhausted, error = False, None
+            try:
+                data = next(self.child_epoch_iterator)
+            except StopIteration:
+                exhausted = True
+            except Exception:
+                error = sys.exc_info()
+            with self._condition:
+                if exhausted:
+                    self._exhausted = True
+                elif error is not None:
+                    self._error = error
+                else:
+                    self._buffer.append(data)
+                self._condition.notify_all()
+                if self._exhausted or self._error is not None:
+                    return
+
+    def _start_producer(self):
+        if (self._producer is not None or self._exhausted or
+                self._error is not None):
+            return
+        self._stopping = False
+        self._producer = threading.Thread(target=self._produce)
+        self._producer.daemon = True
+        self._producer.start()
+
+    def _stop_producer(self):
+        if self._producer is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._producer.join()
+        self._producer = None
+
+    def get_data(self, request=None):
+        if request is not None:
+            raise ValueError
+        self._start_producer()
+        with self._condition:
+            while (not self._buffer and not self._exhausted and
+                   self._error is None):
+                self._condition.wait()
+            if self._buffer:
+                data = self._buffer.popleft()
+                self._condition.notify_all()
+                return data
+            if self._error is not None:
+                error, self._error = self._error, None
+                self._exhausted = True
+                six.reraise(*error)
+            raise StopIteration
+
+    def get_epoch_iterator(self, **kwargs):
+        self._stop_producer()
+        self._buffer.clear()
+        self._exhausted = False
+        self._error = None
+        return super(PrefetchingDataStream, self).get_epoch_iterator(
+            **kwargs)
+
+    def reset(self):
+        self._stop_producer()
+        self._buffer.clear()
+        self._exhausted = True
+        super(PrefetchingDataStream, self).reset()
+
+    def next_epoch(self):
+        self._stop_producer()
+        super(PrefetchingDataStream, self).next_epoch()
+
+    def close(self):
+        self._stop_producer()
+        super(PrefetchingDataStream, self).close()
+
+    def __getstate__(self):
+        # The producer must not advance the wrapped stream while it is
+        # being pickled, it is restarted lazily by get_data
+        self._stop_producer()
+        state = self.__dict__.copy()
+        state['_buffer'] = list(self._buffer)
+        if self._error is not None:
+            state['_error'] = ''.join(traceback.format_exception(
+                *self._error))
+        for attribute in ('_producer', '_stopping', '_condition'):
+            del state[attribute]
+        return state
+
+    def __setstate__(self, state):
+        state['_buffer'] = collections.deque(state['_buffer'])
+        error = state.pop('_error')
+        self.__dict__.update(state)
+        self._create_synchronization()
+        if error is not None:
+            self._error = (RuntimeError, RuntimeError(
+                "the wrapped data stream failed before the stream was "
+                "pickled:\n" + error), None)
+
+
 class DataIterator(six.Iterator):
     """An iterator over data, representing a single epoch.
 
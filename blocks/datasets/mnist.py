@@ -52,12 +52,20 @@ class MNIST(InMemoryDataset):
     binary : bool, optional
         If ``True``, returns binary (black/white) images instead of
         grayscale. ``False`` by default.
+    memmap : bool, optional
+        If ``True``, the images are memory-mapped from the original file
+        instead of being read and converted into memory. The conversion to
+        floats (or booleans) then happens for each requested batch in
+        :meth:`get_data`, and several processes using the same file share
+        the operating system's page cache instead of each holding a copy
+        of the data. Note that the :attr:`features` attribute holds the
+        unconverted unsigned bytes in this case. ``False`` by default.
 
     """
     provides_sources = ('features', 'targets')
 
     def __init__(self, which_set, start=None, stop=None, binary=False,
-                 **kwargs):
+                 memmap=False, **kwargs):
         if which_set not in ('train', 'test'):
             raise ValueError("MNIST only has a train and test set")
         if not stop:
@@ -72,6 +80,12 @@ class MNIST(InMemoryDataset):
         self.start = start
         self.stop = stop
         self.binary = binary
+        self.memmap = memmap
+
+    @property
+    def dtype(self):
+        """The data type of the returned features."""
+        return 'bool' if self.binary else theano.config.floatX
 
     def load(self):
         if self.which_set == 'train':
@@ -83,8 +97,8 @@ class MNIST(InMemoryDataset):
         data_path = os.path.join(config.data_path, 'mnist')
         x = read_mnist_images(
             os.path.join(data_path, data),
-            'bool' if self.binary
-            else theano.config.floatX)[self.start:self.stop]
+            None if self.memmap else self.dtype,
+            memmap=self.memmap)[self.start:self.stop]
         x = x.reshape((x.shape[0], numpy.prod(x.shape[1:])))
         y = read_mnist_labels(
             os.path.join(data_path, labels))[self.start:self.stop,
@@ -95,11 +109,13 @@ class MNIST(InMemoryDataset):
     def get_data(self, state=None, request=None):
         if state is not None:
             raise ValueError("MNIST does not have a state")
-        return self.filter_sources((self.features[request],
-                                    self.targets[request]))
+        features = self.features[request]
+        if self.memmap:
+            features = convert_mnist_images(features, self.dtype)
+        return self.filter_sources((features, self.targets[request]))
 
 
-def read_mnist_images(filename, dtype=None):
+def read_mnist_images(filename, dtype=None, memmap=False):
     """Read MNIST images from the original ubyte file format.
 
     Parameters
@@ -111,6 +127,10 @@ def read_mnist_images(filename, dtype=None):
         If unspecified, images will be returned in their original
         unsigned byte format.
 
+    memmap : bool, optional
+        If ``True``, the images are memory-mapped (read-only) instead of
+        read into memory. Can only be used without `dtype`.
+
     Returns
     -------
     images : :class:`~numpy.ndarray`, shape (n_images, n_rows, n_cols)
@@ -129,23 +149,51 @@ def read_mnist_images(filename, dtype=None):
     original unsigned byte representation equal to 1.0.
 
     """
+    if memmap and dtype:
+        raise ValueError("Memory-mapped MNIST images can't be converted")
     with open(filename, 'rb') as f:
         magic, number, rows, cols = struct.unpack('>iiii', f.read(16))
         if magic != MNIST_IMAGE_MAGIC:
             raise ValueError("Wrong magic number reading MNIST image file")
-        array = numpy.fromfile(f, dtype='uint8').reshape((number, rows, cols))
+        if not memmap:
+            array = numpy.fromfile(f, dtype='uint8').reshape(
+                (number, rows, cols))
+    if memmap:
+        array = numpy.memmap(filename, dtype='uint8', mode='r', offset=16,
+                             shape=(number, rows, cols))
     if dtype:
-        dtype = numpy.dtype(dtype)
-
-        if dtype.kind == 'b':
-            # If the user wants Booleans, threshold at half the range.
-            array = array >= 128
-        elif dtype.kind == 'f':
-            # Otherwise, just convert.
-            array = array.astype(dtype)
-            array /= 255.
-        else:
-            raise ValueError("Unknown dtype to convert MNIST to")
+        array = convert_mnist_images(array, dtype)
+    return array
+
+
+def convert_mnist_images(array, dtype):
+    """Convert MNIST images from unsigned bytes.
+
+    Parameters
+    ----------
+    array : :class:`~numpy.ndarray`
+        The images in their original unsigned byte format.
+    dtype : 'float32', 'float64', or 'bool'
+        The type to convert to. See :func:`read_mnist_images` for the
+        details of the conversion.
+
+    Returns
+    -------
+    images : :class:`~numpy.ndarray`
+        A new array with the converted images.
+
+    """
+    dtype = numpy.dtype(dtype)
+
+    if dtype.kind == 'b':
+        # If the user wants Booleans, threshold at half the range.
+        array = array >= 128
+    elif dtype.kind == 'f':
+        # Otherwise, just convert.
+        array = array.astype(dtype)
+        array /= 255.
+    else:
+        raise ValueError("Unknown dtype to convert MNIST to")
     return array
 
 
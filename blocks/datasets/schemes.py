@@ -1,8 +1,11 @@
 from abc import ABCMeta, abstractmethod
 
+import numpy
 import six
 from six import add_metaclass
 
+from blocks import config
+
 
 @add_metaclass(ABCMeta)
 class IterationScheme(object):
@@ -126,3 +129,141 @@ class SequentialIterator(six.Iterator):
                                          self.current + self.batch_size))
         self.current += self.batch_size
         return slice_
+
+
+class ShuffledScheme(BatchScheme):
+    """Shuffled batches iterator.
+
+    Iterate over all the examples in a dataset of fixed size in shuffled
+    batches, visiting the examples in a new random order each epoch.
+
+    Parameters
+    ----------
+    num_examples : int
+        The number of examples in the dataset.
+    batch_size : int
+        The size of the batches.
+    rng : :class:`~numpy.random.RandomState`, optional
+        The random number generator from which the seed of every epoch is
+        drawn. If not given, a new one seeded with ``config.default_seed``
+        is created. Since the generator is part of the scheme, it is saved
+        together with the data stream, which makes the sequence of epochs
+        reproducible when training is resumed.
+
+    Notes
+    -----
+    The batch size isn't enforced, so the last batch could be smaller.
+
+    The indices in each batch are sorted, which makes reading them from
+    disk-backed arrays faster without affecting which examples end up in
+    the same batch.
+
+    The request iterators only store a seed and their position, so they
+    are cheap to pickle as part of :attr:`.MainLoop.iteration_state`,
+    and an interrupted epoch is resumed exactly where it stopped.
+
+    """
+    block_size = None
+
+    def __init__(self, num_examples, batch_size, rng=None):
+        self.num_examples = num_examples
+        self.batch_size = batch_size
+        if rng is None:
+            rng = numpy.random.RandomState(config.default_seed)
+        self.rng = rng
+
+    def get_request_iterator(self):
+        return ShuffledIterator(self.num_examples, self.batch_size,
+                                self.rng.randint(2 ** 31), self.block_size)
+
+
+class BlockShuffledScheme(ShuffledScheme):
+    """Block-shuffled batches iterator.
+
+    The examples are divided into contiguous blocks. Each epoch, the
+    blocks are visited in a random order, and the examples within each
+    block are shuffled. Every batch is hence read from at most a few
+    contiguous regions of the dataset, which retains most of the speed of
+    sequential reads on memory-mapped or otherwise disk-backed data.
+
+    Parameters
+    ----------
+    num_examples : int
+        The number of examples in the dataset.
+    batch_size : int
+        The size of the batches.
+    block_size : int
+        The number of examples in each block. Should be a good deal larger
+        than `batch_size` for the batches to be well mixed.
+    rng : :class:`~numpy.random.RandomState`, optional
+        See :class:`ShuffledScheme`.
+
+    """
+    def __init__(self, num_examples, batch_size, block_size, rng=None):
+        super(BlockShuffledScheme, self).__init__(num_examples, batch_size,
+                                                  rng)
+        if block_size < 1:
+            raise ValueError("block size must be positive")
+        self.block_size = block_size
+
+
+class ShuffledIterator(six.Iterator):
+    """Iterates over shuffled blocks of examples.
+
+    The order of the blocks and the order of the examples within every
+    block are derived from `seed`, so that only the block being read is
+    kept in memory and the state that needs to be pickled is constant in
+    size.
+
+    """
+    def __init__(self, num_examples, batch_size, seed, block_size=None):
+        self.num_examples = num_examples
+        self.batch_size = batch_size
+        self.seed = seed
+        self.block_size = block_size if block_size else max(num_examples, 1)
+        self.num_blocks = -(-num_examples // self.block_size)
+        self.block = 0
+        self.offset = 0
+
+    @property
+    def block_order(self):
+        if not hasattr(self, '_block_order'):
+            self._block_order = numpy.random.RandomState(
+                self.seed).permutation(self.num_blocks)
+        return self._block_order
+
+    @property
+    def current_block(self):
+        if getattr(self, '_current_block_index', None) != self.block:
+            start = self.block_order[self.block] * self.block_size
+            stop = min(start + self.block_size, self.num_examples)
+            rng = numpy.random.RandomState([self.seed, self.block])
+            self._current_block = start + rng.permutation(stop - start)
+            self._current_block_index = self.block
+        return self._current_block
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for attr in ['_block_order', '_current_block',
+                     '_current_block_index']:
+            state.pop(attr, None)
+        return state
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        batch = []
+        remaining = self.batch_size
+        while remaining and self.block < self.num_blocks:
+            examples = self.current_block[
+                self.offset:self.offset + remaining]
+            batch.extend(examples.tolist())
+            remaining -= len(examples)
+            self.offset += len(examples)
+            if self.offset == len(self.current_block):
+                self.block += 1
+                self.offset = 0
+        if not batch:
+            raise StopIteration
+        return sorted(batch)
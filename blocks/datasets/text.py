@@ -1,6 +1,12 @@
+import hashlib
+import itertools
+import json
+import numbers
 import os
 
 import numpy
+import six
+from numpy.lib.stride_tricks import as_strided
 
 from blocks import config
 from blocks.datasets import Dataset, CachedDataStream
@@ -45,6 +51,14 @@ class TextFile(Dataset):
         a modified string. For example ``str.lower`` in order to lowercase
         the sentence before numberizing.
 
+    Notes
+    -----
+    By default sentences are read and returned one at a time, as lists of
+    integers. When used with a :class:`.ConstantScheme` the sentences are
+    instead read in chunks of the requested size and numberized together,
+    which is considerably faster, and each request returns a list of
+    integer arrays.
+
     Examples
     --------
     >>> with open('sentences.txt', 'w') as f:
@@ -96,9 +110,46 @@ class TextFile(Dataset):
     def _open_file(self, partition_index):
         return open(self.files[partition_index])
 
+    @property
+    def character_table(self):
+        """A lookup table from character code points to numbers.
+
+        The table is indexed by code point; its last entry is the number
+        of the unknown token, to which all code points beyond the table
+        are clipped.
+
+        """
+        if not hasattr(self, '_character_table'):
+            characters = dict((ord(token), number)
+                              for token, number in self.dictionary.items()
+                              if len(token) == 1)
+            table = numpy.empty(max(characters) + 2 if characters else 1,
+                                dtype='int64')
+            table[:] = self.dictionary[self.unk_token]
+            table[list(characters.keys())] = list(characters.values())
+            self._character_table = table
+        return self._character_table
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_character_table', None)
+        return state
+
     def get_data(self, state=None, request=None):
-        if request is not None:
+        if request is None:
+            return (self._numberize(self._read_sentence(state)),)
+        if not isinstance(request, numbers.Integral) or request < 1:
             raise ValueError
+        sentences = []
+        try:
+            while len(sentences) < request:
+                sentences.append(self._read_sentence(state))
+        except StopIteration:
+            if not sentences:
+                raise
+        return (self._numberize_batch(sentences),)
+
+    def _read_sentence(self, state):
         while True:
             if state.file is None:
                 raise StopIteration
@@ -112,18 +163,484 @@ class TextFile(Dataset):
                     state.current_index += 1
                     state.file = self._open_file(state.current_index)
             else:
-                break
+                return sentence
+
+    def _numberize(self, sentence):
+        """Turn a sentence (a line of text) into a list of integers."""
         if self.preprocess is not None:
             sentence = self.preprocess(sentence)
         data = [self.dictionary[self.bos_token]] if self.bos_token else []
+        unk = self.dictionary[self.unk_token]
+        get = self.dictionary.get
         if self.level == 'word':
-            data += [self.dictionary.get(word, self.dictionary[self.unk_token])
-                     for word in sentence.split()]
+            data += [get(word, unk) for word in sentence.split()]
         else:
-            data += [self.dictionary.get(char, self.dictionary[self.unk_token])
-                     for char in sentence.strip()]
+            data += [get(char, unk) for char in sentence.strip()]
         data += [self.dictionary[self.eos_token]] if self.eos_token else []
-        return (data,)
+        return data
+
+    def _numberize_batch(self, sentences):
+        """Turn a list of sentences into a list of integer arrays.
+
+        All the tokens of the batch are looked up at once: words through
+        the dictionary in a single pass, characters by indexing
+        :attr:`character_table` with their code points.
+
+        """
+        if self.preprocess is not None:
+            sentences = [self.preprocess(sentence) for sentence in sentences]
+        if self.level == 'word':
+            tokens = [sentence.split() for sentence in sentences]
+            lengths = numpy.array([len(words) for words in tokens])
+            unk = self.dictionary[self.unk_token]
+            get = self.dictionary.get
+            ids = numpy.fromiter(
+                (get(word, unk) for words in tokens for word in words),
+                dtype='int64', count=lengths.sum())
+        else:
+            sentences = [sentence.strip() for sentence in sentences]
+            lengths = numpy.array([len(sentence) for sentence in sentences])
+            text = ''.join(sentences)
+            if isinstance(text, six.binary_type):
+                code_points = numpy.frombuffer(text, dtype='uint8')
+            else:
+                code_points = numpy.frombuffer(text.encode('utf-32-le'),
+                                               dtype='uint32')
+            table = self.character_table
+            ids = table[numpy.minimum(code_points, len(table) - 1)]
+
+        # Surround the numberized sentences with BOS and EOS markers
+        markers = bool(self.bos_token) + bool(self.eos_token)
+        ends = numpy.cumsum(lengths + markers)
+        starts = ends - lengths - markers
+        data = numpy.empty(ends[-1] if len(ends) else 0, dtype='int64')
+        is_token = numpy.ones_like(data, dtype=bool)
+        if self.bos_token:
+            data[starts] = self.dictionary[self.bos_token]
+            is_token[starts] = False
+        if self.eos_token:
+            data[ends - 1] = self.dictionary[self.eos_token]
+            is_token[ends - 1] = False
+        data[is_token] = ids
+        return numpy.split(data, ends[:-1])
+
+
+def _next_indices(state, request, num_examples):
+    """Turn a request for the next `request` sentences into indices.
+
+    Like :class:`TextFile`, the last request of an epoch can return fewer
+    sentences than requested.
+
+    """
+    if request < 1:
+        raise ValueError
+    if state.position >= num_examples:
+        raise StopIteration
+    stop = min(state.position + request, num_examples)
+    indices = range(state.position, stop)
+    state.position = stop
+    return indices
+
+
+class IndexedTextFileState(object):
+    """The state of an :class:`IndexedTextFile`.
+
+    Only the position in the epoch is serialized; the file handles are
+    reopened when needed.
+
+    """
+    def __init__(self):
+        self.position = 0
+        self.handles = {}
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['handles'] = {}
+        return state
+
+
+class IndexedTextFile(TextFile):
+    r"""Reads text files through an index of line offsets.
+
+    The byte offset of each line in each file is computed once and cached
+    next to the file (as ``<filename>.index.npy``), so that any sentence
+    can be read directly by seeking to it. This allows:
+
+    * resuming an interrupted epoch without re-reading the files, since
+      the state only consists of the index of the next sentence;
+    * requesting batches of sentences by their (global) indices, e.g.
+      using a :class:`.ShuffledScheme` to read the sentences in random
+      order across all files.
+
+    If no iteration scheme is given the sentences are returned one by one
+    in order, just like :class:`TextFile`. Otherwise the requests are
+    expected to be lists of sentence indices, or numbers of sentences to
+    read in order (e.g. using a :class:`.ConstantScheme`), and a list of
+    integer arrays is returned for each request.
+
+    Parameters
+    ----------
+    files : list of str
+        See :class:`TextFile`. The files are expected to be UTF-8 encoded.
+    dictionary : str or dict
+        See :class:`TextFile`.
+    cache_index : bool, optional
+        Whether to save the index next to each file. If the index can't be
+        written (e.g. because the directory is read-only) it is silently
+        kept in memory only. ``True`` by default.
+
+    See :class:`TextFile` for remaining keyword arguments.
+
+    Examples
+    --------
+    >>> from blocks.datasets import DataStream
+    >>> from blocks.datasets.schemes import SequentialScheme
+    >>> with open('sentences.txt', 'w') as f:
+    ...     _ = f.write("This is a sentence\n")
+    ...     _ = f.write("This another one")
+    >>> dictionary = {'<UNK>': 0, '</S>': 1, 'this': 2, 'a': 3, 'one': 4}
+    >>> text_data = IndexedTextFile(files=['sentences.txt'],
+    ...                             dictionary=dictionary, bos_token=None,
+    ...                             preprocess=str.lower, cache_index=False)
+    >>> text_data.num_examples
+    2
+    >>> sentences, = text_data.get_data(text_data.open(), [1, 0])
+    >>> [sentence.tolist() for sentence in sentences]
+    [[2, 0, 4, 1], [2, 0, 3, 0, 1]]
+
+    .. doctest::
+       :hide:
+
+       >>> import os
+       >>> os.remove('sentences.txt')
+
+    """
+    def __init__(self, files, dictionary, cache_index=True, **kwargs):
+        super(IndexedTextFile, self).__init__(files, dictionary, **kwargs)
+        self.cache_index = cache_index
+
+    @property
+    def offsets(self):
+        """The line offsets of each file.
+
+        For each file an array of length ``number of lines + 1`` with the
+        offsets of the start of each line and the size of the file.
+
+        """
+        if not hasattr(self, '_offsets'):
+            self._load_indices()
+        return self._offsets
+
+    @property
+    def num_examples(self):
+        if not hasattr(self, '_cumulative_lengths'):
+            self._load_indices()
+        return int(self._cumulative_lengths[-1])
+
+    def _load_indices(self):
+        self._offsets = [self._load_index(filename)
+                         for filename in self.files]
+        self._cumulative_lengths = numpy.cumsum(
+            [len(offsets) - 1 for offsets in self._offsets])
+
+    def _load_index(self, filename):
+        index_filename = filename + '.index.npy'
+        size = os.path.getsize(filename)
+        if (os.path.isfile(index_filename) and
+                os.path.getmtime(index_filename) >=
+                os.path.getmtime(filename)):
+            offsets = numpy.load(index_filename)
+            if len(offsets) and offsets[-1] == size:
+                return offsets
+        with open(filename, 'rb') as f:
+            offsets = line_offsets(f)
+        if self.cache_index:
+            try:
+                numpy.save(index_filename, offsets)
+            except (IOError, OSError):
+                pass
+        return offsets
+
+    def __getstate__(self):
+        state = super(IndexedTextFile, self).__getstate__()
+        for attr in ['_offsets', '_cumulative_lengths']:
+            state.pop(attr, None)
+        return state
+
+    def open(self):
+        return IndexedTextFileState()
+
+    def reset(self, state):
+        state.position = 0
+        return state
+
+    def close(self, state):
+        state.close()
+
+    def _seek_sentence(self, state, index):
+        offsets = self.offsets
+        partition_index = numpy.searchsorted(self._cumulative_lengths, index,
+                                             side='right')
+        if partition_index > 0:
+            index -= self._cumulative_lengths[partition_index - 1]
+        if partition_index not in state.handles:
+            state.handles[partition_index] = open(
+                self.files[partition_index], 'rb')
+        handle = state.handles[partition_index]
+        start, stop = offsets[partition_index][index:index + 2]
+        handle.seek(start)
+        sentence = handle.read(stop - start)
+        if six.PY3:
+            sentence = sentence.decode('utf-8')
+        return sentence
+
+    def get_data(self, state=None, request=None):
+        if request is None:
+            if state.position >= self.num_examples:
+                raise StopIteration
+            sentence = self._seek_sentence(state, state.position)
+            state.position += 1
+            return (self._numberize(sentence),)
+        if isinstance(request, numbers.Integral):
+            request = _next_indices(state, request, self.num_examples)
+        if not all(0 <= index < self.num_examples for index in request):
+            raise ValueError("sentence index out of range")
+        return (self._numberize_batch([self._seek_sentence(state, index)
+                                       for index in request]),)
+
+
+def line_offsets(f, chunk_size=2 ** 24):
+    """Find the offsets of the lines in a file.
+
+    Parameters
+    ----------
+    f : file
+        A file opened in binary mode.
+    chunk_size : int, optional
+        The number of bytes to read at a time.
+
+    Returns
+    -------
+    offsets : :class:`~numpy.ndarray`
+        An array of integers with the offset at which each line starts,
+        followed by the size of the file. A final line without a
+        terminating newline is considered a line as well.
+
+    """
+    offsets = [numpy.zeros(1, dtype='int64')]
+    position = 0
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        newlines, = numpy.nonzero(
+            numpy.frombuffer(chunk, dtype='uint8') == ord('\n'))
+        offsets.append(newlines.astype('int64') + position + 1)
+        position += len(chunk)
+    offsets = numpy.concatenate(offsets)
+    if offsets[-1] != position:
+        offsets = numpy.append(offsets, position)
+    return offsets
+
+
+def vocabulary_hash(dictionary):
+    """Compute a hash of a dictionary mapping tokens to integers.
+
+    Used to check that pre-numberized data was created with the same
+    dictionary as the one it is used with. Byte string tokens are hashed
+    as they are, and unicode ones encoded in UTF-8.
+
+    """
+    sha1 = hashlib.sha1()
+    for i, (token, number) in enumerate(sorted(dictionary.items())):
+        if isinstance(token, six.text_type):
+            token = token.encode('utf-8')
+        if i:
+            sha1.update(b'\n')
+        sha1.update(token)
+        sha1.update('\t{}'.format(number).encode('ascii'))
+    return sha1.hexdigest()
+
+
+def binarize(text_file, prefixes=None, chunk_size=10000):
+    """Store the numberized partitions of a text file in binary format.
+
+    For each file read by the given :class:`TextFile`, all the numberized
+    sentences are concatenated and stored as a single int32 array in
+    ``<prefix>.tokens.npy``. The offset at which each sentence starts
+    (followed by the total number of tokens) is stored as an int64 array
+    in ``<prefix>.offsets.npy``, and the hash of the dictionary in
+    ``<prefix>.json``. Use :class:`BinaryTextFile` to read the result.
+
+    Parameters
+    ----------
+    text_file : :class:`TextFile`
+        The text file dataset whose files, dictionary, and numberization
+        options to use, e.g. :class:`OneBillionWord`.
+    prefixes : list of str, optional
+        The prefixes of the files to write for each of the files read by
+        `text_file`. By default the name of the original file is used.
+    chunk_size : int, optional
+        The number of lines to numberize at a time.
+
+    Returns
+    -------
+    prefixes : list of str
+        The prefixes of the written files.
+
+    """
+    if prefixes is None:
+        prefixes = text_file.files
+    if len(prefixes) != len(text_file.files):
+        raise ValueError("need a prefix for every file")
+    if max(text_file.dictionary.values()) > numpy.iinfo('int32').max:
+        raise ValueError("dictionary doesn't fit in int32")
+    for filename, prefix in zip(text_file.files, prefixes):
+        tokens, lengths = [], [numpy.zeros(1, dtype='int64')]
+        with open(filename) as f:
+            while True:
+                sentences = list(itertools.islice(f, chunk_size))
+                if not sentences:
+                    break
+                numberized = text_file._numberize_batch(sentences)
+                tokens.extend(numberized)
+                lengths.append(numpy.array([len(sentence)
+                                            for sentence in numberized]))
+        numpy.save(prefix + '.tokens.npy',
+                   numpy.concatenate(tokens).astype('int32')
+                   if tokens else numpy.zeros(0, dtype='int32'))
+        numpy.save(prefix + '.offsets.npy',
+                   numpy.cumsum(numpy.concatenate(lengths)))
+        with open(prefix + '.json', 'w') as f:
+            json.dump({'vocabulary_hash':
+                       vocabulary_hash(text_file.dictionary)}, f)
+    return prefixes
+
+
+class BinaryTextFile(Dataset):
+    r"""Reads numberized sentences stored in binary format.
+
+    Reads the files written by :func:`binarize`. The arrays are
+    memory-mapped, and each sentence is returned as a slice of the token
+    array without any copying or parsing, which makes reading the data
+    essentially free.
+
+    Like :class:`IndexedTextFile`, the sentences are returned one by one
+    in order when no iteration scheme is given, and as a list of arrays
+    when the requests are lists of sentence indices or numbers of
+    sentences.
+
+    Parameters
+    ----------
+    prefixes : list of str
+        The prefixes of the files to read, as returned by :func:`binarize`.
+    dictionary : dict, optional
+        If given, it is checked that the data was numberized with this
+        dictionary.
+
+    Examples
+    --------
+    >>> with open('sentences.txt', 'w') as f:
+    ...     _ = f.write("This is a sentence\n")
+    ...     _ = f.write("This another one")
+    >>> dictionary = {'<UNK>': 0, '</S>': 1, 'this': 2, 'a': 3, 'one': 4}
+    >>> prefixes = binarize(TextFile(['sentences.txt'], dictionary,
+    ...                              bos_token=None, preprocess=str.lower))
+    >>> binary_data = BinaryTextFile(prefixes, dictionary)
+    >>> for data in binary_data.get_default_stream().get_epoch_iterator():
+    ...     print(data[0].tolist())
+    [2, 0, 3, 0, 1]
+    [2, 0, 4, 1]
+
+    .. doctest::
+       :hide:
+
+       >>> import os
+       >>> for extension in ['', '.tokens.npy', '.offsets.npy', '.json']:
+       ...     os.remove('sentences.txt' + extension)
+
+    """
+    provides_sources = ('features',)
+    default_scheme = None
+
+    def __init__(self, prefixes, dictionary=None, **kwargs):
+        super(BinaryTextFile, self).__init__(**kwargs)
+        self.prefixes = prefixes
+        if dictionary is not None:
+            expected_hash = vocabulary_hash(dictionary)
+            for prefix in prefixes:
+                with open(prefix + '.json') as f:
+                    if json.load(f)['vocabulary_hash'] != expected_hash:
+                        raise ValueError("{} was numberized with a different "
+                                         "dictionary".format(prefix))
+
+    @property
+    def tokens(self):
+        """The memory-mapped token arrays of each file."""
+        if not hasattr(self, '_tokens'):
+            self._load()
+        return self._tokens
+
+    @property
+    def offsets(self):
+        """The memory-mapped sentence offsets of each file."""
+        if not hasattr(self, '_offsets'):
+            self._load()
+        return self._offsets
+
+    @property
+    def num_examples(self):
+        if not hasattr(self, '_cumulative_lengths'):
+            self._load()
+        return int(self._cumulative_lengths[-1])
+
+    def _load(self):
+        self._tokens = [numpy.load(prefix + '.tokens.npy', mmap_mode='r')
+                        for prefix in self.prefixes]
+        self._offsets = [numpy.load(prefix + '.offsets.npy', mmap_mode='r')
+                         for prefix in self.prefixes]
+        self._cumulative_lengths = numpy.cumsum(
+            [len(offsets) - 1 for offsets in self._offsets])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for attr in ['_tokens', '_offsets', '_cumulative_lengths']:
+            state.pop(attr, None)
+        return state
+
+    def open(self):
+        return IndexedTextFileState()
+
+    def reset(self, state):
+        state.position = 0
+        return state
+
+    def _get_sentence(self, index):
+        tokens, offsets = self.tokens, self.offsets
+        partition_index = numpy.searchsorted(self._cumulative_lengths, index,
+                                             side='right')
+        if partition_index > 0:
+            index -= self._cumulative_lengths[partition_index - 1]
+        start, stop = offsets[partition_index][index:index + 2]
+        return tokens[partition_index][start:stop]
+
+    def get_data(self, state=None, request=None):
+        if request is None:
+            if state.position >= self.num_examples:
+                raise StopIteration
+            sentence = self._get_sentence(state.position)
+            state.position += 1
+            return (sentence,)
+        if isinstance(request, numbers.Integral):
+            request = _next_indices(state, request, self.num_examples)
+        if not all(0 <= index < self.num_examples for index in request):
+            raise ValueError("sentence index out of range")
+        return ([self._get_sentence(index) for index in request],)
 
 
 class OneBillionWord(TextFile):
@@ -210,7 +727,10 @@ class NGramStream(CachedDataStream):
     Notes
     -----
     This class inherits from :class:`.CachedDataStream` because it makes
-    use of a cache to store the sentences from the wrapped data stream in.
+    use of a cache to store the n-grams extracted from the sentences of the
+    wrapped data stream in. The n-grams of a batch of sentences are
+    extracted all at once, by taking strided windows over the concatenated
+    sentences.
 
     """
     def __init__(self, ngram_order, data_stream, target_source='targets',
@@ -222,25 +742,31 @@ class NGramStream(CachedDataStream):
         self.ngram_order = ngram_order
 
     def get_data(self, request=None):
-        if not self.cache[0]:
-            self._cache()
-        features, targets = [], []
-        for i, sentence in enumerate(self.cache[0]):
-            for j in range(request):
-                features.append(sentence[j:j + self.ngram_order])
-                targets.append([sentence[j + self.ngram_order]])
-                if j + self.ngram_order == len(sentence) - 1:
-                    sentence_ended = True
-                    break
-                elif len(features) == request:
-                    sentence_ended = False
-                    break
-            if sentence_ended:
-                self.cache[0].pop(0)
-                if not self.cache[0]:
-                    self._cache()
-            else:
-                self.cache[0][0] = self.cache[0][0][j + 1:]
-            if len(features) == request:
+        while request > len(self.cache[0]):
+            try:
+                self._cache()
+            except StopIteration:
+                if not len(self.cache[0]):
+                    raise
                 break
-        return tuple(numpy.asarray(data) for data in (features, targets))
+        return self._take(request)
+
+    def _cache(self):
+        sentences = [numpy.asarray(sentence) for sentence
+                     in next(self.child_epoch_iterator)[0]]
+        lengths = numpy.array([len(sentence) for sentence in sentences])
+        tokens = (numpy.concatenate(sentences) if sentences
+                  else numpy.zeros(0, dtype='int64'))
+
+        # An n-gram can start at any position that is followed by at
+        # least `ngram_order` tokens of the same sentence
+        ends = numpy.repeat(numpy.cumsum(lengths), lengths)
+        starts, = numpy.nonzero(
+            numpy.arange(len(tokens)) + self.ngram_order < ends)
+        windows = as_strided(
+            tokens, shape=(max(len(tokens) - self.ngram_order, 0),
+                           self.ngram_order + 1),
+            strides=tokens.strides * 2)
+        ngrams = windows[starts]
+        self._extend_cache((ngrams[:, :self.ngram_order],
+                            ngrams[:, self.ngram_order:]))
@@ -17,16 +17,22 @@ to be gradually changed, aiming to use only stable and simple data formats
 for dumps, such as for instance .npz files.
 
 """
+import hashlib
+import io
+import json
 import logging
 import os
 import os.path
+import tempfile
 from collections import OrderedDict
 
 import dill
 import numpy
+import six
 
 from blocks.bricks.base import Brick
 from blocks.select import Selector
+from blocks.utils import secure_write
 
 logger = logging.getLogger(__name__)
 
@@ -59,13 +65,16 @@ def load_parameter_values(path):
     Parameters
     ----------
     path : str or file
-        The source for loading from.
+        The source for loading from. Can also be the path to the manifest
+        of a checkpoint saved by :class:`ParameterCheckpointStore`.
 
     Returns
     -------
     A dictionary of (parameter name, numpy array) pairs.
 
     """
+    if isinstance(path, six.string_types) and path.endswith('.json'):
+        return ParameterCheckpointStore.load(path)
     source = numpy.load(path)
     param_values = {name.replace("-", "/"): value
                     for name, value in source.items()}
@@ -73,6 +82,181 @@ def load_parameter_values(path):
     return param_values
 
 
+class ParameterCheckpointStore(object):
+    """Incremental, deduplicated storage of parameter checkpoints.
+
+    Each parameter is split into chunks of a fixed number of bytes, which
+    are stored in files named after the hash of their contents. A
+    checkpoint is a manifest listing the chunks of each parameter. Chunks
+    that didn't change since a previous checkpoint are hence neither
+    written again nor stored twice, which for models with large, sparsely
+    updated parameters (e.g. the embeddings of a lookup table) saves most
+    of the I/O and disk space.
+
+    The layout of the folder is::
+
+        chunks/<hash>        the contents of the chunks
+        manifests/<n>.json   the manifest of the n-th checkpoint
+
+    Parameters
+    ----------
+    folder : str
+        The path to the folder of the store. Will be created if it doesn't
+        exist.
+    chunk_size : int, optional
+        The size of the chunks in bytes. By default 1 MB.
+    keep_last : int, optional
+        If given, only the last `keep_last` checkpoints are kept, and the
+        chunks which are no longer used by any of them are deleted.
+
+    """
+    def __init__(self, folder, chunk_size=2 ** 20, keep_last=None):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        if keep_last is not None and keep_last < 1:
+            raise ValueError("must keep at least one checkpoint")
+        self.keep_last = keep_last
+
+    @property
+    def chunks_folder(self):
+        return os.path.join(self.folder, 'chunks')
+
+    @property
+    def manifests_folder(self):
+        return os.path.join(self.folder, 'manifests')
+
+    @property
+    def checkpoints(self):
+        """The paths to the manifests of the checkpoints, oldest first."""
+        if not os.path.isdir(self.manifests_folder):
+            return []
+        return [os.path.join(self.manifests_folder, manifest) for manifest
+                in sorted(os.listdir(self.manifests_folder))
+                if manifest.endswith('.json')]
+
+    def save(self, param_values):
+        """Save a checkpoint.
+
+        Parameters
+        ----------
+        param_values : dict of (parameter name, numpy array)
+            The parameter values.
+
+        Returns
+        -------
+        path : str
+            The path to the manifest of the new checkpoint, which can be
+            passed to :func:`load_parameter_values`.
+
+        """
+        for folder in [self.folder, self.chunks_folder,
+                       self.manifests_folder]:
+            if not os.path.exists(folder):
+                os.mkdir(folder)
+        stored_chunks = set(os.listdir(self.chunks_folder))
+        new_chunks = OrderedDict()
+        manifest = OrderedDict()
+        for name, value in param_values.items():
+            # Unlike ascontiguousarray, keeps 0-d arrays 0-d
+            value = numpy.require(value, requirements='C')
+            data = memoryview(value.reshape(-1).view('uint8'))
+            chunks = []
+            for start in range(0, len(data), self.chunk_size):
+                chunk = data[start:start + self.chunk_size]
+                digest = hashlib.sha1(chunk).hexdigest()
+                if digest not in stored_chunks:
+                    new_chunks[digest] = chunk
+                chunks.append(digest)
+            manifest[name] = {'dtype': value.dtype.str,
+                              'shape': list(value.shape),
+                              'chunks': chunks}
+        self._write_chunks(new_chunks)
+
+        checkpoints = self.checkpoints
+        number = (int(os.path.splitext(os.path.basename(
+            checkpoints[-1]))[0]) + 1 if checkpoints else 0)
+        path = os.path.join(self.manifests_folder,
+                            '{:08d}.json'.format(number))
+        secure_write(json.dumps(manifest).encode('utf-8'), path)
+        if self.keep_last is not None:
+            self.prune()
+        return path
+
+    def _write_chunks(self, chunks):
+        """Atomically write new chunks.
+
+        All the chunks are written to temporary files before any of them
+        is synced to disk, so that the disk can write them together, and
+        renamed once they are all synced.
+
+        """
+        temps = []
+        try:
+            for chunk in chunks.values():
+                with tempfile.NamedTemporaryFile(
+                        dir=self.chunks_folder, delete=False) as f:
+                    temps.append(f.name)
+                    f.write(chunk.tobytes())
+            for temp in temps:
+                descriptor = os.open(temp, os.O_RDONLY)
+                try:
+                    os.fsync(descriptor)
+                finally:
+                    os.close(descriptor)
+            for temp, digest in zip(temps, chunks):
+                os.rename(temp, os.path.join(self.chunks_folder, digest))
+        except Exception:
+            for temp in temps:
+                if os.path.exists(temp):
+                    os.remove(temp)
+            raise
+
+    def prune(self):
+        """Delete all but the last checkpoints and their unused chunks."""
+        checkpoints = self.checkpoints
+        for path in checkpoints[:-self.keep_last]:
+            os.remove(path)
+        used_chunks = set()
+        for path in checkpoints[-self.keep_last:]:
+            for parameter in self._read_manifest(path).values():
+                used_chunks.update(parameter['chunks'])
+        for chunk in set(os.listdir(self.chunks_folder)) - used_chunks:
+            os.remove(os.path.join(self.chunks_folder, chunk))
+
+    @staticmethod
+    def _read_manifest(path):
+        with open(path) as f:
+            return json.load(f, object_pairs_hook=OrderedDict)
+
+    @classmethod
+    def load(cls, path):
+        """Load the parameter values of a checkpoint.
+
+        Parameters
+        ----------
+        path : str
+            The path to the manifest of the checkpoint.
+
+        Returns
+        -------
+        A dictionary of (parameter name, numpy array) pairs.
+
+        """
+        chunks_folder = os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(path))),
+            'chunks')
+        param_values = OrderedDict()
+        for name, parameter in cls._read_manifest(path).items():
+            data = bytearray()
+            for chunk in parameter['chunks']:
+                with open(os.path.join(chunks_folder, chunk), 'rb') as f:
+                    data.extend(f.read())
+            param_values[name] = numpy.frombuffer(
+                data, dtype=parameter['dtype']).reshape(
+                    tuple(parameter['shape']))
+        return param_values
+
+
 def extract_parameter_values(bricks):
     """Extract parameter values from a bricks hierarchy.
 
@@ -145,19 +329,49 @@ class MainLoopDumpManager(object):
     ----------
     folder : str
         The path to the dump root folder.
+    incremental : bool, optional
+        If ``True``, the parameters are saved in a
+        :class:`ParameterCheckpointStore` instead of a single ``.npz``
+        file, so that only the parts of the parameters that changed since
+        the last dump are written. Either kind of dump can be loaded
+        regardless of this setting, the last checkpoint of the store being
+        loaded. ``False`` by default.
+    keep_last : int, optional
+        The number of checkpoints kept in the store when `incremental` is
+        ``True``. By default 1.
 
     Notes
     -----
     Requires the model to be a Brick or a list of Bricks.
 
     """
-    def __init__(self, folder):
+    # Defaults for the managers unpickled from older dumps
+    incremental = False
+    keep_last = 1
+
+    def __init__(self, folder, incremental=False, keep_last=1):
         self.folder = folder
+        self.incremental = incremental
+        self.keep_last = keep_last
 
     @property
     def path_to_parameters(self):
         return "{}/{}".format(self.folder, "params.npz")
 
+    @property
+    def parameter_store(self):
+        return ParameterCheckpointStore(
+            "{}/{}".format(self.folder, "params"),
+            keep_last=self.keep_last)
+
+    def _save_parameters(self, param_values):
+        if self.incremental:
+            self.parameter_store.save(param_values)
+        else:
+            parameters = io.BytesIO()
+            save_parameter_values(param_values, parameters)
+            secure_write(parameters.getvalue(), self.path_to_parameters)
+
     @property
     def path_to_iteration_state(self):
         return "{}/{}".format(self.folder, "iteration_state.pkl")
@@ -172,8 +386,7 @@ class MainLoopDumpManager(object):
         return "{}/{}".format(self.folder, "log")
 
     def dump_parameters(self, main_loop):
-        save_parameter_values(extract_parameter_values(main_loop.model),
-                              self.path_to_parameters)
+        self._save_parameters(extract_parameter_values(main_loop.model))
 
     def dump_iteration_state(self, main_loop):
         with open(self.path_to_iteration_state, "wb") as destination:
@@ -197,7 +410,43 @@ class MainLoopDumpManager(object):
         self.dump_iteration_state(main_loop)
         self.dump_log(main_loop)
 
+    def snapshot(self, main_loop):
+        """Take an in-memory snapshot of the state to dump.
+
+        The snapshot can be written to disk with :meth:`dump_snapshot`,
+        e.g. in a background thread, while training continues.
+
+        Returns
+        -------
+        snapshot : tuple
+            A tuple with copies of the parameter values, and the pickled
+            iteration state and log.
+
+        """
+        param_values = OrderedDict(
+            (name, numpy.array(value)) for name, value
+            in extract_parameter_values(main_loop.model).items())
+        return (param_values, dill.dumps(main_loop.iteration_state),
+                dill.dumps(main_loop.log))
+
+    def dump_snapshot(self, snapshot):
+        """Dumps a snapshot taken by :meth:`snapshot` to the root folder.
+
+        Each file is written atomically, and synced to disk.
+
+        """
+        param_values, iteration_state, log = snapshot
+        if not os.path.exists(self.folder):
+            os.mkdir(self.folder)
+        self._save_parameters(param_values)
+        secure_write(iteration_state, self.path_to_iteration_state)
+        secure_write(log, self.path_to_log)
+
     def load_parameters(self):
+        if self.incremental or not os.path.exists(self.path_to_parameters):
+            checkpoints = self.parameter_store.checkpoints
+            if checkpoints:
+                return load_parameter_values(checkpoints[-1])
         return load_parameter_values(self.path_to_parameters)
 
     def load_iteration_state(self):
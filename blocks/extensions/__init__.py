@@ -103,6 +103,18 @@ class TrainingExtension(object):
         pass
 
 
+def _previous_iterations_done(status):
+    """The number of iterations done before the last batch.
+
+    A batch can count as several iterations (see
+    :class:`.GradientDescent`), so that conditions on the number of
+    iterations check whether it was reached during the last batch.
+
+    """
+    return (status.iterations_done -
+            getattr(status, '_last_batch_iterations', 1))
+
+
 @add_metaclass(ABCMeta)
 class SimpleExtension(TrainingExtension):
     """A base class for simple extensions.
@@ -140,6 +152,12 @@ class SimpleExtension(TrainingExtension):
     every_n_batches : int, optional
         If not ``None``, :meth:`do` is invoked after every n-th batch.
 
+    Notes
+    -----
+    When a batch counts as several iterations, the conditions on the
+    number of batches are fulfilled after the batch during which the
+    number of iterations was reached.
+
     """
     def __init__(self, before_training=False, before_first_epoch=False,
                  on_resumption=False, on_interrupt=False,
@@ -211,13 +229,15 @@ class SimpleExtension(TrainingExtension):
         self.add_condition(
             "after_batch",
             predicate=lambda log:
-                log.status.iterations_done == n_batches)
+                _previous_iterations_done(log.status) < n_batches <=
+                log.status.iterations_done)
 
     def invoke_every_n_batches(self, n_batches):
         self.add_condition(
             "after_batch",
             predicate=lambda log:
-                log.status.iterations_done % n_batches == 0)
+                _previous_iterations_done(log.status) // n_batches <
+                log.status.iterations_done // n_batches)
 
     @abstractmethod
     def do(self, which_callback, *args):
@@ -369,11 +389,12 @@ class Timing(TrainingExtension):
         self.batch_started_at = self.clock_function()
 
     def after_batch(self, batch):
-        self.log.current_row.iteration_took = (
-            self.clock_function() - self.batch_started_at)
-        self.log.current_row.total_took = (
-            self.log.status._total_before_interrupted +
-            self.clock_function() - self.started_at)
+        status = self.log.status
+        now = self.clock_function()
+        self.log.add_records(status.iterations_done, {
+            'iteration_took': now - self.batch_started_at,
+            'total_took': (status._total_before_interrupted +
+                           now - self.started_at)})
 
     def after_epoch(self):
         self.log.current_row.epoch_took = (
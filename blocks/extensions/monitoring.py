@@ -3,19 +3,25 @@ import logging
 
 from blocks.extensions import SimpleExtension
 from blocks.algorithms import DifferentiableCostMinimizer
-from blocks.monitoring.evaluators import AggregationBuffer, DatasetEvaluator
+from blocks.monitoring.evaluators import (
+    AggregationBuffer, BackgroundEvaluator, DatasetEvaluator)
+from blocks.utils import named_copy
 
 PREFIX_SEPARATOR = '_'
 logger = logging.getLogger()
 
 
-def _add_records(log, prefix, record_tuples):
+def _add_records(log, prefix, record_tuples, time=None):
     """Helper function to add monitoring records to the log."""
+    records = {}
     for name, value in record_tuples:
         if not name:
             raise ValueError("monitor variable without name")
         prefixed_name = prefix + PREFIX_SEPARATOR + name if prefix else name
-        setattr(log.current_row, prefixed_name, value)
+        records[prefixed_name] = value
+    if time is None:
+        time = log.status.iterations_done
+    log.add_records(time, records)
 
 
 class DataStreamMonitoring(SimpleExtension):
@@ -34,26 +40,188 @@ class DataStreamMonitoring(SimpleExtension):
     prefix : str, optional
         A prefix to add to the names when adding records to the log. An
         underscore will be used to separate the prefix.
+    manager : :class:`MonitoringManager`, optional
+        If given, the variables are evaluated by the manager, together
+        with the variables of the other extensions of the manager that
+        monitor the same data stream at the same time.
+    background : bool, optional
+        If ``True``, the evaluation is done in a background process while
+        training continues. See :class:`.BackgroundEvaluator`. The values
+        are written to the log at the iteration at which the evaluation
+        was started, as soon as they are available and at the latest
+        after training. ``False`` by default. Can not be used together
+        with `manager`.
 
     """
     PREFIX_SEPARATOR = '_'
 
-    def __init__(self, variables, data_stream, prefix=None, **kwargs):
+    def __init__(self, variables, data_stream, prefix=None, manager=None,
+                 background=False, **kwargs):
         kwargs.setdefault("after_every_epoch", True)
         kwargs.setdefault("before_first_epoch", True)
         super(DataStreamMonitoring, self).__init__(**kwargs)
-        self._evaluator = DatasetEvaluator(variables)
+        self.variables = variables
         self.data_stream = data_stream
         self.prefix = prefix
+        self.manager = manager
+        self._background_evaluator = None
+        if manager is not None:
+            if background:
+                raise ValueError("background evaluation is not supported "
+                                 "with a monitoring manager")
+            manager.register(self)
+        else:
+            self._evaluator = DatasetEvaluator(variables)
+            if background:
+                self._background_evaluator = BackgroundEvaluator(
+                    self._evaluator, data_stream)
+
+    def triggered(self, callback_name):
+        """Check if :meth:`do` is invoked from the given callback now."""
+        return any(name == callback_name and predicate(self.main_loop.log)
+                   for name, predicate, _ in self._conditions)
+
+    def dispatch(self, callback_invoked, *from_main_loop):
+        """Call :meth:`do` and write the background results, if any."""
+        super(DataStreamMonitoring, self).dispatch(callback_invoked,
+                                                   *from_main_loop)
+        if self._background_evaluator is not None:
+            finished = callback_invoked == 'after_training'
+            self._write_results(
+                self._background_evaluator.results(wait=finished))
+            if finished:
+                self._background_evaluator.close()
+
+    def _write_results(self, results):
+        if results is not None:
+            time, value_dict = results
+            _add_records(self.main_loop.log, self.prefix, value_dict.items(),
+                         time)
+            logger.info("Monitoring on auxiliary data finished")
 
     def do(self, callback_name, *args):
         """Write the values of monitored variables to the log."""
         logger.info("Monitoring on auxiliary data started")
-        value_dict = self._evaluator.evaluate(self.data_stream)
+        if self._background_evaluator is not None:
+            self._write_results(self._background_evaluator.start(
+                self.main_loop.status.iterations_done))
+            return
+        if self.manager is None:
+            value_dict = self._evaluator.evaluate(self.data_stream)
+        else:
+            value_dict = self.manager.evaluate(self, callback_name)
         _add_records(self.main_loop.log, self.prefix, value_dict.items())
         logger.info("Monitoring on auxiliary data finished")
 
 
+class MonitoringManager(object):
+    """Evaluates several monitoring extensions in a single pass.
+
+    The :class:`DataStreamMonitoring` extensions given this manager do
+    not evaluate their variables separately. When one of them is
+    invoked, the manager evaluates the variables of all its extensions
+    that monitor the same data stream and are invoked from the same
+    callback of the main loop, with a single compiled function and a
+    single pass over the data. The values are then handed out to the
+    extensions as they are invoked.
+
+    The evaluators are compiled on first use, one for each combination
+    of extensions evaluated together.
+
+    Examples
+    --------
+    >>> manager = MonitoringManager()
+    >>> extensions = [
+    ...     DataStreamMonitoring([cost], valid_stream, prefix='valid',
+    ...                          manager=manager),
+    ...     DataStreamMonitoring([error_rate], valid_stream,
+    ...                          prefix='valid', every_n_batches=100,
+    ...                          manager=manager)]  # doctest: +SKIP
+
+    """
+    def __init__(self):
+        self.extensions = []
+        self._evaluators = {}
+        self._status = None
+        self._evaluated = set()
+        self._values = {}
+
+    def register(self, extension):
+        """Add a :class:`DataStreamMonitoring` extension to the manager."""
+        self.extensions.append(extension)
+
+    def evaluate(self, extension, callback_name):
+        """Return the values of the variables monitored by an extension.
+
+        Parameters
+        ----------
+        extension : :class:`DataStreamMonitoring`
+            The extension registered with this manager.
+        callback_name : str
+            The callback from which the extension is invoked.
+
+        Returns
+        -------
+        A mapping from the names of the variables of the extension to
+        their values.
+
+        """
+        index = self.extensions.index(extension)
+        status = extension.main_loop.status
+        current_status = (callback_name, status.iterations_done,
+                          status.epochs_done)
+        if current_status != self._status:
+            self._status = current_status
+            self._evaluated = set()
+            self._values = {}
+        if index not in self._values:
+            group = [i for i, other in enumerate(self.extensions)
+                     if i not in self._evaluated and
+                     other.data_stream is extension.data_stream and
+                     other.triggered(callback_name)]
+            if index not in group:
+                group.append(index)
+            self._values.update(self._evaluate(tuple(sorted(group))))
+            self._evaluated.update(group)
+        return self._values.pop(index)
+
+    def _evaluate(self, group):
+        if group not in self._evaluators:
+            self._evaluators[group] = self._create_evaluator(group)
+        evaluator, record_names = self._evaluators[group]
+        values = evaluator.evaluate(self.extensions[group[0]].data_stream)
+        return dict((index, dict((name, values[merged_name])
+                                 for name, merged_name in names))
+                    for index, names in zip(group, record_names))
+
+    def _create_evaluator(self, group):
+        """Merge the variables of the extensions into one evaluator."""
+        variables = []
+        merged_names = {}
+        record_names = []
+        for index in group:
+            names = []
+            for variable in self.extensions[index].variables:
+                if variable not in merged_names:
+                    merged_name = variable.name
+                    suffix = 0
+                    while merged_name in merged_names.values():
+                        suffix += 1
+                        merged_name = '{}_{}'.format(variable.name, suffix)
+                    if merged_name != variable.name:
+                        copy = named_copy(variable, merged_name)
+                        if hasattr(variable.tag, 'aggregation_scheme'):
+                            copy.tag.aggregation_scheme = (
+                                variable.tag.aggregation_scheme)
+                        variables.append(copy)
+                    else:
+                        variables.append(variable)
+                    merged_names[variable] = merged_name
+                names.append((variable.name, merged_names[variable]))
+            record_names.append(names)
+        return DatasetEvaluator(variables), record_names
+
+
 class TrainingDataMonitoring(SimpleExtension):
     """Monitors values of Theano variables on training batches.
 
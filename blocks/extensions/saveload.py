@@ -1,10 +1,15 @@
 """Extensions for saving and loading the state of a training process."""
 import os.path
 import logging
+import sys
+import threading
+
+import dill
+import six
 
 from blocks.extensions import SimpleExtension, TrainingExtension
 from blocks.dump import MainLoopDumpManager
-from blocks.utils import reraise_as, secure_dill_dump
+from blocks.utils import reraise_as, secure_dill_dump, secure_write
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +17,86 @@ LOADED_FROM = "loaded_from"
 SAVED_TO = "saved_to"
 
 
+class BackgroundSaver(object):
+    """Runs saving functions in a background thread.
+
+    At most one save is running at any time: starting a new one first
+    waits for the previous one to finish. When a save is waited for, its
+    callback is called in the waiting thread, and an exception raised
+    while saving is then re-raised.
+
+    """
+    def __init__(self):
+        self._thread = None
+        self._exc_info = None
+        self._callback = None
+
+    def _run(self, function, args):
+        try:
+            function(*args)
+        except Exception:
+            self._exc_info = sys.exc_info()
+
+    def save(self, function, args=(), callback=None):
+        """Wait for the previous save, and start a new one.
+
+        Parameters
+        ----------
+        function : callable
+            The function saving the data.
+        args : tuple, optional
+            The arguments of `function`.
+        callback : callable, optional
+            Called with a boolean telling whether the save succeeded, in
+            the thread that waits for it.
+
+        """
+        self.wait()
+        self._callback = callback
+        self._thread = threading.Thread(target=self._run,
+                                        args=(function, args))
+        self._thread.start()
+
+    def wait(self):
+        """Wait for the save in progress to finish, if any."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        callback, self._callback = self._callback, None
+        exc_info, self._exc_info = self._exc_info, None
+        if callback is not None:
+            callback(exc_info is None)
+        if exc_info is not None:
+            six.reraise(*exc_info)
+
+    def __getstate__(self):
+        return {'_thread': None, '_exc_info': None, '_callback': None}
+
+
+def _start_background_save(main_loop, destination, saver, function,
+                           take_snapshot):
+    """Save a snapshot in the background, recording the outcome.
+
+    The `SAVED_TO` record is made on the current row while the snapshot
+    is taken, so that the saved log contains it, and deleted from the log
+    of the main loop until the snapshot is written. Once it is, the
+    record is made again on the same row, unless the save failed.
+
+    """
+    log = main_loop.log
+    time = log.status.iterations_done
+    log[time][SAVED_TO] = destination
+    try:
+        snapshot = take_snapshot()
+    finally:
+        log.delete_record(time, SAVED_TO)
+
+    def record(success):
+        if success:
+            main_loop.log[time][SAVED_TO] = destination
+    saver.save(function, (snapshot,), record)
+
+
 class SerializeMainLoop(SimpleExtension):
     """Saves a pickled version of the main loop to the disk.
 
@@ -31,11 +116,21 @@ class SerializeMainLoop(SimpleExtension):
         the attribute name preceded by an underscore before the
         `path` extension. The whole main loop will still be pickled
         as usual.
+    background : bool, optional
+        If ``True``, the main loop is pickled in memory when the extension
+        is triggered, but written to disk in a background thread while
+        training continues. A new save waits for the previous one to
+        finish, and all saves are finished after training. The
+        `SAVED_TO` record of the row at which the save started is only
+        made once the file is written. ``False`` by default.
 
     Notes
     -----
     Instead of the standard pickling library, the dill package is used.
 
+    The files are written atomically: a file being written is never left
+    half-written if training is interrupted.
+
     Using pickling for saving the whole main loop object comes with
     certain limitations:
 
@@ -46,29 +141,63 @@ class SerializeMainLoop(SimpleExtension):
 
 
     """
-    def __init__(self, path, save_separately=None, **kwargs):
+    def __init__(self, path, save_separately=None, background=False,
+                 **kwargs):
         kwargs.setdefault("after_training", True)
         super(SerializeMainLoop, self).__init__(**kwargs)
 
         self.path = path
         self.save_separately = save_separately
+        self.background = background
+        self.saver = BackgroundSaver()
 
         if not self.save_separately:
             self.save_separately = []
 
+    def _paths(self):
+        yield None, self.path
+        for attribute in self.save_separately:
+            root, ext = os.path.splitext(self.path)
+            yield attribute, root + "_" + attribute + ext
+
     def do(self, callback_name, *args):
         """Pickle the main loop object to the disk."""
+        # A failure of the previous background save is recorded on its
+        # own row, and raised before this save is attempted
+        self.saver.wait()
         try:
+            self.main_loop.synchronize_algorithm()
+            if self.background:
+                _start_background_save(self.main_loop, self.path,
+                                       self.saver, self._write,
+                                       self._snapshot)
+                return
             self.main_loop.log.current_row[SAVED_TO] = self.path
-            secure_dill_dump(self.main_loop, self.path)
-            for attribute in self.save_separately:
-                root, ext = os.path.splitext(self.path)
-                path = root + "_" + attribute + ext
-                secure_dill_dump(getattr(self.main_loop, attribute), path)
+            for attribute, path in self._paths():
+                secure_dill_dump(
+                    getattr(self.main_loop, attribute) if attribute
+                    else self.main_loop, path)
         except:
             self.main_loop.log.current_row[SAVED_TO] = None
             raise
 
+    def _snapshot(self):
+        return [(dill.dumps(getattr(self.main_loop, attribute) if attribute
+                            else self.main_loop,
+                            fmode=dill.CONTENTS_FMODE), path)
+                for attribute, path in self._paths()]
+
+    @staticmethod
+    def _write(snapshot):
+        for contents, path in snapshot:
+            secure_write(contents, path)
+
+    def dispatch(self, callback_invoked, *from_main_loop):
+        super(SerializeMainLoop, self).dispatch(callback_invoked,
+                                                *from_main_loop)
+        if callback_invoked == 'after_training':
+            self.saver.wait()
+
 
 class LoadFromDump(TrainingExtension):
     """Loads a dump into the main loop.
@@ -113,22 +242,55 @@ class Dump(SimpleExtension):
     state_path : str
         The folder to dump the state to. Will be created it does not
         exist.
+    background : bool, optional
+        If ``True``, only a snapshot of the parameter values, the iteration
+        state and the log is taken when the extension is triggered (see
+        :meth:`.MainLoopDumpManager.snapshot`). The snapshot is written to
+        disk in a background thread while training continues. A new dump
+        waits for the previous one to finish, and all dumps are finished
+        after training. The `SAVED_TO` record of the row at which the dump
+        started is only made once the dump is written. ``False`` by
+        default.
+    incremental : bool, optional
+        If ``True``, only the parts of the parameters that changed since
+        the previous dump are written. See :class:`.MainLoopDumpManager`.
+        ``False`` by default.
+    keep_last : int, optional
+        The number of incremental dumps to keep. By default 1.
 
     Notes
     -----
     Requires the model to be a Brick or a list of Bricks.
 
     """
-    def __init__(self, state_path, **kwargs):
+    def __init__(self, state_path, background=False, incremental=False,
+                 keep_last=1, **kwargs):
         kwargs.setdefault("after_training", True)
         super(Dump, self).__init__(**kwargs)
-        self.manager = MainLoopDumpManager(state_path)
+        self.manager = MainLoopDumpManager(state_path, incremental,
+                                           keep_last)
+        self.background = background
+        self.saver = BackgroundSaver()
 
-    def do(self, callback_name, **kwargs):
+    def do(self, callback_name, *args):
+        # A failure of the previous background dump is recorded on its
+        # own row, and raised before this dump is attempted
+        self.saver.wait()
         try:
-            self.main_loop.log.current_row[SAVED_TO] = (
-                self.manager.folder)
+            self.main_loop.synchronize_algorithm()
+            if self.background:
+                _start_background_save(
+                    self.main_loop, self.manager.folder, self.saver,
+                    self.manager.dump_snapshot,
+                    lambda: self.manager.snapshot(self.main_loop))
+                return
+            self.main_loop.log.current_row[SAVED_TO] = self.manager.folder
             self.manager.dump(self.main_loop)
         except:
             self.main_loop.log.current_row[SAVED_TO] = None
             raise
+
+    def dispatch(self, callback_invoked, *from_main_loop):
+        super(Dump, self).dispatch(callback_invoked, *from_main_loop)
+        if callback_invoked == 'after_training':
+            self.saver.wait()
@@ -1,8 +1,13 @@
 """The event-based main loop of Blocks."""
+import numbers
+import sqlite3
 from abc import ABCMeta, abstractmethod
 from collections import defaultdict
 
+import numpy
+import six
 from six import add_metaclass
+from six.moves import cPickle
 try:
     from pandas import DataFrame
     pandas_available = True
@@ -26,6 +31,8 @@ class AbstractTrainingStatus(object):
         The number of epochs done.
     _epoch_ends : list
         The numbers of the epochs last iterations.
+    _last_batch_iterations : int
+        The number of iterations done by the last batch.
 
     .. todo::
 
@@ -39,6 +46,7 @@ class AbstractTrainingStatus(object):
         self.iterations_done = 0
         self.epochs_done = 0
         self._epoch_ends = []
+        self._last_batch_iterations = 1
 
     @abstractmethod
     def __iter__(self):
@@ -50,6 +58,13 @@ class AbstractTrainingStatus(object):
         pass
 
 
+def _is_default(value, default):
+    """Tell whether a value equals a default value, arrays included."""
+    if default is None:
+        return value is None
+    return numpy.array_equal(value, default)
+
+
 class TrainingLogRow(object):
     """A convenience interface for a row of the training log.
 
@@ -143,8 +158,7 @@ class AbstractTrainingLog(object):
 
         """
         self._check_time(time)
-        default_value = self.get_default_value(key)
-        if value != default_value:
+        if not _is_default(value, self.get_default_value(key)):
             self._add_record(time, key, value)
 
     @abstractmethod
@@ -156,6 +170,65 @@ class AbstractTrainingLog(object):
         """
         pass
 
+    def delete_record(self, time, key):
+        """Deletes a record from the log, if there is one.
+
+        Fetching the record afterwards returns the default value for the
+        `key`.
+
+        """
+        self._check_time(time)
+        self._delete_record(time, key)
+
+    def _delete_record(self, time, key):
+        """Deletes a record from the log.
+
+        The implementation method to be overridden.
+
+        """
+        raise NotImplementedError()
+
+    def truncate(self):
+        """Discards the records made after the log was pickled.
+
+        Called by the main loop when training is resumed. Logs that keep
+        all their records in memory have nothing to discard.
+
+        """
+        pass
+
+    def add_records(self, time, records):
+        """Adds several records with the same time to the log.
+
+        Equivalent to calling :meth:`add_record` for each record, but
+        faster when many records are written at once, e.g. by monitoring
+        extensions.
+
+        Parameters
+        ----------
+        time : int
+            The time of the records.
+        records : dict
+            A dictionary of (key, value) pairs.
+
+        """
+        self._check_time(time)
+        get_default_value = self.get_default_value
+        self._add_records(time, [(key, value)
+                                 for key, value in records.items()
+                                 if not _is_default(
+                                     value, get_default_value(key))])
+
+    def _add_records(self, time, records):
+        """Adds a list of (key, value) records to the log.
+
+        Can be overridden by logs that support adding several records at
+        once more efficiently.
+
+        """
+        for key, value in records:
+            self._add_record(time, key, value)
+
     def fetch_record(self, time, key):
         """Fetches a record from the log.
 
@@ -243,6 +316,16 @@ class TrainingLog(AbstractTrainingLog):
     def _add_record(self, time, key, value):
         self._storage[time][key] = value
 
+    def _add_records(self, time, records):
+        self._storage[time].update(records)
+
+    def _delete_record(self, time, key):
+        records = self._storage.get(time)
+        if records and key in records:
+            del records[key]
+            if not records:
+                del self._storage[time]
+
     def _fetch_record(self, time, key):
         slice_ = self._storage.get(time)
         if not slice_:
@@ -263,3 +346,381 @@ class TrainingLog(AbstractTrainingLog):
 
     def _to_dataframe(self):
         return DataFrame.from_dict(self._storage, orient='index')
+
+
+class SQLiteTrainingLog(AbstractTrainingLog):
+    """A training log storing its records in an SQLite database.
+
+    Only the most recent rows of the log are kept in memory. The older
+    rows are written to a table of time-key-value triples, so that the
+    memory use doesn't grow with the length of training, and pickling the
+    log (e.g. when dumping the main loop) only involves the recent rows.
+
+    Parameters
+    ----------
+    path : str
+        The path to the database file. Records already in the database
+        are part of the log, so that a log can be reopened to inspect it,
+        or to continue training.
+    hot_window : int, optional
+        The number of most recent rows to keep in memory. By default 100.
+
+    Notes
+    -----
+    Numbers, including NumPy scalars and zero-dimensional arrays, are
+    stored as SQLite numbers (and hence returned as Python numbers),
+    strings as text. All other values are pickled.
+
+    The rows leaving the memory are written to the database in blocks of
+    `hot_window` rows, so that training doesn't wait for the disk at
+    every iteration.
+
+    When unpickled, the log refers to the same database file, but only
+    shows the records up to the time it was pickled at, so that e.g. an
+    old checkpoint can be inspected while training continues. The
+    records written after that time are only deleted by
+    :meth:`truncate`, which the main loop calls when training is
+    resumed.
+
+    """
+    def __init__(self, path, hot_window=100):
+        self.path = path
+        self.hot_window = hot_window
+        self._hot = defaultdict(dict)
+        self._latest = 0
+        self._next_eviction = 0
+        self._default_values = {}
+        self._status = TrainingStatus()
+
+    @property
+    def connection(self):
+        if not hasattr(self, '_connection'):
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "time INTEGER, key TEXT, value, PRIMARY KEY (time, key))")
+        return self._connection
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, numpy.ndarray) and value.ndim == 0:
+            value = value[()]
+        if isinstance(value, numpy.generic) and value.dtype.kind in 'iuf':
+            value = value.item()
+        if (isinstance(value, (numbers.Integral, float)) and
+                not isinstance(value, bool)):
+            return value
+        if isinstance(value, six.text_type):
+            return value
+        return sqlite3.Binary(cPickle.dumps(value, protocol=2))
+
+    @staticmethod
+    def _decode(value):
+        if value is None or isinstance(value, (numbers.Number,
+                                               six.text_type)):
+            return value
+        return cPickle.loads(bytes(value))
+
+    def get_default_value(self, key):
+        return self._default_values.get(key)
+
+    def set_default_value(self, key, value):
+        self._default_values[key] = value
+
+    def _add_record(self, time, key, value):
+        if time < self._latest - self.hot_window and time not in self._hot:
+            self._write([(time, key, value)])
+            return
+        self._hot[time][key] = value
+        if time > self._latest:
+            self._latest = time
+            if time >= self._next_eviction:
+                self._evict()
+
+    def _delete_record(self, time, key):
+        self._hot.get(time, {}).pop(key, None)
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM records WHERE time = ? AND key = ?",
+                (time, key))
+
+    def _write(self, records):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?)",
+                [(time, key, self._encode(value))
+                 for time, key, value in records])
+
+    def _evict(self):
+        old_times = [time for time in self._hot
+                     if time < self._latest - self.hot_window]
+        if old_times:
+            self._write([(time, key, value) for time in old_times
+                         for key, value in self._hot[time].items()])
+            for time in old_times:
+                del self._hot[time]
+        # The rows are evicted again once the window holds twice as many
+        self._next_eviction = self._latest + self.hot_window + 1
+
+    def flush(self):
+        """Write all the records held in memory to the database."""
+        self._write([(time, key, value) for time, records in self._hot.items()
+                     for key, value in records.items()])
+
+    def truncate(self):
+        """Delete the records written after the log was pickled."""
+        with self.connection:
+            self.connection.execute("DELETE FROM records WHERE time > ?",
+                                    (self._latest,))
+
+    def _in_memory(self, time):
+        return time in self._hot or time >= self._latest - self.hot_window
+
+    def _fetch_record(self, time, key):
+        if self._in_memory(time):
+            return self._hot.get(time, {}).get(key)
+        row = self.connection.execute(
+            "SELECT value FROM records WHERE time = ? AND key = ?",
+            (time, key)).fetchone()
+        return self._decode(row[0]) if row else None
+
+    def fetch_records(self, key, start=None, stop=None):
+        """Fetch the records of a key in a range of time.
+
+        Parameters
+        ----------
+        key : str
+            The key of the records.
+        start : int, optional
+            The first time step to include. By default the records are
+            returned from the start of training.
+        stop : int, optional
+            The time step at which to stop (exclusive). By default all the
+            records until the end are returned.
+
+        Returns
+        -------
+        list of (time, value) pairs
+            The records, sorted by time.
+
+        """
+        self.flush()
+        start = 0 if start is None else start
+        stop = (self._latest + 1 if stop is None
+                else min(stop, self._latest + 1))
+        return [(time, self._decode(value)) for time, value in
+                self.connection.execute(
+                    "SELECT time, value FROM records WHERE key = ? AND "
+                    "time >= ? AND time < ? ORDER BY time",
+                    (key, start, stop))]
+
+    def get_row_iterator(self, time):
+        if self._in_memory(time):
+            records = list(self._hot.get(time, {}).items())
+        else:
+            records = [(key, self._decode(value)) for key, value in
+                       self.connection.execute(
+                           "SELECT key, value FROM records WHERE time = ?",
+                           (time,))]
+        for key, value in records:
+            yield key, value
+
+    def __iter__(self):
+        self.flush()
+        for time, key, value in self.connection.execute(
+                "SELECT time, key, value FROM records WHERE time <= ? "
+                "ORDER BY time", (self._latest,)):
+            yield time, key, self._decode(value)
+
+    def get_status(self):
+        return self._status
+
+    def _to_dataframe(self):
+        self.flush()
+        columns = defaultdict(dict)
+        for time, key, value in self.connection.execute(
+                "SELECT time, key, value FROM records WHERE time <= ?",
+                (self._latest,)):
+            columns[key][time] = self._decode(value)
+        return DataFrame(dict(columns)).sort_index()
+
+    def __getstate__(self):
+        self.flush()
+        state = self.__dict__.copy()
+        state.pop('_connection', None)
+        return state
+
+
+class CompactTrainingLog(AbstractTrainingLog):
+    """A training log storing numeric records in typed arrays.
+
+    For each key whose values are numbers (Python or NumPy scalars, or
+    zero-dimensional arrays) the log keeps a sorted array of the times
+    at which the key was recorded, along with an array of booleans,
+    64-bit integers or 64-bit floats holding the values. This takes 16
+    bytes per record (9 for booleans) instead of the hundreds of bytes
+    of a boxed value in a dictionary, and keys recorded rarely (e.g.
+    once per epoch) only take space for the records they have. The
+    arrays are grown by doubling when needed.
+
+    Keys with non-numeric values, or with values of different types
+    (except for a mix of integers and floats, which are stored as
+    floats), are stored in dictionaries like in :class:`TrainingLog`.
+
+    Notes
+    -----
+    Numeric records are returned as Python numbers, whatever type they
+    were recorded with.
+
+    Records are appended in constant amortized time when written in
+    order of time, which is how the main loop writes them. Writing a
+    record before the last one of the same key takes linear time.
+
+    """
+    def __init__(self):
+        self._times = {}
+        self._values = {}
+        self._sizes = {}
+        self._objects = {}
+        self._default_values = {}
+        self._status = TrainingStatus()
+
+    @staticmethod
+    def _get_dtype(value):
+        if isinstance(value, numpy.ndarray) and value.ndim == 0:
+            value = value[()]
+        if isinstance(value, (bool, numpy.bool_)):
+            return numpy.dtype('bool')
+        if isinstance(value, numbers.Integral):
+            return numpy.dtype('int64')
+        if isinstance(value, numbers.Real):
+            return numpy.dtype('float64')
+
+    def get_default_value(self, key):
+        return self._default_values.get(key)
+
+    def set_default_value(self, key, value):
+        self._default_values[key] = value
+
+    def _to_objects(self, key):
+        times = self._times.pop(key)
+        values = self._values.pop(key)
+        size = self._sizes.pop(key)
+        self._objects[key] = dict(zip(times[:size].tolist(),
+                                      values[:size].tolist()))
+
+    def _insert(self, time, key, value):
+        times, values = self._times[key], self._values[key]
+        size = self._sizes[key]
+        # Raises an OverflowError before anything is changed
+        value = numpy.asarray(value, dtype=values.dtype)
+        index = size
+        if size and time <= times[size - 1]:
+            index = numpy.searchsorted(times[:size], time)
+            if times[index] == time:
+                values[index] = value
+                return
+        if size == len(times):
+            self._times[key] = times = numpy.resize(times, 2 * size)
+            self._values[key] = values = numpy.resize(values, 2 * size)
+        times[index + 1:size + 1] = times[index:size].copy()
+        values[index + 1:size + 1] = values[index:size].copy()
+        times[index] = time
+        values[index] = value
+        self._sizes[key] = size + 1
+
+    def _add_record(self, time, key, value):
+        if key not in self._objects:
+            dtype = self._get_dtype(value)
+            values = self._values.get(key)
+            if values is not None and dtype != values.dtype:
+                if (dtype is None or dtype.kind == 'b' or
+                        values.dtype.kind == 'b'):
+                    dtype = None
+                elif values.dtype.kind != 'f':
+                    self._values[key] = values.astype('float64')
+            if dtype is not None:
+                if key not in self._values:
+                    self._times[key] = numpy.zeros(16, dtype='int64')
+                    self._values[key] = numpy.zeros(16, dtype=dtype)
+                    self._sizes[key] = 0
+                try:
+                    self._insert(time, key, value)
+                    return
+                except OverflowError:
+                    pass
+            if key in self._values:
+                self._to_objects(key)
+        self._objects.setdefault(key, {})[time] = value
+
+    def _delete_record(self, time, key):
+        if key in self._values:
+            index = self._find(time, key)
+            if index is not None:
+                size = self._sizes[key]
+                for column in [self._times[key], self._values[key]]:
+                    column[index:size - 1] = column[index + 1:size].copy()
+                self._sizes[key] = size - 1
+        else:
+            self._objects.get(key, {}).pop(time, None)
+
+    def _find(self, time, key):
+        """Return the index of a record of a numeric key, or None."""
+        size = self._sizes[key]
+        index = numpy.searchsorted(self._times[key][:size], time)
+        if index < size and self._times[key][index] == time:
+            return index
+
+    def _fetch_record(self, time, key):
+        if key in self._values:
+            index = self._find(time, key)
+            if index is not None:
+                return self._values[key][index].item()
+            return None
+        return self._objects.get(key, {}).get(time)
+
+    def _all_times(self):
+        """Return the sorted times at which there are records."""
+        times = [self._times[key][:size] for key, size in self._sizes.items()]
+        times.extend(numpy.array(list(records), dtype='int64')
+                     for records in self._objects.values())
+        if not times:
+            return numpy.zeros(0, dtype='int64')
+        return numpy.unique(numpy.concatenate(times))
+
+    def get_row_iterator(self, time):
+        for key in list(self._values) + list(self._objects):
+            value = self._fetch_record(time, key)
+            if value is not None:
+                yield key, value
+
+    def __iter__(self):
+        for time in self._all_times().tolist():
+            for key, value in self.get_row_iterator(time):
+                yield time, key, value
+
+    def get_status(self):
+        return self._status
+
+    def _to_dataframe(self):
+        times = self._all_times()
+        columns = {}
+        for key, values in self._values.items():
+            size = self._sizes[key]
+            values = values[:size]
+            if size == len(times):
+                columns[key] = values.copy()
+                continue
+            column = numpy.empty(
+                len(times), 'float64' if values.dtype.kind != 'b' else object)
+            column[:] = numpy.nan
+            column[numpy.searchsorted(times, self._times[key][:size])] = values
+            columns[key] = column
+        for key, records in self._objects.items():
+            column = numpy.empty(len(times), dtype=object)
+            column[:] = numpy.nan
+            for time, value in records.items():
+                column[numpy.searchsorted(times, time)] = value
+            columns[key] = column
+        return DataFrame(columns, index=times)
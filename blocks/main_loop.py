@@ -33,6 +33,13 @@ class MainLoop(object):
     be gracefully finished, with calling all necessary extension callbacks
     and waiting until they finish.
 
+    When the training algorithm processes batches asynchronously and has
+    a `synchronize` method (e.g. :class:`.HogwildGradientDescent`), the
+    main loop waits for it to process all the batches given so far
+    before the end of every epoch and of training, so that the extensions
+    called then see the parameters trained on all these batches. The
+    `close` method of the algorithm, if any, is called after training.
+
     Parameters
     ----------
     model : object
@@ -101,6 +108,7 @@ class MainLoop(object):
             # called "before_training" could have changed the status
             # of the main loop.
             if self.log.status.iterations_done > 0:
+                self.log.truncate()
                 self._run_extensions('on_resumption')
             while self._run_epoch():
                 pass
@@ -113,9 +121,30 @@ class MainLoop(object):
                 "Attempting to run extensions before exiting...")
             # TODO: change the serialization destination here
         finally:
+            try:
+                self.synchronize_algorithm()
+            except Exception:
+                logger.error(traceback.format_exc())
             self._run_extensions('after_training')
+            close = getattr(self.algorithm, 'close', None)
+            if close is not None:
+                close()
+            stop_workers = getattr(self.data_stream, 'stop_workers', None)
+            if stop_workers is not None:
+                stop_workers()
             signal.signal(signal.SIGINT, self.original_handler)
 
+    def synchronize_algorithm(self):
+        """Wait until the algorithm has processed the batches given to it.
+
+        Extensions that save or evaluate the parameters in the middle of
+        an epoch, e.g. checkpointing ones, should call this method first.
+
+        """
+        synchronize = getattr(self.algorithm, 'synchronize', None)
+        if synchronize is not None:
+            synchronize()
+
     def find_extension(self, name):
         """Find an extension with a given name.
 
@@ -143,6 +172,7 @@ class MainLoop(object):
             self._run_extensions('before_epoch')
         while self._run_iteration():
             pass
+        self.synchronize_algorithm()
         self.status._epoch_started = False
         self.status.epochs_done += 1
         self.status._epoch_ends.append(
@@ -158,7 +188,9 @@ class MainLoop(object):
             return False
         self._run_extensions('before_batch', batch)
         self.algorithm.process_batch(batch)
-        self.status.iterations_done += 1
+        self.status._last_batch_iterations = getattr(self.algorithm,
+                                                     'steps_per_call', 1)
+        self.status.iterations_done += self.status._last_batch_iterations
         self._run_extensions('after_batch', batch)
         self._check_finish_training()
         return True
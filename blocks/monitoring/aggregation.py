@@ -2,8 +2,12 @@
 import logging
 from abc import ABCMeta, abstractmethod
 
+import numpy
+import theano
 from six import add_metaclass
 from theano import tensor
+from theano.ifelse import ifelse
+from theano.tensor.extra_ops import cumsum
 
 from blocks.utils import shared_like
 
@@ -87,9 +91,50 @@ class Aggregator(object):
         self.accumulation_updates = accumulation_updates
 
 
+def _accumulate_elementwise(variable, combine):
+    """Accumulate a variable of unknown shape elementwise.
+
+    The shape of the accumulator is only known once the first batch is
+    processed. Instead of being reset by the initialization, the
+    accumulator takes the value of the variable on the first batch after
+    the initialization, which is then combined with the values on the
+    following batches.
+
+    Parameters
+    ----------
+    variable : :class:`~tensor.TensorVariable`
+        The variable to accumulate.
+    combine : function
+        A function of the accumulator and the value of the variable on a
+        batch returning the new value of the accumulator.
+
+    Returns
+    -------
+    accumulator : :class:`~tensor.TensorSharedVariable`
+        The accumulator.
+    initialization_updates : list of tuples
+        The initialization updates.
+    accumulation_updates : list of tuples
+        The accumulation updates.
+
+    """
+    accumulator = shared_like(variable)
+    started = theano.shared(numpy.array(0, dtype='int8'),
+                            name="started_{}".format(variable.name))
+    value = tensor.unbroadcast(variable, *range(variable.ndim))
+    initialization_updates = [(started, 0)]
+    accumulation_updates = [
+        (accumulator, ifelse(started, combine(accumulator, value), value)),
+        (started, 1)]
+    return accumulator, initialization_updates, accumulation_updates
+
+
 class Mean(AggregationScheme):
     """Aggregation scheme which computes the mean.
 
+    The numerator can have any number of dimensions, in which case the
+    mean is computed elementwise.
+
     Parameters
     ----------
     numerator : :class:`~tensor.TensorVariable`
@@ -103,14 +148,19 @@ class Mean(AggregationScheme):
         self.denominator = denominator
 
     def get_aggregator(self):
-        numerator_acc = shared_like(self.numerator)
+        if self.numerator.ndim > 0:
+            (numerator_acc, initialization_updates,
+             accumulation_updates) = _accumulate_elementwise(
+                self.numerator, lambda acc, value: acc + value)
+        else:
+            numerator_acc = shared_like(self.numerator)
+            initialization_updates = [(numerator_acc, 0.0)]
+            accumulation_updates = [(numerator_acc,
+                                     numerator_acc + self.numerator)]
         denominator_acc = shared_like(self.denominator)
-        initialization_updates = [(numerator_acc, 0.0),
-                                  (denominator_acc, 0.0)]
-        accumulation_updates = [(numerator_acc,
-                                 numerator_acc + self.numerator),
-                                (denominator_acc,
-                                 denominator_acc + self.denominator)]
+        initialization_updates.append((denominator_acc, 0.0))
+        accumulation_updates.append((denominator_acc,
+                                     denominator_acc + self.denominator))
         aggregator = Aggregator(aggregation_scheme=self,
                                 initialization_updates=initialization_updates,
                                 accumulation_updates=accumulation_updates,
@@ -151,3 +201,172 @@ class TakeLast(AggregationScheme):
                               (self.storage, tensor.zeros_like(self.storage))],
                           accumulation_updates=[(self.storage, self.variable)],
                           readout_variable=self.storage)
+
+
+class _Elementwise(AggregationScheme):
+    """Aggregation scheme combining the values on batches elementwise."""
+    def __init__(self, variable):
+        self.variable = variable
+
+    @abstractmethod
+    def combine(self, accumulator, value):
+        """Combine the accumulated and the new values."""
+        pass
+
+    def get_aggregator(self):
+        (accumulator, initialization_updates,
+         accumulation_updates) = _accumulate_elementwise(self.variable,
+                                                         self.combine)
+        return Aggregator(aggregation_scheme=self,
+                          initialization_updates=initialization_updates,
+                          accumulation_updates=accumulation_updates,
+                          readout_variable=accumulator)
+
+
+class Sum(_Elementwise):
+    """Aggregation scheme which computes the elementwise sum."""
+    def combine(self, accumulator, value):
+        return accumulator + value
+
+
+class Minimum(_Elementwise):
+    """Aggregation scheme which computes the elementwise minimum."""
+    def combine(self, accumulator, value):
+        return tensor.minimum(accumulator, value)
+
+
+class Maximum(_Elementwise):
+    """Aggregation scheme which computes the elementwise maximum."""
+    def combine(self, accumulator, value):
+        return tensor.maximum(accumulator, value)
+
+
+class Histogram(AggregationScheme):
+    """Aggregation scheme which counts the values falling in bins.
+
+    All the elements of the variable on all the batches are counted in
+    `bins` bins of equal width between `low` and `high`. The readout is a
+    vector of counts.
+
+    Parameters
+    ----------
+    variable : :class:`~tensor.TensorVariable`
+        The variable whose values are counted.
+    bins : int
+        The number of bins.
+    low : float
+        The lower edge of the first bin. Smaller values are counted in
+        the first bin.
+    high : float
+        The higher edge of the last bin. Larger values are counted in the
+        last bin.
+
+    """
+    def __init__(self, variable, bins, low, high):
+        if not high > low:
+            raise ValueError("high must be larger than low")
+        self.variable = variable
+        self.bins = bins
+        self.low = low
+        self.high = high
+
+    @property
+    def bin_edges(self):
+        """The edges of the bins, as in :func:`numpy.histogram`."""
+        return numpy.linspace(self.low, self.high, self.bins + 1)
+
+    def get_aggregator(self):
+        counts = theano.shared(numpy.zeros(self.bins, dtype='int64'),
+                               name="counts_{}".format(self.variable.name))
+        width = (self.high - self.low) / float(self.bins)
+        indices = tensor.clip(
+            tensor.floor((self.variable.flatten() - self.low) / width),
+            0, self.bins - 1).astype('int64')
+        return Aggregator(aggregation_scheme=self,
+                          initialization_updates=[
+                              (counts, tensor.zeros_like(counts))],
+                          accumulation_updates=[
+                              (counts,
+                               tensor.inc_subtensor(counts[indices], 1))],
+                          readout_variable=counts)
+
+
+class Quantile(Histogram):
+    """Aggregation scheme which estimates quantiles with a histogram.
+
+    The values are counted in a fixed number of bins, as with
+    :class:`Histogram`, so that the memory used does not depend on the
+    number of values. The quantiles are interpolated linearly within the
+    bins, hence their precision is the width of the bins.
+
+    Parameters
+    ----------
+    variable : :class:`~tensor.TensorVariable`
+        The variable whose quantiles are estimated.
+    quantiles : float or list of floats
+        The quantiles, between 0 and 1. If a list is given, the readout
+        is a vector. The readout is NaN if there are no values.
+    low : float
+        The lower edge of the first bin.
+    high : float
+        The higher edge of the last bin.
+    bins : int, optional
+        The number of bins, 1000 by default.
+
+    """
+    def __init__(self, variable, quantiles, low, high, bins=1000):
+        super(Quantile, self).__init__(variable, bins, low, high)
+        if not numpy.all((numpy.asarray(quantiles) >= 0) &
+                         (numpy.asarray(quantiles) <= 1)):
+            raise ValueError("quantiles must be between 0 and 1")
+        self.quantiles = quantiles
+
+    def get_aggregator(self):
+        aggregator = super(Quantile, self).get_aggregator()
+        counts = aggregator.readout_variable
+        cumulative_counts = cumsum(counts)
+        total = cumulative_counts[-1]
+        # The targets are computed in float64, and the counts being
+        # integers, targets within the tolerance of a count are rounded to
+        # it, lest the rounding errors move them to the next bin
+        targets = (tensor.constant(numpy.atleast_1d(
+            numpy.asarray(self.quantiles, dtype='float64'))) * total)
+        tolerance = 1e-10 * total
+        # The first non-empty bin in which the cumulative count reaches
+        # the target
+        cumulative_counts_row = cumulative_counts.dimshuffle('x', 0)
+        indices = tensor.minimum(
+            tensor.or_(tensor.lt(cumulative_counts_row,
+                                 (targets - tolerance).dimshuffle(0, 'x')),
+                       tensor.eq(cumulative_counts_row, 0)).sum(axis=1),
+            self.bins - 1)
+        fractions = tensor.clip(
+            (targets - cumulative_counts[indices] + counts[indices]) /
+            tensor.maximum(counts[indices], 1), 0, 1)
+        width = (self.high - self.low) / float(self.bins)
+        readout_variable = tensor.switch(
+            tensor.eq(total, 0), numpy.nan,
+            self.low + (indices + fractions) * width)
+        if numpy.ndim(self.quantiles) == 0:
+            readout_variable = readout_variable[0]
+        aggregator.readout_variable = readout_variable
+        return aggregator
+
+
+def quantile(variable, quantiles, low, high, bins=1000):
+    """Quantiles of a variable over all the batches.
+
+    Returns a copy of the variable with a :class:`Quantile` aggregation
+    scheme.
+
+    """
+    result = variable.copy()
+    result.tag.aggregation_scheme = Quantile(variable, quantiles, low, high,
+                                             bins)
+    result.name = variable.name
+    return result
+
+
+def median(variable, low, high, bins=1000):
+    """Median of a variable over all the batches."""
+    return quantile(variable, 0.5, low, high, bins)
@@ -1,12 +1,12 @@
 from collections import OrderedDict
 import logging
+import traceback
 
-import theano
-
+from blocks import compilation
 from blocks.utils import dict_subset
 from blocks.monitoring.aggregation import _DataIndependent, Mean, TakeLast
 from blocks.graph import ComputationGraph
-from blocks.utils import reraise_as
+from blocks.utils import fork_context, ignore_interrupts, reraise_as
 
 logger = logging.getLogger()
 
@@ -82,7 +82,8 @@ class AggregationBuffer(object):
                                      ' aggregation scheme for %s', v.name)
                         v.tag.aggregation_scheme = Mean(v, 1.0)
                     else:
-                        # TODO: support averaging for multi-dim variables
+                        # The shape can change from batch to batch, use
+                        # the elementwise schemes explicitly to aggregate
                         logger.debug('Multidimensional variable:'
                                      ' using the TakeLast'
                                      ' aggregation scheme for %s', v.name)
@@ -106,12 +107,12 @@ class AggregationBuffer(object):
         """
         logger.debug("Compiling initialization and readout functions")
         if self.initialization_updates:
-            self._initialize_fun = theano.function(
+            self._initialize_fun = compilation.function(
                 [], [], updates=self.initialization_updates)
         else:
             self._initialize_fun = None
 
-        self._readout_fun = theano.function(
+        self._readout_fun = compilation.function(
             [], list(self.readout_variables.values()))
         logger.debug("Initialization and readout functions compiled")
 
@@ -172,7 +173,7 @@ class DatasetEvaluator(object):
 
         """
         if self.buffer_.accumulation_updates:
-            self._accumulate_fun = theano.function(
+            self._accumulate_fun = compilation.function(
                 self.buffer_.inputs, [],
                 updates=self.buffer_.accumulation_updates)
         else:
@@ -220,3 +221,118 @@ class DatasetEvaluator(object):
                 'will not iterate the over data!')
 
         return self.get_aggregated_values()
+
+
+def _evaluation_worker(connection, evaluator, data_stream, params):
+    """Evaluate on the data stream with the parameter values received."""
+    ignore_interrupts()
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        time, param_values = request
+        try:
+            for param, value in zip(params, param_values):
+                param.set_value(value, borrow=True)
+            connection.send((time, evaluator.evaluate(data_stream), None))
+        except Exception:
+            connection.send((time, None, traceback.format_exc()))
+
+
+class BackgroundEvaluator(object):
+    """Runs a :class:`DatasetEvaluator` in a background process.
+
+    The process is forked from the main process when the first evaluation
+    is started, so that it holds the same compiled functions. Each
+    evaluation is done with a snapshot of the values of the shared
+    variables the monitored variables depend on, taken when the
+    evaluation is started. At most one evaluation is running at any time:
+    starting a new one first waits for the previous one to finish.
+
+    Parameters
+    ----------
+    evaluator : :class:`DatasetEvaluator`
+        The evaluator to run.
+    data_stream : instance of :class:`.DataStream`
+        The data stream to evaluate on.
+
+    """
+    def __init__(self, evaluator, data_stream):
+        self.evaluator = evaluator
+        self.data_stream = data_stream
+        self.params = ComputationGraph(
+            evaluator.buffer_.variables).shared_variables
+        self._worker = None
+        self._pending = False
+
+    def _start_worker(self):
+        self._connection, worker_connection = fork_context.Pipe()
+        self._worker = fork_context.Process(
+            target=_evaluation_worker,
+            args=(worker_connection, self.evaluator, self.data_stream,
+                  self.params))
+        self._worker.daemon = True
+        self._worker.start()
+        worker_connection.close()
+
+    def start(self, time):
+        """Start an evaluation with the current parameter values.
+
+        Parameters
+        ----------
+        time : int
+            An identifier of the evaluation, returned with its results,
+            e.g. the number of iterations done.
+
+        Returns
+        -------
+        The results of the previous evaluation if it was still running,
+        as returned by :meth:`results`.
+
+        """
+        results = self.results(wait=True)
+        if self._worker is None:
+            self._start_worker()
+        self._connection.send(
+            (time, [param.get_value() for param in self.params]))
+        self._pending = True
+        return results
+
+    def results(self, wait=False):
+        """Return the results of the finished evaluation, if any.
+
+        Parameters
+        ----------
+        wait : bool, optional
+            If ``True``, wait for the evaluation in progress to finish.
+
+        Returns
+        -------
+        A tuple of the identifier given to :meth:`start` and a mapping
+        from record names to values, or ``None`` if no evaluation has
+        finished since the last call.
+
+        """
+        if not self._pending or not (wait or self._connection.poll()):
+            return None
+        time, values, error = self._connection.recv()
+        self._pending = False
+        if error is not None:
+            raise RuntimeError("The evaluation in the background process "
+                               "failed:\n" + error)
+        return time, values
+
+    def close(self):
+        """Stop the background process."""
+        if self._worker is None:
+            return
+        self._connection.send(None)
+        self._worker.join()
+        self._worker = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_connection', None)
+        state['_worker'] = None
+        state['_pending'] = False
+        return state
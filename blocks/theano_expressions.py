@@ -14,8 +14,7 @@ def L2_norm(tensors):
         The tensors.
 
     """
-    flattened = [tensor.as_tensor_variable(t).flatten() for t in tensors]
-    flattened = [(t if t.ndim > 0 else t.dimshuffle('x'))
-                 for t in flattened]
-    joined = tensor.join(0, *flattened)
-    return tensor.sqrt(tensor.sqr(joined).sum())
+    # Summing the squares of each tensor separately avoids allocating
+    # a joined copy of all the tensors
+    return tensor.sqrt(sum(tensor.sqr(tensor.as_tensor_variable(t)).sum()
+                           for t in tensors))
@@ -1,6 +1,8 @@
-import sys
+import multiprocessing
 import os
 import shutil
+import signal
+import sys
 import tempfile
 from collections import OrderedDict
 
@@ -14,6 +16,13 @@ from theano.gof.graph import Constant
 from theano.tensor.shared_randomstreams import RandomStateSharedVariable
 from theano.tensor.sharedvar import SharedVariable
 
+# Worker processes rely on inheriting the compiled Theano functions and
+# the shared memory of the main process
+if hasattr(multiprocessing, 'get_context'):
+    fork_context = multiprocessing.get_context('fork')
+else:
+    fork_context = multiprocessing
+
 
 def pack(arg):
     """Pack variables into a list.
@@ -473,3 +482,38 @@ def secure_dill_dump(object_, path):
         if "temp" in locals():
             os.remove(temp.name)
         raise
+
+
+def secure_write(contents, path):
+    """Atomically write bytes to a file.
+
+    The contents are written to a temporary file in the same directory,
+    flushed to disk and then renamed to `path`, so that `path` always
+    contains either its old contents or the new ones, even if the process
+    is killed while writing.
+
+    Parameters
+    ----------
+    contents : bytes
+        The data to write.
+    path : str
+        The destination path.
+
+    """
+    temp = tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(os.path.abspath(path)), delete=False)
+    try:
+        with temp:
+            temp.write(contents)
+            temp.flush()
+            os.fsync(temp.fileno())
+        os.rename(temp.name, path)
+    except Exception:
+        if os.path.exists(temp.name):
+            os.remove(temp.name)
+        raise
+
+
+def ignore_interrupts():
+    """Make worker processes leave SIGINT to the main process."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
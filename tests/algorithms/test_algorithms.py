@@ -1,13 +1,16 @@
 import numpy
-from numpy.testing import assert_allclose
+from numpy.testing import assert_allclose, assert_raises
 
+import theano
 from theano import tensor
 
 from blocks.algorithms import (GradientDescent, GradientClipping,
                                CompositeRule, SteepestDescent,
-                               StepRule)
+                               StepRule, Momentum, AdaGrad, RMSProp, Adam)
 from blocks.utils import shared_floatx
 
+floatX = theano.config.floatX
+
 
 def test_gradient_descent():
     W = shared_floatx(numpy.array([[1, 2], [3, 4]]))
@@ -21,6 +24,49 @@ def test_gradient_descent():
     assert_allclose(W.get_value(), -0.5 * W_start_value)
 
 
+def test_gradient_descent_inputs():
+    W = shared_floatx(numpy.array([[1, 2], [3, 4]]))
+    x = tensor.vector('x')
+    cost = tensor.sum(tensor.dot(x, W) ** 2)
+
+    algorithm = GradientDescent(cost=cost, params=[W])
+    algorithm.initialize()
+    assert_raises(ValueError, algorithm.process_batch, dict())
+    assert_raises(ValueError, algorithm.process_batch,
+                  dict(y=numpy.ones(2, dtype=floatX)))
+    assert_raises(ValueError, algorithm.process_batch,
+                  dict(x=numpy.ones(2, dtype=floatX),
+                       y=numpy.ones(2, dtype=floatX)))
+    algorithm.process_batch(dict(x=numpy.zeros(2, dtype=floatX)))
+    assert algorithm._batch_getter is not None
+    assert_raises(ValueError, algorithm.process_batch,
+                  dict(y=numpy.ones(2, dtype=floatX)))
+    assert_allclose(W.get_value(), [[1, 2], [3, 4]])
+
+
+def test_gradient_descent_steps_per_call():
+    x = tensor.vector('x')
+    batches = numpy.arange(6, dtype=floatX).reshape(3, 2) / 10
+
+    values = []
+    for steps_per_call in [1, 3]:
+        W = shared_floatx(numpy.array([[1, 2], [3, 4]]))
+        cost = tensor.sum(tensor.dot(x, W) ** 2)
+        algorithm = GradientDescent(cost=cost, params=[W],
+                                    step_rule=Momentum(0.1, 0.5),
+                                    steps_per_call=steps_per_call)
+        algorithm.initialize()
+        if steps_per_call == 1:
+            for batch in batches:
+                algorithm.process_batch(dict(x=batch))
+        else:
+            algorithm.process_batch(dict(x=batches))
+            assert_raises(ValueError, algorithm.process_batch,
+                          dict(x=batches[:2]))
+        values.append(W.get_value())
+    assert_allclose(values[0], values[1], rtol=1e-5)
+
+
 def test_gradient_clipping():
     rule1 = GradientClipping(4)
     rule2 = GradientClipping(5)
@@ -51,3 +97,46 @@ def test_composite_rule():
     rule = CompositeRule([RuleWithUpdates([(1, 2)]),
                           RuleWithUpdates([(3, 4)])])
     assert rule.additional_updates() == [(1, 2), (3, 4)]
+
+
+def run_step_rule(step_rule, num_steps=2):
+    W = shared_floatx(numpy.array([1., -2.]))
+    cost = tensor.sum(W ** 2)
+    algorithm = GradientDescent(cost=cost, params=[W], step_rule=step_rule)
+    algorithm.initialize()
+    values = []
+    for _ in range(num_steps):
+        algorithm.process_batch(dict())
+        values.append(W.get_value())
+    return values
+
+
+def test_momentum():
+    first, second = run_step_rule(Momentum(0.1, 0.5))
+    # gradient 2 * W; velocity -0.1 * 2 * W
+    assert_allclose(first, [0.8, -1.6], rtol=1e-5)
+    assert_allclose(second, [0.8 - 0.1 - 0.16, -1.6 + 0.2 + 0.32],
+                    rtol=1e-5)
+
+
+def test_adagrad():
+    first, second = run_step_rule(AdaGrad(0.1, epsilon=0))
+    assert_allclose(first, [0.9, -1.9], rtol=1e-5)
+    assert_allclose(second, [0.9 - 0.1 * 1.8 / numpy.sqrt(4 + 1.8 ** 2),
+                             -1.9 + 0.1 * 3.8 / numpy.sqrt(16 + 3.8 ** 2)],
+                    rtol=1e-5)
+
+
+def test_rmsprop():
+    first, = run_step_rule(RMSProp(0.1, decay_rate=0.5, epsilon=0), 1)
+    assert_allclose(first, [1 - 0.1 * 2 / numpy.sqrt(2),
+                            -2 + 0.1 * 4 / numpy.sqrt(8)], rtol=1e-5)
+
+
+def test_adam():
+    step_rule = Adam(0.1, epsilon=0)
+    first, second = run_step_rule(step_rule)
+    # The first steps are of the size of the learning rate
+    assert_allclose(first, [0.9, -1.9], rtol=1e-5)
+    assert_allclose(step_rule.time.get_value(), 2)
+    assert len(step_rule.additional_updates()) == 3
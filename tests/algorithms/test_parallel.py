@@ -0,0 +1,105 @@
+import numpy
+from numpy.testing import assert_allclose, assert_raises
+
+import theano
+from theano import tensor
+
+from blocks.algorithms import GradientDescent, Momentum
+from blocks.algorithms.parallel import (DataParallelGradientDescent,
+                                        HogwildGradientDescent)
+from blocks.utils import shared_floatx
+
+floatX = theano.config.floatX
+
+
+def train(algorithm_class, batches, **kwargs):
+    x = tensor.matrix('x')
+    W = shared_floatx(numpy.array([[1, 2], [3, 4]]))
+    cost = tensor.sqr(tensor.dot(x, W)).sum(axis=1).mean()
+    algorithm = algorithm_class(cost=cost, params=[W],
+                                step_rule=Momentum(0.01, 0.5), **kwargs)
+    algorithm.initialize()
+    for batch in batches:
+        algorithm.process_batch(dict(x=batch))
+    return algorithm, W.get_value()
+
+
+def test_data_parallel_gradient_descent():
+    rng = numpy.random.RandomState(1)
+    batches = [rng.rand(size, 2).astype(floatX) for size in [7, 8, 2]]
+    _, expected = train(GradientDescent, batches)
+    algorithm, value = train(DataParallelGradientDescent, batches,
+                             num_workers=3)
+    try:
+        assert_allclose(value, expected, rtol=1e-5)
+        assert_raises(ValueError, algorithm.process_batch,
+                      dict(y=batches[0]))
+    finally:
+        algorithm.close()
+
+    # A worker killed by the system is reported, and the others stopped
+    algorithm, _ = train(DataParallelGradientDescent, batches[:1],
+                         num_workers=2)
+    algorithm._workers[0].terminate()
+    algorithm._workers[0].join()
+    workers = algorithm._workers
+    try:
+        assert_raises(RuntimeError, algorithm.process_batch,
+                      dict(x=batches[1]))
+    finally:
+        algorithm.close()
+    assert not any(worker.is_alive() for worker in workers)
+
+
+def test_hogwild_gradient_descent():
+    rng = numpy.random.RandomState(1)
+    batches = [rng.rand(size, 2).astype(floatX) for size in [7, 8, 2]]
+    _, expected = train(GradientDescent, batches)
+    # With a single worker the batches are processed in order
+    algorithm, _ = train(HogwildGradientDescent, batches, num_workers=1)
+    try:
+        algorithm.synchronize()
+        assert_allclose(algorithm.params[0].get_value(), expected,
+                        rtol=1e-5)
+        algorithm.process_batch(dict(x=batches[0][:, :1]))
+        assert_raises(RuntimeError, algorithm.synchronize)
+    finally:
+        algorithm.close()
+
+    # A worker killed by the system makes waiting fail instead of hang
+    algorithm, _ = train(HogwildGradientDescent, batches[:1], num_workers=1)
+    algorithm.synchronize()
+    algorithm._workers[0].terminate()
+    algorithm._workers[0].join()
+    try:
+        assert_raises(RuntimeError, algorithm.process_batch,
+                      dict(x=batches[1]))
+        assert_raises(RuntimeError, algorithm.synchronize)
+    finally:
+        assert_raises(RuntimeError, algorithm.close)
+    assert algorithm._workers is None
+
+
+def test_data_parallel_gradient_descent_batch_axis():
+    # Time-major data, laid out as (time, batch, features)
+    def train_time_major(algorithm_class, batches, **kwargs):
+        x = tensor.tensor3('x')
+        W = shared_floatx(numpy.array([[1, 2], [3, 4]]))
+        cost = tensor.sqr(tensor.dot(x, W)).sum(axis=(0, 2)).mean()
+        algorithm = algorithm_class(cost=cost, params=[W],
+                                    step_rule=Momentum(0.01, 0.5), **kwargs)
+        algorithm.initialize()
+        for batch in batches:
+            algorithm.process_batch(dict(x=batch))
+        return algorithm, W.get_value()
+
+    rng = numpy.random.RandomState(1)
+    batches = [rng.rand(3, size, 2).astype(floatX) for size in [7, 2]]
+    _, expected = train_time_major(GradientDescent, batches)
+    algorithm, value = train_time_major(
+        DataParallelGradientDescent, batches, num_workers=3,
+        batch_axis=dict(x=1))
+    try:
+        assert_allclose(value, expected, rtol=1e-5)
+    finally:
+        algorithm.close()
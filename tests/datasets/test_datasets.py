@@ -1,5 +1,7 @@
+import time
 from collections import OrderedDict
 
+import dill
 import numpy
 from six.moves import zip
 from nose.tools import assert_raises
@@ -7,10 +9,12 @@ from nose.tools import assert_raises
 from blocks.datasets import (
     CachedDataStream, ContainerDataset, DataStream,
     DataStreamMapping, BatchDataStream, PaddingDataStream,
-    DataStreamFilter)
+    DataStreamFilter, PrefetchingDataStream, ParallelDataStreamMapping,
+    BucketedBatchDataStream)
 from blocks.datasets.mnist import MNIST
-from blocks.datasets.schemes import (BatchSizeScheme, ConstantScheme,
-                                     SequentialScheme)
+from blocks.datasets.schemes import (BatchSizeScheme, BlockShuffledScheme,
+                                     ConstantScheme, SequentialScheme,
+                                     ShuffledScheme)
 
 
 def test_dataset():
@@ -41,6 +45,42 @@ def test_data_stream_mapping():
     assert list(wrapper2.get_epoch_iterator()) == list(zip(data, data_doubled))
 
 
+def double(data):
+    if data[0] < 0:
+        raise ValueError("negative")
+    return (2 * data[0],)
+
+
+def test_parallel_data_stream_mapping():
+    data = list(range(50))
+    stream = ContainerDataset(data).get_default_stream()
+    wrapper = ParallelDataStreamMapping(
+        stream, double, add_sources=("doubled",), num_workers=2,
+        chunk_size=3)
+    for _, epoch in zip(range(2), wrapper.iterate_epochs()):
+        assert list(epoch) == [(d, 2 * d) for d in data]
+
+    epoch = wrapper.get_epoch_iterator()
+    next(epoch)
+    epoch = dill.loads(dill.dumps(epoch))
+    assert list(epoch) == [(d, 2 * d) for d in data[1:]]
+
+    # Stopping the workers keeps the examples being processed
+    epoch = wrapper.get_epoch_iterator()
+    next(epoch)
+    wrapper.stop_workers()
+    assert wrapper._pool is None
+    assert list(epoch) == [(d, 2 * d) for d in data[1:]]
+    wrapper.close()
+
+    stream = ContainerDataset([1, -1]).get_default_stream()
+    wrapper = ParallelDataStreamMapping(stream, double, num_workers=2)
+    epoch = wrapper.get_epoch_iterator()
+    assert next(epoch) == (2,)
+    assert_raises(RuntimeError, next, epoch)
+    wrapper.close()
+
+
 def test_data_stream_filter():
     data = [1, 2, 3]
     data_filtered = [1, 3]
@@ -165,6 +205,36 @@ def test_batch_data_stream():
                     .get_epoch_iterator())) == 3
 
 
+def test_bucketed_batch_data_stream():
+    rng = numpy.random.RandomState(1)
+    sentences = [[i] * length
+                 for i, length in enumerate(rng.randint(1, 20, size=100))]
+    stream = ContainerDataset(sentences).get_default_stream()
+    batches = list(BucketedBatchDataStream(stream, ConstantScheme(10),
+                                           window_size=50)
+                   .get_epoch_iterator())
+    assert len(batches) == 10
+    returned = [list(sentence) for batch, in batches for sentence in batch]
+    assert sorted(returned) == sorted(sentences)
+    for batch, in batches:
+        assert len(batch) == 10
+        window = sentences[:50] if batch[0][0] < 50 else sentences[50:]
+        lengths = sorted(len(sentence) for sentence in window)
+        batch_lengths = sorted(len(sentence) for sentence in batch)
+        assert batch_lengths in [lengths[i:i + 10] for i in range(0, 50, 10)]
+
+    # The padded size of a batch is limited by `max_tokens`
+    batches = list(BucketedBatchDataStream(stream, ConstantScheme(10),
+                                           window_size=50, max_tokens=60)
+                   .get_epoch_iterator())
+    returned = [list(sentence) for batch, in batches for sentence in batch]
+    assert sorted(returned) == sorted(sentences)
+    for batch, in batches:
+        assert len(batch) <= 10
+        assert len(batch) == 1 or \
+            len(batch) * max(len(sentence) for sentence in batch) <= 60
+
+
 def test_padding_data_stream():
     # 1-D sequences
     stream = BatchDataStream(
@@ -203,3 +273,94 @@ def test_padding_data_stream():
         .get_default_stream(),
         ConstantScheme(2)))
     assert len(next(stream3.get_epoch_iterator())) == 4
+
+
+def test_prefetching_data_stream():
+    data = list(range(10))
+    stream = PrefetchingDataStream(
+        ContainerDataset(data).get_default_stream(), buffer_size=3)
+    for _, epoch in zip(range(2), stream.iterate_epochs()):
+        assert list(epoch) == list(zip(data))
+
+    # Pickling in the middle of an epoch keeps the prefetched examples
+    epoch = stream.get_epoch_iterator()
+    for _ in range(4):
+        next(epoch)
+    epoch = dill.loads(dill.dumps(epoch))
+    assert list(epoch) == list(zip(data[4:]))
+
+    # Errors of the wrapped stream are re-raised by the consumer
+    def fail_on_odd(data):
+        if data[0] % 2:
+            raise ValueError
+        return data
+    stream = PrefetchingDataStream(DataStreamMapping(
+        ContainerDataset(data).get_default_stream(), fail_on_odd))
+    epoch = stream.get_epoch_iterator()
+    assert next(epoch) == (0,)
+    assert_raises(ValueError, next, epoch)
+
+    # Including when the stream is pickled before the error is re-raised
+    epoch = stream.get_epoch_iterator()
+    assert next(epoch) == (0,)
+    while stream._error is None:
+        time.sleep(0.01)
+    epoch = dill.loads(dill.dumps(epoch))
+    assert_raises(RuntimeError, next, epoch)
+    assert_raises(StopIteration, next, epoch)
+
+    # Buffers overwritten by the next batch can't be prefetched
+    stream = PaddingDataStream(BatchDataStream(
+        ContainerDataset([[1, 2], [3]]).get_default_stream(),
+        ConstantScheme(1)), reuse_buffers=True)
+    assert_raises(ValueError, PrefetchingDataStream,
+                  DataStreamMapping(stream, lambda data: data))
+
+
+def test_padding_data_stream_buffers():
+    stream = BatchDataStream(
+        ContainerDataset([[1, 2, 3], [4], [5, 6], [7], [8]])
+        .get_default_stream(),
+        ConstantScheme(2))
+    mask_stream = PaddingDataStream(stream, length_multiple=4,
+                                    reuse_buffers=True)
+    it = mask_stream.get_epoch_iterator()
+    data, mask = next(it)
+    assert (data == numpy.array([[1, 2, 3, 0], [4, 0, 0, 0]])).all()
+    assert (mask == numpy.array([[1, 1, 1, 0], [1, 0, 0, 0]])).all()
+    first_data = data
+    data, mask = next(it)
+    assert numpy.may_share_memory(data, first_data)
+    assert (data == numpy.array([[5, 6, 0, 0], [7, 0, 0, 0]])).all()
+    assert (mask == numpy.array([[1, 1, 0, 0], [1, 0, 0, 0]])).all()
+    data, mask = next(it)
+    assert (data == numpy.array([[8, 0, 0, 0]])).all()
+    assert (mask == numpy.array([[1, 0, 0, 0]])).all()
+
+    # Nor by the other wrappers that keep several batches at once
+    assert_raises(ValueError, ParallelDataStreamMapping,
+                  mask_stream, lambda data: data)
+    assert_raises(ValueError, BucketedBatchDataStream,
+                  DataStreamMapping(mask_stream, lambda data: data),
+                  ConstantScheme(2))
+
+
+def test_shuffled_schemes():
+    for scheme in [ShuffledScheme(103, 10),
+                   BlockShuffledScheme(103, 10, block_size=25)]:
+        first_epoch = list(scheme.get_request_iterator())
+        assert [len(batch) for batch in first_epoch] == [10] * 10 + [3]
+        assert all(batch == sorted(batch) for batch in first_epoch)
+        assert sorted(sum(first_epoch, [])) == list(range(103))
+        assert sum(first_epoch, []) != list(range(103))
+        assert first_epoch != list(scheme.get_request_iterator())
+
+        iterator = scheme.get_request_iterator()
+        next(iterator)
+        resumed = dill.loads(dill.dumps(iterator))
+        assert list(resumed) == list(iterator)
+
+    # Blocks are read contiguously
+    batches = BlockShuffledScheme(100, 5, block_size=10).get_request_iterator()
+    for batch in batches:
+        assert batch[-1] - batch[0] < 10
@@ -29,3 +29,19 @@ def test_mnist():
     first_feature, = binary_mnist.get_data(request=[0])
     assert first_feature.dtype.kind == 'b'
     assert_raises(ValueError, MNIST, 'valid')
+
+
+def test_mnist_memmap():
+    mnist = MNIST('test', start=100, memmap=True)
+    assert mnist.features.dtype == numpy.dtype('uint8')
+    assert mnist.features.shape == (9900, 784)
+    features, targets = mnist.get_data(request=[0, 1])
+    assert features.dtype == numpy.dtype(theano.config.floatX)
+    in_memory = MNIST('test', start=100)
+    assert numpy.all(features == in_memory.get_data(request=[0, 1])[0])
+
+    binary_mnist = MNIST('test', binary=True, memmap=True)
+    features, _ = binary_mnist.get_data(request=range(10))
+    assert features.dtype.kind == 'b'
+    assert numpy.all(
+        features == MNIST('test', binary=True).get_data(request=range(10))[0])
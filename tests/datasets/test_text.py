@@ -1,7 +1,14 @@
+import os
+
 import dill
+import numpy
 from numpy.testing import assert_raises
 
-from blocks.datasets.text import TextFile
+from blocks.datasets import BatchDataStream, ContainerDataset, DataStream
+from blocks.datasets.schemes import ConstantScheme, ShuffledScheme
+from blocks.datasets.text import (BinaryTextFile, IndexedTextFile,
+                                  NGramStream, TextFile, binarize,
+                                  vocabulary_hash)
 from tests import temporary_files
 
 
@@ -42,3 +49,165 @@ def test_text():
     sentence = next(text_data.get_default_stream().get_epoch_iterator())[0]
     assert sentence[:3] == [27, 19, 7]
     assert sentence[-3:] == [2, 4, 28]
+
+
+@temporary_files('sentences.txt')
+def test_text_batches():
+    with open('sentences.txt', 'w') as f:
+        f.write("This is a sentence\n")
+        f.write("\n")
+        f.write("This another one\n")
+        f.write("~{unicode\n")
+        f.write("More sentences")
+    word_dictionary = {'<UNK>': 0, '</S>': 1, 'this': 2, 'a': 3, 'one': 4,
+                       '<S>': 5}
+    character_dictionary = dict([(chr(ord('a') + i), i) for i in range(26)]
+                                + [(' ', 26)] + [('<S>', 27)]
+                                + [('</S>', 28)] + [('<UNK>', 29)])
+    for dictionary, level in [(word_dictionary, 'word'),
+                              (character_dictionary, 'character')]:
+        for bos_token in [None, '<S>']:
+            text_data = TextFile(['sentences.txt'], dictionary,
+                                 bos_token=bos_token, level=level,
+                                 preprocess=str.lower)
+            sentences = [sentence for sentence, in
+                         text_data.get_default_stream().get_epoch_iterator()]
+            stream = DataStream(text_data, iteration_scheme=ConstantScheme(2))
+            batches = [batch for batch, in stream.get_epoch_iterator()]
+            assert [len(batch) for batch in batches] == [2, 2, 1]
+            assert all(sentence.dtype == numpy.int64
+                       for sentence in sum(batches, []))
+            assert [sentence.tolist()
+                    for sentence in sum(batches, [])] == sentences
+    assert_raises(ValueError, text_data.get_data, text_data.open(), [0])
+
+    # The character table is rebuilt rather than pickled
+    assert '_character_table' in vars(text_data)
+    unpickled = dill.loads(dill.dumps(text_data))
+    assert '_character_table' not in vars(unpickled)
+    assert (unpickled.character_table == text_data.character_table).all()
+
+
+@temporary_files('sentences1.txt', 'sentences2.txt',
+                 'sentences1.txt.index.npy', 'sentences2.txt.index.npy')
+def test_indexed_text():
+    with open('sentences1.txt', 'w') as f:
+        f.write("This is a sentence\n")
+        f.write("This another one\n")
+    with open('sentences2.txt', 'w') as f:
+        f.write("More sentences\n")
+        f.write("The last one")
+    dictionary = {'<UNK>': 0, '</S>': 1, 'this': 2, 'a': 3, 'one': 4}
+    files = ['sentences1.txt', 'sentences2.txt']
+    sentences = list(TextFile(files, dictionary, bos_token=None,
+                              preprocess=str.lower).get_default_stream()
+                     .get_epoch_iterator())
+    text_data = IndexedTextFile(files, dictionary, bos_token=None,
+                                preprocess=str.lower)
+    assert text_data.num_examples == 4
+    stream = text_data.get_default_stream()
+    assert list(stream.get_epoch_iterator()) == sentences
+    assert list(stream.get_epoch_iterator()) == sentences
+    assert os.path.isfile('sentences2.txt.index.npy')
+
+    # Resuming only requires the position
+    epoch = stream.get_epoch_iterator()
+    next(epoch)
+    epoch = dill.loads(dill.dumps(epoch))
+    assert list(epoch) == sentences[1:]
+
+    # Random access
+    state = text_data.open()
+    batch, = text_data.get_data(state, [3, 0])
+    assert [sentence.tolist() for sentence in batch] == [
+        sentences[3][0], sentences[0][0]]
+    assert_raises(ValueError, text_data.get_data, state, [4])
+    assert_raises(ValueError, text_data.get_data, state, 0)
+    text_data.close(state)
+
+    # Reading chunks of sentences in order
+    stream = DataStream(text_data, iteration_scheme=ConstantScheme(3))
+    batches = [batch for batch, in stream.get_epoch_iterator()]
+    assert [len(batch) for batch in batches] == [3, 1]
+    assert [sentence.tolist() for sentence in sum(batches, [])] == \
+        [sentence for sentence, in sentences]
+
+    stream = DataStream(dill.loads(dill.dumps(text_data)),
+                        iteration_scheme=ShuffledScheme(4, 3))
+    batches = [batch for batch, in stream.get_epoch_iterator()]
+    assert sorted(sentence.tolist() for sentence in sum(batches, [])) == \
+        sorted(sentence for sentence, in sentences)
+
+
+@temporary_files('sentences1.txt', 'sentences2.txt', 'corpus1.tokens.npy',
+                 'corpus1.offsets.npy', 'corpus1.json', 'corpus2.tokens.npy',
+                 'corpus2.offsets.npy', 'corpus2.json')
+def test_binary_text():
+    with open('sentences1.txt', 'w') as f:
+        f.write("This is a sentence\n")
+        f.write("This another one")
+    with open('sentences2.txt', 'w') as f:
+        f.write("More sentences\n")
+        f.write("The last one")
+    dictionary = {'<UNK>': 0, '</S>': 1, 'this': 2, 'a': 3, 'one': 4,
+                  '<S>': 5}
+    text_data = TextFile(['sentences1.txt', 'sentences2.txt'], dictionary,
+                         preprocess=str.lower)
+    sentences = list(text_data.get_default_stream().get_epoch_iterator())
+    prefixes = binarize(text_data, ['corpus1', 'corpus2'], chunk_size=1)
+    binary_data = BinaryTextFile(prefixes, dictionary)
+    assert binary_data.num_examples == 4
+    binary_sentences = list(
+        binary_data.get_default_stream().get_epoch_iterator())
+    assert [sentence.tolist() for sentence, in binary_sentences] == \
+        [sentence for sentence, in sentences]
+    assert binary_sentences[0][0].dtype == numpy.int32
+
+    batch, = binary_data.get_data(binary_data.open(), [2, 0])
+    assert [sentence.tolist() for sentence in batch] == [sentences[2][0],
+                                                         sentences[0][0]]
+    assert_raises(ValueError, BinaryTextFile, prefixes, {'<UNK>': 0})
+    batches = [batch for batch, in DataStream(
+        binary_data, iteration_scheme=ConstantScheme(3)).get_epoch_iterator()]
+    assert [len(batch) for batch in batches] == [3, 1]
+    assert [sentence.tolist() for sentence in sum(batches, [])] == \
+        [sentence for sentence, in sentences]
+
+    # Plugs into the other data streams unchanged
+    ngrams, text_ngrams = [
+        list(NGramStream(2, BatchDataStream(dataset.get_default_stream(),
+                                            ConstantScheme(2)),
+                         iteration_scheme=ConstantScheme(4))
+             .get_epoch_iterator())
+        for dataset in [binary_data, text_data]]
+    assert ngrams and len(ngrams) == len(text_ngrams)
+    for (features, targets), (text_features, text_targets) in zip(
+            ngrams, text_ngrams):
+        assert numpy.all(features == text_features)
+        assert numpy.all(targets == text_targets)
+
+    stream = dill.loads(dill.dumps(binary_data.get_default_stream()))
+    assert len(list(stream.get_epoch_iterator())) == 4
+
+
+def test_vocabulary_hash():
+    # Non-ASCII byte string tokens are hashed like their unicode version
+    hash_ = vocabulary_hash({u'caf\xe9': 1, u'<UNK>': 0})
+    assert vocabulary_hash({b'caf\xc3\xa9': 1, b'<UNK>': 0}) == hash_
+    assert vocabulary_hash({u'caf\xe9': 0, u'<UNK>': 1}) != hash_
+
+
+def test_ngram_stream():
+    sentences = [list(range(i, 2 * i)) for i in range(1, 8)]
+    stream = BatchDataStream(
+        ContainerDataset(sentences).get_default_stream(), ConstantScheme(3))
+    ngram_stream = NGramStream(3, stream, iteration_scheme=ConstantScheme(4))
+    features, targets = zip(*ngram_stream.get_epoch_iterator())
+    assert [len(batch) for batch in features] == [4, 4, 2]
+    expected = [(sentence[i:i + 3], sentence[i + 3])
+                for sentence in sentences for i in range(len(sentence) - 3)]
+    assert numpy.concatenate(features).tolist() == [
+        features for features, _ in expected]
+    assert numpy.concatenate(targets).tolist() == [
+        [target] for _, target in expected]
+    assert len(list(ngram_stream.get_epoch_iterator())) == 3
@@ -3,9 +3,11 @@ import theano
 from theano import tensor
 from numpy.testing import assert_allclose
 
-from blocks.datasets import ContainerDataset
+from blocks.datasets import BatchDataStream, ContainerDataset
+from blocks.datasets.schemes import ConstantScheme
 from blocks.extensions import TrainingExtension, FinishAfter
-from blocks.extensions.monitoring import TrainingDataMonitoring
+from blocks.extensions.monitoring import (
+    DataStreamMonitoring, MonitoringManager, TrainingDataMonitoring)
 from blocks.monitoring import aggregation
 from blocks.algorithms import GradientDescent, SteepestDescent
 from blocks.utils import shared_floatx, named_copy
@@ -68,3 +70,145 @@ def test_training_data_monitoring():
         main_loop.log[n_batches].train2_W_sum,
         sum([main_loop.log[i].train1_W_sum
              for i in range(1, n_batches + 1)]) / n_batches)
+
+
+def test_monitoring_manager():
+    features = [numpy.array(f, dtype=floatX)
+                for f in [[1, 2], [3, 4], [5, 6]]]
+    dataset = ContainerDataset(dict(features=features))
+    data_stream = dataset.get_default_stream()
+    epochs = []
+    get_epoch_iterator = data_stream.get_epoch_iterator
+
+    def counting_get_epoch_iterator(**kwargs):
+        epochs.append(kwargs)
+        return get_epoch_iterator(**kwargs)
+    data_stream.get_epoch_iterator = counting_get_epoch_iterator
+
+    x = tensor.vector('features')
+    W = shared_floatx([1, 1], name='W')
+    cost = named_copy((x * W).sum(), 'cost')
+    other_cost = named_copy((x * W).sum() + 1, 'cost')
+    norm = named_copy(tensor.sqr(W).sum(), 'norm')
+    cost_sum = named_copy(tensor.sqr(x * W).sum(), 'cost_sum')
+    cost_sum.tag.aggregation_scheme = aggregation.Mean(cost_sum, 1.0)
+
+    manager = MonitoringManager()
+    main_loop = MainLoop(
+        model=None, data_stream=dataset.get_default_stream(),
+        algorithm=GradientDescent(cost=cost, params=[W],
+                                  step_rule=SteepestDescent(0.001)),
+        extensions=[
+            FinishAfter(after_n_epochs=1),
+            DataStreamMonitoring([cost, norm], data_stream, "first",
+                                 manager=manager),
+            DataStreamMonitoring([other_cost, cost_sum], data_stream,
+                                 "second", manager=manager),
+            DataStreamMonitoring([cost], data_stream, "batch",
+                                 manager=manager, after_every_epoch=False,
+                                 before_first_epoch=False,
+                                 after_every_batch=True)])
+    main_loop.run()
+
+    # One pass before the first epoch, one for each batch and one after
+    # the epoch
+    assert len(epochs) == 5
+    row = main_loop.log[0]
+    assert_allclose(row.first_cost, 7.)
+    assert_allclose(row.first_norm, 2.)
+    assert_allclose(row.second_cost, 8.)
+    assert_allclose(row.second_cost_sum, 91. / 3)
+    assert_allclose(main_loop.log[3].batch_cost,
+                    main_loop.log[3].first_cost)
+
+
+def test_background_data_stream_monitoring():
+    features = [numpy.array(f, dtype=floatX)
+                for f in [[1, 2], [3, 4], [5, 6]]]
+    dataset = ContainerDataset(dict(features=features))
+
+    x = tensor.vector('features')
+    W = shared_floatx([1, 1], name='W')
+    cost = named_copy((x * W).sum(), 'cost')
+
+    main_loop = MainLoop(
+        model=None, data_stream=dataset.get_default_stream(),
+        algorithm=GradientDescent(cost=cost, params=[W],
+                                  step_rule=SteepestDescent(0.1)),
+        extensions=[
+            FinishAfter(after_n_epochs=2),
+            DataStreamMonitoring([cost], dataset.get_default_stream(),
+                                 "valid"),
+            DataStreamMonitoring([cost], dataset.get_default_stream(),
+                                 "background", background=True)])
+    main_loop.run()
+
+    for time in [0, 3, 6]:
+        assert_allclose(main_loop.log[time].background_cost,
+                        main_loop.log[time].valid_cost)
+
+
+def test_training_data_monitoring_steps_per_call():
+    features = [numpy.array(f, dtype=floatX)
+                for f in [[1, 2], [3, 4], [5, 6], [7, 8], [9, 10], [11, 12],
+                          [13, 14], [15, 16], [17, 18]]]
+    dataset = ContainerDataset(dict(features=features))
+
+    def run(steps_per_call, every_n_batches, after_n_batches):
+        x = tensor.vector('features')
+        W = shared_floatx([0, 0], name='W')
+        cost = named_copy(((x * W).sum() - 1) ** 2, 'cost')
+        data_stream = dataset.get_default_stream()
+        if steps_per_call > 1:
+            data_stream = BatchDataStream(
+                data_stream, ConstantScheme(steps_per_call), strict=True)
+        main_loop = MainLoop(
+            model=None, data_stream=data_stream,
+            algorithm=GradientDescent(cost=cost, params=[W],
+                                      step_rule=SteepestDescent(0.001),
+                                      steps_per_call=steps_per_call),
+            extensions=[
+                FinishAfter(after_n_batches=after_n_batches),
+                TrainingDataMonitoring([cost], "train",
+                                       every_n_batches=every_n_batches)])
+        main_loop.run()
+        return main_loop
+
+    expected = run(1, 3, 6)
+    # The conditions are fulfilled after the batches during which 2, 4
+    # and 6 iterations are reached, i.e. after the iterations 3 and 6
+    main_loop = run(3, 2, 4)
+    assert main_loop.status.iterations_done == 6
+    for time in [3, 6]:
+        assert_allclose(main_loop.log[time].train_cost,
+                        expected.log[time].train_cost, rtol=1e-5)
+
+
+def test_training_data_monitoring_quantile():
+    features = [numpy.array(f, dtype=floatX)
+                for f in [[1, 2], [3, 4], [5, 6], [7, 8], [9, 10]]]
+    dataset = ContainerDataset(dict(features=features))
+
+    x = tensor.vector('features')
+    W = shared_floatx([1, 1], name='W')
+    cost = named_copy((x * W).sum(), 'cost')
+    median = aggregation.median(named_copy(x.sum(), 'median'), 0, 20,
+                                bins=2000)
+    quantiles = aggregation.quantile(named_copy(x.sum(), 'quantiles'),
+                                     [0.2, 1], 0, 20, bins=2000)
+
+    main_loop = MainLoop(
+        model=None, data_stream=dataset.get_default_stream(),
+        algorithm=GradientDescent(cost=cost, params=[W],
+                                  step_rule=SteepestDescent(0.1)),
+        extensions=[
+            FinishAfter(after_n_epochs=2),
+            TrainingDataMonitoring([median, quantiles], "train",
+                                   after_every_epoch=True)])
+    main_loop.run()
+
+    # The histograms are reset after every epoch
+    for time in [5, 10]:
+        assert_allclose(main_loop.log[time].train_median, 11, atol=0.02)
+        assert_allclose(main_loop.log[time].train_quantiles, [3, 19],
+                        atol=0.02)
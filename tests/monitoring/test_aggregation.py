@@ -6,7 +6,10 @@ from theano import tensor
 from blocks import bricks
 from blocks.bricks.base import application
 from blocks.graph import ComputationGraph
-from blocks.monitoring.aggregation import mean
+from blocks.monitoring.aggregation import (mean, median, quantile, Histogram,
+                                           Maximum, Minimum, Quantile, Sum)
+from blocks.monitoring.evaluators import DatasetEvaluator
+from blocks.datasets import ContainerDataset
 from blocks.utils import shared_floatx
 
 
@@ -52,3 +55,54 @@ def test_param_monitor():
     accumulate(numpy.arange(4, dtype=theano.config.floatX).reshape(2, 2))
     accumulate(numpy.arange(4, 10, dtype=theano.config.floatX).reshape(3, 2))
     assert_allclose(aggregator.readout_variable.eval(), 4.5)
+
+
+def test_elementwise_aggregation():
+    X = tensor.matrix('X')
+    batches = [numpy.array([[1, 5], [2, -1]], dtype=theano.config.floatX),
+               numpy.array([[0, 3]], dtype=theano.config.floatX)]
+    schemes = [mean(X.sum(axis=0), X.shape[0]).tag.aggregation_scheme,
+               Sum(X.sum(axis=0)), Minimum(X.min(axis=0)),
+               Maximum(X.max(axis=0)), Histogram(X, 3, 0, 3)]
+    aggregators = [scheme.get_aggregator() for scheme in schemes]
+    initialize = theano.function(
+        [], updates=sum([aggregator.initialization_updates
+                         for aggregator in aggregators], []))
+    accumulate = theano.function(
+        [X], updates=sum([aggregator.accumulation_updates
+                          for aggregator in aggregators], []))
+    readout = theano.function(
+        [], [aggregator.readout_variable for aggregator in aggregators])
+
+    # The aggregators must be reset by the initialization
+    for _ in range(2):
+        initialize()
+        for batch in batches:
+            accumulate(batch)
+        means, sums, minimums, maximums, counts = readout()
+        assert_allclose(means, [1, 7 / 3.])
+        assert_allclose(sums, [3, 7])
+        assert_allclose(minimums, [0, -1])
+        assert_allclose(maximums, [2, 5])
+        assert_allclose(counts, [2, 1, 3])
+
+
+def test_quantile():
+    rng = numpy.random.RandomState(1)
+    data = rng.normal(size=(20, 50)).astype(theano.config.floatX)
+    data_stream = ContainerDataset(dict(X=list(data))).get_default_stream()
+
+    X = tensor.vector('X')
+    y = tensor.sqr(X)
+    y.name = 'y'
+    evaluator = DatasetEvaluator([quantile(y, [0.5, 0.95, 0.99], 0, 10),
+                                  median(X, -5, 5, bins=100)])
+    values = evaluator.evaluate(data_stream)
+    assert_allclose(values['y'],
+                    numpy.percentile(data ** 2, [50, 95, 99]), atol=0.01)
+    assert_allclose(values['X'], numpy.median(data), atol=0.1)
+
+    # Without any values the quantiles are not defined
+    aggregator = Quantile(X, 0.5, -5, 5).get_aggregator()
+    theano.function([], updates=aggregator.initialization_updates)()
+    assert numpy.isnan(aggregator.readout_variable.eval())
@@ -3,8 +3,10 @@ import theano
 from numpy.testing import assert_raises
 
 from blocks.graph import ComputationGraph
+from blocks.monitoring.aggregation import Maximum
 from blocks.monitoring.evaluators import DatasetEvaluator
-from blocks.datasets import ContainerDataset
+from blocks.datasets import BatchDataStream, ContainerDataset
+from blocks.datasets.schemes import ConstantScheme
 from tests.monitoring.test_aggregation import TestBrick
 
 floatX = theano.config.floatX
@@ -34,3 +36,23 @@ def test_dataset_evaluators():
         data_stream = ContainerDataset(dict(X2=data)).get_default_stream()
         validator.evaluate(data_stream)
     assert "Not all data sources" in ar.exception.args[0]
+
+
+def test_dataset_evaluators_ragged_batches():
+    X = theano.tensor.matrix('X')
+    per_example = (X ** 2).sum(axis=1)
+    per_example.name = 'per_example'
+    column_max = X.max(axis=0)
+    column_max.name = 'column_max'
+    column_max.tag.aggregation_scheme = Maximum(column_max)
+    validator = DatasetEvaluator([per_example, column_max])
+
+    data = list(numpy.arange(10, dtype=floatX).reshape(5, 2))
+    data_stream = BatchDataStream(
+        ContainerDataset(dict(X=data)).get_default_stream(),
+        ConstantScheme(2))
+
+    # The last batch has a single example
+    values = validator.evaluate(data_stream)
+    numpy.testing.assert_allclose(values['per_example'], [145.])
+    numpy.testing.assert_allclose(values['column_max'], [8., 9.])
@@ -0,0 +1,96 @@
+import os
+
+import numpy
+import theano
+from numpy.testing import assert_allclose, assert_raises
+from theano import tensor
+
+from blocks import compilation, config
+from blocks.utils import shared_floatx
+from tests import temporary_files
+
+floatX = theano.config.floatX
+
+
+def compile_update(name='W'):
+    x = tensor.vector('x')
+    W = shared_floatx([1, 2], name=name)
+    cost = tensor.dot(x, W)
+    return W, compilation.function([x], cost, updates=[(W, W + x)])
+
+
+@temporary_files("__function_cache")
+def test_function_cache():
+    config.function_cache_path = "__function_cache"
+    try:
+        W, function = compile_update()
+        assert len(os.listdir("__function_cache")) == 1
+        assert_allclose(function(numpy.ones(2, dtype=floatX)), 3)
+
+        # The same graph with other shared variables is loaded from the
+        # cache and uses the new shared variables
+        other_W, other_function = compile_update()
+        assert len(os.listdir("__function_cache")) == 1
+        assert_allclose(other_function(numpy.ones(2, dtype=floatX)), 3)
+        assert_allclose(other_W.get_value(), [2, 3])
+        assert_allclose(W.get_value(), [2, 3])
+
+        compile_update(name='V')
+        assert len(os.listdir("__function_cache")) == 2
+    finally:
+        config.function_cache_path = ''
+
+
+def test_graph_hash():
+    x = tensor.vector('x')
+    y = tensor.vector('y')
+    hashes = [compilation.graph_hash([x], [x + 1], []),
+              compilation.graph_hash([x], [x + 1], []),
+              compilation.graph_hash([x], [x + 2], []),
+              compilation.graph_hash([y], [y + 1], []),
+              compilation.graph_hash([x], [x + 1], [], name='f')]
+    assert hashes[0] == hashes[1]
+    assert len(set(hashes[1:])) == 4
+
+    # The attributes of the installed Theano's Elemwise, e.g. the inplace
+    # pattern, are part of the hash
+    add = tensor.Elemwise(theano.scalar.add)
+    add_inplace = tensor.Elemwise(theano.scalar.add, {0: 0})
+    assert (compilation.graph_hash([x, y], [add(x, y)], []) !=
+            compilation.graph_hash([x, y], [add_inplace(x, y)], []))
+
+
+class Factor(object):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Scale(theano.Op):
+    __props__ = ('factor',)
+
+    def __init__(self, factor):
+        self.factor = factor
+
+    def make_node(self, x):
+        x = tensor.as_tensor_variable(x)
+        return theano.Apply(self, [x], [x.type()])
+
+    def perform(self, node, inputs, outputs):
+        outputs[0][0] = inputs[0] * self.factor.value
+
+
+@temporary_files("__function_cache")
+def test_function_cache_unknown_attribute():
+    # Ops with attributes that can't be described are not cached
+    x = tensor.vector('x')
+    y = Scale(Factor(2))(x)
+    assert_raises(TypeError, compilation.graph_hash, [x], [y], [])
+    config.function_cache_path = "__function_cache"
+    try:
+        function = compilation.function([x], y)
+        assert_allclose(function(numpy.ones(2, dtype=floatX)), 2)
+        assert not os.path.exists("__function_cache")
+    finally:
+        config.function_cache_path = ''
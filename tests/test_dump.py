@@ -1,12 +1,17 @@
+import os
+
 import numpy
 import theano
+from numpy.testing import assert_raises
 
 from examples.sqrt import main as sqrt_example
 from blocks.bricks import MLP, Identity
 from blocks.dump import (
     load_parameter_values, save_parameter_values,
     extract_parameter_values, inject_parameter_values,
-    MainLoopDumpManager)
+    MainLoopDumpManager, ParameterCheckpointStore)
+from blocks.extensions.saveload import Dump, SAVED_TO
+from blocks.log import TrainingLog
 from tests import temporary_files, silence_printing
 
 floatX = theano.config.floatX
@@ -25,6 +30,34 @@ def test_save_load_parameter_values():
         assert numpy.all(old[1] == new[1])
 
 
+@temporary_files("__checkpoints")
+def test_parameter_checkpoint_store():
+    store = ParameterCheckpointStore("__checkpoints", chunk_size=400,
+                                     keep_last=2)
+    param_values = {"/a/b": numpy.random.rand(100, 10).astype(floatX),
+                    "/a/c": numpy.zeros(0), "/a/d": numpy.array(3.)}
+    path = store.save(param_values)
+    for name, value in load_parameter_values(path).items():
+        assert value.shape == param_values[name].shape
+        assert numpy.all(value == param_values[name])
+    num_chunks = len(os.listdir(store.chunks_folder))
+
+    # Only changed chunks are written
+    param_values["/a/b"][0, 0] = 5
+    store.save(param_values)
+    assert len(os.listdir(store.chunks_folder)) == num_chunks + 1
+
+    # Old checkpoints and their chunks are deleted
+    param_values["/a/b"][-1, -1] = 5
+    path = store.save(param_values)
+    assert len(store.checkpoints) == 2
+    assert len(os.listdir(store.chunks_folder)) == num_chunks + 1
+    assert numpy.all(load_parameter_values(path)["/a/b"] ==
+                     param_values["/a/b"])
+    assert numpy.all(load_parameter_values(store.checkpoints[0])["/a/b"][0] ==
+                     param_values["/a/b"][0])
+
+
 def test_extract_parameter_values():
     mlp = MLP([Identity(), Identity()], [10, 20, 10])
     mlp.allocate()
@@ -93,3 +126,75 @@ def test_main_loop_state_manager():
     main_loop3 = sqrt_example(folder, 33)
     assert main_loop3.log.status.iterations_done == 33
     assert_equal(main_loop2, main_loop3, check_log=False)
+
+
+@temporary_files("__snapshot_folder")
+def test_background_dump():
+    class FakeMainLoop(object):
+        def synchronize_algorithm(self):
+            pass
+    main_loop = FakeMainLoop()
+    main_loop.model = MLP([Identity()], [10, 10])
+    main_loop.model.allocate()
+    main_loop.iteration_state = (None, [1, 2, 3])
+    main_loop.log = TrainingLog()
+    W = main_loop.model.linear_transformations[0].params[0]
+    W.set_value(numpy.ones((10, 10), dtype=floatX))
+
+    dump = Dump("__snapshot_folder", background=True)
+    dump.main_loop = main_loop
+    dump.do("after_batch", None)
+    # The record is only made once the dump is written
+    assert main_loop.log.current_row[SAVED_TO] is None
+    # Changes made after the snapshot are not saved
+    W.set_value(2 * numpy.ones((10, 10), dtype=floatX))
+    main_loop.log.current_row['after'] = True
+    dump.saver.wait()
+
+    assert main_loop.log.current_row[SAVED_TO] == "__snapshot_folder"
+    parameters, iteration_state, log = dump.manager.load()
+    assert numpy.all(parameters['/mlp/linear_0.W'] == 1)
+    assert iteration_state == main_loop.iteration_state
+    assert log.current_row[SAVED_TO] == "__snapshot_folder"
+    assert not log.current_row['after']
+
+    # A failed dump is recorded on its own row and raised by the next one
+    def fail(snapshot):
+        raise IOError
+    dump.manager.dump_snapshot = fail
+    main_loop.log.status.iterations_done += 1
+    dump.do("after_batch", None)
+    main_loop.log.status.iterations_done += 1
+    assert_raises(IOError, dump.do, "after_batch", None)
+    assert main_loop.log.previous_row[SAVED_TO] is None
+    assert main_loop.log.current_row[SAVED_TO] is None
+    assert main_loop.log[0][SAVED_TO] == "__snapshot_folder"
+
+
+@temporary_files("__incremental_folder")
+def test_incremental_dump():
+    class FakeMainLoop(object):
+        def synchronize_algorithm(self):
+            pass
+    main_loop = FakeMainLoop()
+    main_loop.model = MLP([Identity()], [10, 10])
+    main_loop.model.allocate()
+    main_loop.iteration_state = (None, [1, 2, 3])
+    main_loop.log = TrainingLog()
+    W = main_loop.model.linear_transformations[0].params[0]
+
+    dump = Dump("__incremental_folder", incremental=True, keep_last=2)
+    dump.main_loop = main_loop
+    for i in range(3):
+        W.set_value(i * numpy.ones((10, 10), dtype=floatX))
+        dump.do("after_batch", None)
+    checkpoints = dump.manager.parameter_store.checkpoints
+    assert len(checkpoints) == 2
+    assert numpy.all(load_parameter_values(checkpoints[0])[
+        '/mlp/linear_0.W'] == 1)
+    assert numpy.all(dump.manager.load_parameters()['/mlp/linear_0.W'] == 2)
+
+    # Managers pickled before the incremental dumps existed still load
+    old_manager = MainLoopDumpManager.__new__(MainLoopDumpManager)
+    old_manager.__dict__ = {'folder': "__incremental_folder"}
+    assert numpy.all(old_manager.load_parameters()['/mlp/linear_0.W'] == 2)
@@ -1,8 +1,96 @@
-from blocks.log import TrainingLog
+import dill
+import numpy
+
+from blocks.log import CompactTrainingLog, SQLiteTrainingLog, TrainingLog
+from tests import temporary_files
 
 
 def test_training_log():
-    log = TrainingLog()
+    check_training_log(TrainingLog())
+
+
+@temporary_files('__log.sqlite')
+def test_sqlite_training_log():
+    check_training_log(SQLiteTrainingLog('__log.sqlite', hot_window=0))
+
+    log = SQLiteTrainingLog('__log.sqlite', hot_window=2)
+    for i in range(10):
+        log[i].cost = numpy.float32(i) / 2
+        log[i].pair = (i, [i])
+        log[i].text = str(i)
+    assert sorted(log._hot) == [5, 6, 7, 8, 9]
+    assert log[3].cost == 1.5
+    assert log[3].pair == (3, [3])
+    assert log[3].text == '3'
+    for time in [3, 8]:
+        assert dict(list(log[time])) == {
+            'cost': time / 2., 'pair': (time, [time]), 'text': str(time)}
+    assert log.fetch_records('cost', 3, 6) == [(3, 1.5), (4, 2.), (5, 2.5)]
+    assert len(log.fetch_records('text')) == 10
+
+    # Records written after pickling are hidden when unpickling, and
+    # deleted when truncating
+    pickled = dill.dumps(log)
+    log[12].cost = 6
+    log.flush()
+    old_log = dill.loads(pickled)
+    assert old_log[12].cost is None
+    assert old_log.fetch_records('cost', 10, 20) == []
+    assert log[12].cost == 6
+    assert log.fetch_records('cost', 10, 20) == [(12, 6)]
+    log = old_log
+    log.truncate()
+    log[12].text = '12'
+    assert dict(list(log[12])) == {'text': '12'}
+    log[1].cost = 7
+    assert log[1].cost == 7
+    df = log.to_dataframe()
+    assert list(df.cost)[:10] == [0., 7] + [i / 2. for i in range(2, 10)]
+    assert numpy.isnan(df.cost[12])
+
+
+def test_compact_training_log():
+    check_training_log(CompactTrainingLog())
+
+    log = CompactTrainingLog()
+    for i in range(0, 100, 3):
+        log[i].cost = numpy.array(i / 2., dtype='float32')
+        log[i].count = i
+        log[i].done = i % 2 == 0
+    log[50].count = 0.5
+    log[60].done = 'yes'
+    log[70].big = 2 ** 70
+    assert log._values['cost'].dtype == numpy.float64
+    assert log._values['count'].dtype == numpy.float64
+    assert 'done' not in log._values and 'big' not in log._values
+    assert log[3].cost == 1.5 and log[4].cost is None
+    assert log[50].count == 0.5
+    assert log[6].done is True and log[60].done == 'yes'
+    assert log[70].big == 2 ** 70
+    assert len([time for time, key, value in log if key == 'cost']) == 34
+
+    log = dill.loads(dill.dumps(log))
+    df = log.to_dataframe()
+    assert list(df.index) == sorted(set(range(0, 100, 3)) | {50, 70})
+    assert df.cost[3] == 1.5 and numpy.isnan(df.cost[50])
+    assert df.done[6] is True
+
+    # Sparse keys only take space for their records, and integers are
+    # written to float columns without converting them
+    log = CompactTrainingLog()
+    log[10 ** 7].cost = 1.
+    log[5].cost = 2
+    values = log._values['cost']
+    log[10 ** 6].cost = 3
+    assert log._values['cost'] is values
+    assert len(values) == 16
+    assert log._times['cost'][:3].tolist() == [5, 10 ** 6, 10 ** 7]
+    assert log[10 ** 6].cost == 3. and log[6].cost is None
+    log[5].cost = 4
+    assert log[5].cost == 4. and log._sizes['cost'] == 3
+
+
+def check_training_log(log):
 
     # test basic writing capabilities
     log[0].field = 45
@@ -25,3 +113,29 @@ def test_training_log():
     assert list(sorted(df.columns)) == ["field", "flag"]
     assert df.flag[1] is False
     assert df.field[0] == 45
+
+    # test adding several records at once
+    log.add_records(2, {'field': 3, 'flag': True, 'other': 'a'})
+    assert log[2].field == 3
+    assert log[2].other == 'a'
+    assert len(list(log)) == 4
+
+    # test array values, which can't be compared to the defaults with !=
+    log.set_default_value('vector', numpy.zeros(2))
+    log.add_records(3, {'vector': numpy.zeros(2)})
+    log[4].vector = numpy.ones(2)
+    log[5].matrix = numpy.ones((2, 2))
+    assert log[3].vector is not None and not log[3].vector.any()
+    assert numpy.all(log[4].vector == 1)
+    assert numpy.all(log[5].matrix == 1)
+
+    # test deleting records
+    log[6].field = 6
+    log[6].text = 'a'
+    log.delete_record(6, 'field')
+    log.delete_record(6, 'text')
+    log.delete_record(6, 'missing')
+    log.delete_record(4, 'vector')
+    assert log[6].field is None and log[6].text is None
+    assert not log[4].vector.any()
+    assert log[2].field == 3
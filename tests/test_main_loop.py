@@ -4,7 +4,7 @@ import dill
 
 from blocks.main_loop import MainLoop
 from blocks.datasets import ContainerDataset
-from blocks.extensions import FinishAfter
+from blocks.extensions import FinishAfter, TrainingExtension
 from blocks.utils import unpack
 
 
@@ -58,6 +58,46 @@ def test_main_loop():
         assert main_loop.log[i].batch == dict(data=i + 1)
 
 
+class MockAsynchronousAlgorithm(MockAlgorithm):
+    """An algorithm that only processes the batches when synchronized."""
+    def __init__(self):
+        super(MockAsynchronousAlgorithm, self).__init__()
+        self.pending = []
+        self.processed = 0
+        self.closed = False
+
+    def process_batch(self, batch):
+        self.pending.append(batch)
+
+    def synchronize(self):
+        self.processed += len(self.pending)
+        self.pending = []
+
+    def close(self):
+        self.closed = True
+
+
+def test_main_loop_synchronization():
+
+    class CountProcessed(TrainingExtension):
+
+        def after_epoch(self):
+            self.main_loop.log.current_row.processed = (
+                self.main_loop.algorithm.processed)
+
+        def after_training(self):
+            self.after_epoch()
+
+    data_stream = ContainerDataset(range(10)).get_default_stream()
+    main_loop = MainLoop(
+        None, data_stream, MockAsynchronousAlgorithm(),
+        extensions=[FinishAfter(after_n_batches=14), CountProcessed()])
+    main_loop.run()
+    assert main_loop.log[10].processed == 10
+    assert main_loop.log[14].processed == 14
+    assert main_loop.algorithm.closed
+
+
 def test_training_resumption():
     def do_test(with_serialization):
         data_stream = ContainerDataset(range(10)).get_default_stream()